@@ -1,5 +1,9 @@
 import sys
-from classHolder import StructurePDB, singlePDB
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from classHolder import PDBtable
+from mmCIFFileManipulation import isMmCIFfile, readMmCIFtable,\
+    readMmCIFspaceGroup, readMmCIFunitCell
 
 
 def PDBtoList(pdbFileName='', printText=False):
@@ -7,31 +11,259 @@ def PDBtoList(pdbFileName='', printText=False):
     # this function inputs a pdb file name and returns an list
     # of pdb objects, organised following the StructurePDB class
 
-    PDBarray = []
-    pdbin = open(pdbFileName, "r")
-    lines = pdbin.readlines()
     if printText:
         print('Reading PDB file and converting to list of objects')
-    for line in lines:
-        if ('ATOM' in str(line[0:6])) or ('HETATM' in str(line[0:6])):
-            y = singlePDB(StructurePDB)
-            y.atomnum = int(line[6:11].strip())
-            y.atomtype = str(line[12:16].strip())
-            y.basetype = str(line[17:20].strip())
-            y.chaintype = str(line[21])
-            y.residuenum = str(line[22:27].strip())
-            y.X_coord = float(line[30:38].strip())
-            y.Y_coord = float(line[38:46].strip())
-            y.Z_coord = float(line[46:54].strip())
-            y.Occupancy = str(line[54:60].strip())
-            y.Bfactor = float(line[60:66].strip())
-            y.atomID = str(line[76:78].strip())
-            y.atomOrHetatm = str(line[0:6].strip())
-            PDBarray.append(y)
+
+    return readPDBtable(pdbFileName=pdbFileName).getAtoms()
+
+
+def readPDBtable(pdbFileName=''):
+
+    # read the ATOM/HETATM records of a pdb file into typed columns (see
+    # classHolder.PDBtable). The whole file is read at once, and each
+    # fixed-width field is parsed for all records together. Fields are
+    # interpreted as for singlePDB attributes (e.g. residue numbers and
+    # occupancies are held as strings). mmCIF files are read through
+    # mmCIFFileManipulation.readMmCIFtable
+
+    if isMmCIFfile(pdbFileName):
+        return readMmCIFtable(fileName=pdbFileName)
+
+    with open(pdbFileName, 'rb') as pdbin:
+        buf = np.frombuffer(pdbin.read(), dtype=np.uint8)
+
+    # start and length of each line (excluding any carriage return)
+    ends = np.flatnonzero(buf == ord('\n'))
+    if len(buf) > 0 and buf[-1] != ord('\n'):
+        ends = np.append(ends, len(buf))
+    starts = np.concatenate(([0], ends[:-1] + 1)).astype(np.int64)
+    lengths = ends - starts
+    hasCR = (lengths > 0) & (buf[np.maximum(ends - 1, 0)] == ord('\r'))
+    lengths -= hasCR
+
+    # keep records with 'ATOM' or 'HETATM' within the first 6 characters
+    records = fixedWidthRecords(buf, starts, lengths)
+    isAtom = fieldAsBytes(records[:, :6]) == b'HETATM'
+    for i in range(3):
+        isAtom |= fieldAsBytes(records[:, i:i + 4]) == b'ATOM'
+    records = records[isAtom]
+
+    def field(first, last):
+        return np.ascontiguousarray(records[:, first:last])
+
+    columns = {'atomOrHetatm': parseStringField(field(0, 6)),
+               'atomnum': parseIntegerField(field(6, 11)),
+               'atomtype': parseStringField(field(12, 16)),
+               'basetype': parseStringField(field(17, 20)),
+               'chaintype': parseStringField(field(21, 22), strip=False),
+               'residuenum': parseStringField(field(22, 27)),
+               'X_coord': parseDecimalField(field(30, 38)),
+               'Y_coord': parseDecimalField(field(38, 46)),
+               'Z_coord': parseDecimalField(field(46, 54)),
+               'Occupancy': parseStringField(field(54, 60)),
+               'Bfactor': parseDecimalField(field(60, 66)),
+               'atomID': parseStringField(field(76, 78))}
+
+    return PDBtable(columns=columns)
+
+
+def readSpaceGroup(pdbFileName=''):
+
+    # the space group (without spaces) of a coordinate file, from the
+    # (last) CRYST1 record of a pdb file or the symmetry items of an
+    # mmCIF file. Returns None if not found
+
+    if isMmCIFfile(pdbFileName):
+        return readMmCIFspaceGroup(fileName=pdbFileName)
+
+    spaceGroup = None
+    with open(pdbFileName, 'r') as pdbin:
+        for line in pdbin:
+            if line.startswith('CRYST1'):
+                spaceGroup = line[55:66].replace(' ', '')
+
+    return spaceGroup
+
+
+def readUnitCell(pdbFileName=''):
+
+    # the unit cell (a, b, c, alpha, beta, gamma) of a coordinate file,
+    # from the (last) CRYST1 record of a pdb file or the cell items of an
+    # mmCIF file. Returns None if not found
+
+    if isMmCIFfile(pdbFileName):
+        return readMmCIFunitCell(fileName=pdbFileName)
+
+    cell = None
+    with open(pdbFileName, 'r') as pdbin:
+        for line in pdbin:
+            if line.startswith('CRYST1'):
+                try:
+                    cell = [float(line[i:j]) for i, j in
+                            ((6, 15), (15, 24), (24, 33), (33, 40),
+                             (40, 47), (47, 54))]
+                except ValueError:
+                    cell = None
+
+    return cell
+
+
+def renumberPDBFile(fileIn='', fileOut='', atomRange=None):
+
+    # renumber the atoms of a pdb file sequentially, copying all other
+    # lines unchanged. If 'atomRange' (first, last) is given, only the
+    # first-th to last-th atoms of the file (counting from 1) are kept,
+    # numbered from 1. Returns the number of atoms written
+
+    pdbin = open(fileIn, 'r')
+    pdbout = open(fileOut, 'w')
+
+    index, counter = 0, 0
+    for line in pdbin.readlines():
+        if ('ATOM' not in line[0:4] and 'HETATM' not in line[0:6]):
+            pdbout.write(line)
         else:
-            pass
+            index += 1
+            if atomRange is not None:
+                if not atomRange[0] <= index <= atomRange[1]:
+                    continue
+            counter += 1
+            pdbout.write(line[0:6])
+            new_atomnum = " "*(5-len(str(counter))) + str(counter)
+            pdbout.write(new_atomnum)
+            pdbout.write(line[11:80]+'\n')
     pdbin.close()
-    return PDBarray
+    pdbout.close()
+
+    return counter
+
+
+def fixedWidthRecords(buf=[], starts=[], lengths=[], width=80):
+
+    # the first 'width' characters of each line (as a lines x width uint8
+    # array), where lines are given by their start offset and length
+    # within buf. Characters beyond the end of a line are spaces. Each
+    # line is copied with a single indexed read of a strided view of buf
+
+    padded = np.concatenate((buf, np.full(width, ord(' '), dtype=np.uint8)))
+    windows = as_strided(padded, shape=(len(padded) - width + 1, width),
+                         strides=(padded.strides[0], padded.strides[0]))
+    records = windows[starts]
+    short = np.flatnonzero(lengths < width)
+    records[short] = np.where(
+        np.arange(width) < lengths[short, np.newaxis], records[short],
+        ord(' '))
+
+    return records
+
+
+def fieldAsBytes(chars=[]):
+
+    # a fixed-width field (an array of characters per line) as an array
+    # of byte strings
+
+    return np.ascontiguousarray(chars).view(
+        'S{}'.format(chars.shape[1])).ravel()
+
+
+def parseStringField(chars=[], strip=True):
+
+    # the (stripped) strings of a fixed-width field, from an array of
+    # characters per line. Each distinct value is decoded only once
+
+    width = chars.shape[1]
+    if len(chars) == 0:
+        return np.array([], dtype=str)
+
+    # identify distinct values by an integer code for each line
+    if width <= 8:
+        padded = np.zeros((len(chars), 8), dtype=np.uint8)
+        padded[:, :width] = chars
+        codes = padded.view(np.uint64).ravel()
+    else:
+        codes = fieldAsBytes(chars)
+    uniq, index, inverse = np.unique(codes, return_index=True,
+                                     return_inverse=True)
+
+    vals = [v.decode('ascii') for v in fieldAsBytes(chars[index]).tolist()]
+    if strip:
+        vals = [v.strip() for v in vals]
+
+    return np.array(vals, dtype=str)[inverse.ravel()]
+
+
+def parseNumberColumns(chars=[]):
+
+    # read the digits of a fixed-width numeric field (from an array of
+    # characters per line) as an integer for each line, one column at a
+    # time. Returns the integer value, the number of digits after any
+    # decimal point, the number of digits and whether a minus sign is
+    # present, together with whether each field consists only of digits,
+    # spaces, a decimal point and a minus sign
+
+    numLines = len(chars)
+    vals = np.zeros(numLines, dtype=np.int64)
+    decimals = np.zeros(numLines, dtype=np.int8)
+    numDigits = np.zeros(numLines, dtype=np.int8)
+    numPoints = np.zeros(numLines, dtype=np.int8)
+    numMinus = np.zeros(numLines, dtype=np.int8)
+    simple = np.ones(numLines, dtype=bool)
+
+    for j in range(chars.shape[1]):
+        col = chars[:, j]
+        digit = col - np.uint8(ord('0'))
+        isDigit = digit < 10
+        isPoint = col == ord('.')
+        isMinus = col == ord('-')
+        np.multiply(vals, 10, out=vals, where=isDigit)
+        np.add(vals, digit, out=vals, where=isDigit)
+        numDigits += isDigit
+        decimals += isDigit & (numPoints > 0)
+        numPoints += isPoint
+        numMinus += isMinus
+        simple &= isDigit | isPoint | isMinus | (col == ord(' '))
+
+    simple &= (numMinus <= 1) & (numPoints <= 1) & (numDigits > 0)
+
+    return vals, decimals, numDigits, numPoints, numMinus > 0, simple
+
+
+def parseIntegerField(chars=[]):
+
+    # the integers of a fixed-width field, from an array of characters
+    # per line. Fields of other than an optional sign and digits are
+    # parsed individually (raising ValueError if not an integer)
+
+    vals, decimals, numDigits, numPoints, negative, simple = \
+        parseNumberColumns(chars)
+    simple &= (numPoints == 0) & (numDigits < 19)
+    vals = np.where(negative, -vals, vals)
+
+    for i in np.flatnonzero(~simple):
+        vals[i] = int(bytes(bytearray(chars[i])).strip())
+
+    return vals
+
+
+def parseDecimalField(chars=[]):
+
+    # the floats of a fixed-width decimal field, from an array of
+    # characters per line. The digits are read as an integer, which is
+    # then divided by the power of ten given by the decimal point
+    # position. This is exact (as float() of the field) while the
+    # integer has fewer than 16 digits. Other fields are parsed
+    # individually (raising ValueError if not a number)
+
+    vals, decimals, numDigits, numPoints, negative, simple = \
+        parseNumberColumns(chars)
+    simple &= numDigits < 16
+    vals = vals/(10**decimals.astype(np.int64)).astype(np.float64)
+    vals = np.where(negative, -vals, vals)
+
+    for i in np.flatnonzero(~simple):
+        vals[i] = float(bytes(bytearray(chars[i])).strip())
+
+    return vals
 
 
 def writePDBline_DamSite(atom='', damValue=0, index=0, chain='A'):
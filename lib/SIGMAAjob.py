@@ -1,5 +1,6 @@
 from ccp4Job import ccp4Job, checkInputsExist, fillerLine
 from errors import error
+from PDBFileManipulation import readSpaceGroup
 
 
 class SIGMAAjob():
@@ -113,15 +114,14 @@ class SIGMAAjob():
                 fileIn, fileOut))
 
     def getSpaceGroup(self):
-        pdbin = open(self.inputPDB, 'r')
-        for line in pdbin.readlines():
-            if line.split()[0] == 'CRYST1':
-                self.spaceGroup = line[55:66].replace(' ', '')
-                self.runLog.writeToLog(
-                    'Retrieving space group from file: "{}"'.format(
-                        self.inputPDB))
-                self.runLog.writeToLog(
-                    'Space group determined to be {}'.format(self.spaceGroup))
+        spaceGroup = readSpaceGroup(pdbFileName=self.inputPDB)
+        if spaceGroup is not None:
+            self.spaceGroup = spaceGroup
+            self.runLog.writeToLog(
+                'Retrieving space group from file: "{}"'.format(
+                    self.inputPDB))
+            self.runLog.writeToLog(
+                'Space group determined to be {}'.format(self.spaceGroup))
         try:
             self.spaceGroup
         except AttributeError:
@@ -0,0 +1,127 @@
+from __future__ import division
+from scipy.spatial import cKDTree
+import numpy as np
+
+# a spatial index of atom positions, for finding the atoms near to given
+# points (all atoms within a distance range, or the k nearest atoms)
+# without computing the distance to every atom. The index is a k-d tree
+# over the atom coordinates, built once for a list of atoms and then
+# queried for many points at a time. Atoms are identified by their
+# position within the list from which the index was built.
+#
+# Atoms may also be given integer group labels (e.g. one label per
+# residue), such that atoms in the same group as a query point can be
+# excluded from the query results. The distances returned are
+# recomputed from the atom coordinates, and the distance limits applied
+# to these, such that the results match those of a search atom by atom
+
+# relative margin added to the search radius of the k-d tree, such that
+# no atom within the distance limit is missed through rounding
+searchRadiusMargin = 1e-9
+
+
+class atomNeighbourIndex(object):
+
+    # a k-d tree index of atom positions. See the module description
+
+    def __init__(self,
+                 coords=[], groups={}):
+
+        # the atom coordinates (as an atoms x 3 array)
+        self.coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+        self.numAtoms = len(self.coords)
+
+        # integer group labels of the atoms: {group type: per-atom array}
+        self.groups = {k: np.asarray(v) for k, v in groups.items()}
+
+        self.tree = cKDTree(self.coords) if self.numAtoms > 0 else None
+
+    def getDistances(self,
+                     point=[], inds=[]):
+
+        # the distances from a point to the atoms 'inds'
+
+        return np.sqrt(np.sum(np.square(self.coords[inds] - point), axis=1))
+
+    def getNotInGroup(self,
+                      inds=[], groupType=None, pointGroups=[]):
+
+        # whether each atom of 'inds' (an array with a row per query
+        # point) is outside the group of the corresponding query point.
+        # Nothing is excluded if no group type is given
+
+        if groupType is None:
+            return np.ones(np.shape(inds), dtype=bool)
+        pointGroups = np.asarray(pointGroups).reshape(
+            (-1,) + (1,)*(np.ndim(inds) - 1))
+
+        return self.groups[groupType][inds] != pointGroups
+
+    def withinDist(self,
+                   points=[], distLimMax=4, distLimMin=0, groupType=None,
+                   pointGroups=[]):
+
+        # for each query point, the atoms at a distance greater than
+        # 'distLimMin' and less than 'distLimMax'. If 'groupType' is given,
+        # atoms in the same group as the point ('pointGroups' giving the
+        # group label of each point) are excluded. Returns a list of
+        # (atom indices, distances) per point, with atoms in index order
+
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0))
+        if self.tree is None:
+            return [empty for p in points]
+
+        radius = distLimMax*(1 + searchRadiusMargin) + searchRadiusMargin
+        found = self.tree.query_ball_point(points, r=radius)
+
+        neighbours = []
+        for i, point in enumerate(points):
+            inds = np.sort(np.asarray(found[i], dtype=np.int64))
+            dists = self.getDistances(point=point, inds=inds)
+            keep = (dists < distLimMax) & (dists > distLimMin)
+            if groupType is not None:
+                keep &= self.getNotInGroup(
+                    inds=inds, groupType=groupType,
+                    pointGroups=[pointGroups[i]])
+            neighbours.append((inds[keep], dists[keep]))
+
+        return neighbours
+
+    def nearest(self,
+                points=[], k=1, groupType=None, pointGroups=[]):
+
+        # the 'k' nearest atoms to each query point, excluding atoms in
+        # the same group as the point if 'groupType' is given (see
+        # withinDist). Returns (points x k) arrays of atom indices and
+        # distances, ordered by distance. Where fewer than k atoms are
+        # found, indices are padded with -1 and distances with inf
+
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        inds = np.full((len(points), k), -1, dtype=np.int64)
+        dists = np.full((len(points), k), np.inf)
+        if self.tree is None or len(points) == 0:
+            return inds, dists
+
+        # more atoms are requested from the tree while too many of the
+        # nearest atoms are excluded by group
+        numQuery = min(k, self.numAtoms)
+        while True:
+            treeDists, treeInds = self.tree.query(points, k=numQuery)
+            treeInds = np.asarray(treeInds).reshape(len(points), numQuery)
+            valid = self.getNotInGroup(inds=treeInds, groupType=groupType,
+                                       pointGroups=pointGroups)
+            if (numQuery == self.numAtoms or
+                    np.all(np.count_nonzero(valid, axis=1) >= k)):
+                break
+            numQuery = min(2*numQuery, self.numAtoms)
+
+        # the first k valid atoms for each point (in distance order)
+        for i, point in enumerate(points):
+            pointInds = treeInds[i][valid[i]][:k]
+            pointDists = self.getDistances(point=point, inds=pointInds)
+            order = np.argsort(pointDists, kind='mergesort')
+            inds[i, :len(pointInds)] = pointInds[order]
+            dists[i, :len(pointInds)] = pointDists[order]
+
+        return inds, dists
@@ -0,0 +1,225 @@
+from __future__ import division
+from columnarFile import columnarFile, writeColumnarFile
+from classHolder import MapInfo
+from mapTools import mapTools
+from readMap import readMap
+from errors import error
+import os
+import numpy as np
+
+# SFALL atom-tagged maps hold 100*(atom number) (plus a remainder below
+# 100) as 4-byte floats, which represent integers exactly only up to
+# 2^24. Atom numbers above maxExactTagAtomNum therefore cannot be
+# recovered exactly from a single SFALL map. Larger models are instead
+# tagged in chunks of at most atomTagChunkSize atoms (each SFALL run
+# tagging with chunk-local atom numbers), and the chunks then merged.
+#
+# Each final atom-tagged map is also held in a sparse form alongside the
+# dense map (see sparseAtomMapName): the sorted linear indices of the
+# atom-tagged voxels, their int32 atom numbers and the map header
+# information, in the columnar file format of columnarFile.py. Reading
+# the sparse form scales with the number of model voxels rather than
+# with the volume of the map, and holds exact atom numbers for merged
+# chunk maps. Once all maps of a run have been made, the dense atom maps
+# can be removed, leaving only the sparse form (see removeDenseAtomMap)
+
+maxExactTagValue = 2**24
+maxExactTagAtomNum = maxExactTagValue//100 - 1
+
+# the chunk size is also within the 5-column pdb atom serial limit, such
+# that chunks can be written in either pdb or mmCIF format
+atomTagChunkSize = 99999
+
+# the MapInfo header attributes held within a sparse atom map
+mapInfoAttrs = ['type', 'nxyz', 'start', 'gridsamp', 'celldims', 'axis',
+                'density']
+
+
+def mapInfoHeader(rho=None):
+
+    # the header information of a map (excluding voxel values), in a JSON
+    # serialisable form for a columnar file header
+
+    return {'mapInfo': {a: getattr(rho, a) for a in mapInfoAttrs},
+            'symOps': getattr(rho, 'symOpsStr', []),
+            'exactTags': bool(getattr(rho, 'exactTags', False))}
+
+
+def mapInfoFromHeader(header={}):
+
+    # a MapInfo object (without voxel values) from the header
+    # information returned by mapInfoHeader
+
+    rho = MapInfo()
+    for attr, val in header['mapInfo'].items():
+        if isinstance(val, dict):
+            val = {str(k): v for k, v in val.items()}
+        setattr(rho, str(attr), val)
+    rho.symOpsStr = [[str(s) for s in symOp] for symOp in header['symOps']]
+    rho.exactTags = header['exactTags']
+
+    return rho
+
+
+def sparseAtomMapName(mapName=''):
+
+    # the sparse form of an atom-tagged map
+
+    return '{}_sparse.col'.format(mapName.rsplit('.map', 1)[0])
+
+
+def hasSparseAtomMap(mapName=''):
+
+    # whether a sparse form of an atom-tagged map exists, and was made
+    # from the current dense map (written no earlier than the dense map,
+    # and from a map of the same file size)
+
+    sparseName = sparseAtomMapName(mapName)
+    if not os.path.exists(sparseName):
+        return False
+    if not os.path.exists(mapName):
+        return True
+    if os.path.getmtime(sparseName) < os.path.getmtime(mapName):
+        return False
+    header = columnarFile(fileName=sparseName, mmap=False).header
+
+    return header['mapFileSize'] == os.path.getsize(mapName)
+
+
+def writeSparseAtomMap(mapName='', atomNums=None, log=''):
+
+    # write the sparse form of an atom-tagged map. The map header and
+    # atom-tagged voxels are read from the dense map. If given, the
+    # atom numbers are taken from 'atomNums' (an exact atom number for
+    # every voxel of the map) rather than from the map values
+
+    rho, atomInds = readMap(dirIn='', mapName=mapName, mapType='atom_map',
+                            log=log)
+    atomInds = np.asarray(atomInds, dtype=np.int64)
+    if atomNums is None:
+        atomNums = rho.vxls_val
+        exactTags = rho.density['max'] < maxExactTagValue
+    else:
+        atomNums = np.asarray(atomNums)[atomInds]
+        exactTags = True
+
+    rho.exactTags = exactTags
+    header = mapInfoHeader(rho)
+    header['mapFileSize'] = os.path.getsize(mapName)
+    # voxel indices are held as 4-byte integers where possible
+    indexType = np.uint32 if len(rho.vxls_val) == 0 or atomInds[-1] <\
+        np.iinfo(np.uint32).max else np.int64
+    columns = {'voxelIndices': atomInds.astype(indexType),
+               'atomNums': np.asarray(atomNums, dtype=np.int32)}
+
+    return writeColumnarFile(fileName=sparseAtomMapName(mapName),
+                             columns=columns, header=header)
+
+
+def removeDenseAtomMap(mapName='', log=''):
+
+    # remove a dense atom-tagged map once its sparse form has been
+    # written, since the metric calculation reads only the sparse form
+    # where present (see maps2DensMetrics.readAtomMap and
+    # mapSlabs.atomMapSlabReader). A map without a current sparse form
+    # is kept. Returns whether the map was removed
+
+    if not os.path.exists(mapName) or not hasSparseAtomMap(mapName):
+        return False
+    os.remove(mapName)
+
+    if log != '':
+        log.writeToLog(
+            str='Dense atom map removed (sparse form kept): {}'.format(
+                mapName))
+
+    return True
+
+
+def readSparseAtomMap(mapName='', log=''):
+
+    # read the sparse form of an atom-tagged map. Returns the map header
+    # information as a MapInfo object (with atom numbers as vxls_val)
+    # and the linear indices of the atom-tagged voxels, as for readMap
+
+    colFile = columnarFile(fileName=sparseAtomMapName(mapName), mmap=False)
+    rho = mapInfoFromHeader(colFile.header)
+    rho.vxls_val = colFile.getColumn('atomNums')
+    atomInds = colFile.getColumn('voxelIndices').astype(np.int64)
+
+    if log != '':
+        log.writeToLog(
+            str='Sparse atom map read: {}\n# atom-tagged voxels: {}'.format(
+                sparseAtomMapName(mapName), len(atomInds)))
+
+    return rho, atomInds
+
+
+def readMapVoxels(mapName=''):
+
+    # the header bytes and (float32) voxel values of a ccp4 map file
+
+    nxyz = mapTools(mapName=mapName).getMapSize()
+    filesize = os.path.getsize(mapName)
+    dataStart = filesize - 4*nxyz
+    with open(mapName, 'rb') as f:
+        header = f.read(dataStart)
+        voxels = np.fromfile(f, dtype=np.dtype('=f'), count=nxyz)
+
+    return header, voxels
+
+
+def writeMapVoxels(mapName='', header=b'', voxels=[]):
+
+    # write a ccp4 map file from header bytes (as read by readMapVoxels)
+    # and float32 voxel values. The min, max and mean values within the
+    # header are updated to match the voxel values
+
+    voxels = np.asarray(voxels, dtype=np.dtype('=f'))
+    stats = np.array([voxels.min(), voxels.max(), voxels.mean()],
+                     dtype=np.dtype('=f'))
+    header = header[:19*4] + stats.tobytes() + header[22*4:]
+    with open(mapName, 'wb') as f:
+        f.write(header)
+        voxels.tofile(f)
+
+
+def mergeAtomTagMaps(chunkMaps=[], chunkOffsets=[], mapOut='', log=''):
+
+    # merge atom-tagged maps, each made from a chunk of the atoms of a
+    # model, into a single atom-tagged map 'mapOut' together with its
+    # sparse form (holding exact atom numbers). 'chunkOffsets' gives the
+    # number to add to the chunk-local atom numbers of each map. The
+    # chunk maps must share the same grid. A voxel tagged within more
+    # than one chunk (at the boundary between atoms of different chunks)
+    # is assigned to the atom of the first such chunk. Returns the number
+    # of these boundary voxels
+
+    header, merged, numShared = None, None, 0
+    if max(chunkOffsets) + atomTagChunkSize > np.iinfo(np.int32).max:
+        error(text='Too many atoms to tag within a single int32 map',
+              log=log, type='error')
+
+    for chunkMap, offset in zip(chunkMaps, chunkOffsets):
+        chunkHeader, voxels = readMapVoxels(chunkMap)
+        if header is None:
+            header = chunkHeader
+            merged = np.zeros(len(voxels), dtype=np.int32)
+        elif len(voxels) != len(merged) or chunkHeader[:40] != header[:40]:
+            error(text='Atom-tagged maps for different chunks of the ' +
+                       'model do not share the same grid',
+                  log=log, type='error')
+
+        tags = (voxels // 100).astype(np.int64)
+        tagged = tags > 0
+        numShared += np.count_nonzero(tagged & (merged > 0))
+        tagged &= merged == 0
+        merged[tagged] = tags[tagged] + offset
+
+    # the float map values are only used to mark tagged voxels, and so
+    # do not need to represent the atom numbers exactly
+    writeMapVoxels(mapName=mapOut, header=header,
+                   voxels=merged.astype(np.float64)*100)
+    writeSparseAtomMap(mapName=mapOut, atomNums=merged, log=log)
+
+    return numShared
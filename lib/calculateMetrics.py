@@ -1,9 +1,15 @@
 from combinedAtomList import combinedAtomList
 from savevariables import retrieve_objectlist, save_objectlist
 from savevariables import saveGenericObject
-from PDBFileManipulation import PDBtoList
+from PDBFileManipulation import readPDBtable
+from classHolder import lazyAtomList
 from mapsToDensityMetrics import maps2DensMetrics
+from fileCache import fileCache
+from multiprocessing import Pool
+from logFile import bufferedLogFile
 from shutil import move
+from traceback import format_exc
+from copy import copy
 from errors import error
 from os import path, makedirs, remove
 
@@ -28,7 +34,10 @@ class calculateMetrics(object):
                  inclFCmets=True, densMapList=[], atomMapList=[],
                  pdbFileList=[], FcMapList=[],
                  normSet=[['', 'CA']], RIDLinputFile='untitled.txt',
-                 sepPDBperDataset=False):
+                 sepPDBperDataset=False, numProcesses=1, numDsetProcesses=1,
+                 memLimit=None, cacheSize=0, saveDsetFiles=False,
+                 saveDensSamples=False, batchDsets=False,
+                 streamMaps=False):
 
         # the input map file directory
         self.mapDir = mapDir
@@ -39,6 +48,33 @@ class calculateMetrics(object):
         # list of pkl files from map_processing
         self.pklFiles = pklFiles
 
+        # whether map_processing saves per-dataset atom lists to file
+        # (in pklFileDir). Otherwise these are only held in memory, and
+        # passed directly to post_processing
+        self.saveDsetFiles = saveDsetFiles
+
+        # whether map_processing keeps the density values at the
+        # atom-tagged voxels of every dataset in a density sample store
+        # (see densitySampleStore.py), within outputDataDir
+        self.saveDensSamples = saveDensSamples
+
+        # per-dataset lists of atom objects from map_processing (None if
+        # map_processing has not been run)
+        self.dsetPDBarrays = None
+
+        # whether map_processing calculates the metrics for all datasets
+        # together (see maps2DensMetrics.calcDensMetricsAllDatasets),
+        # where a single atom-tagged map is used for the whole series. The
+        # resulting list of atoms and dictionary of (atoms x datasets)
+        # metric arrays are then held in dsetMetrics (otherwise None)
+        self.batchDsets = batchDsets
+        self.dsetMetrics = None
+
+        # whether the metrics for all datasets are instead calculated with
+        # the maps read slab by slab, for maps too large to be held in
+        # memory (see maps2DensMetrics.calcDensMetricsStreamed)
+        self.streamMaps = streamMaps
+
         # the first dataset pdb code
         self.initialPDB = initialPDB
 
@@ -88,6 +124,19 @@ class calculateMetrics(object):
         # whether to use a separate pdb file for each datasets' atom map
         self.sepPDBperDataset = sepPDBperDataset
 
+        # number of processes to calculate per-atom metrics over
+        self.numProcesses = numProcesses
+
+        # number of later datasets to process concurrently, and the memory
+        # budget (in GB) shared between concurrently processed datasets
+        self.numDsetProcesses = numDsetProcesses
+        self.memLimit = memLimit
+
+        # size cap (in GB) of the cache of parsed input files kept in the
+        # RIDL-cache/ subdirectory of the map directory (see fileCache.py).
+        # No cache is used if 0 (the default)
+        self.cacheSize = cacheSize
+
         # if number of initial datasets given doesn't match
         # number of later datasets, assume same initial dataset
         # used for every later dataset (fix as first one given)
@@ -97,7 +146,7 @@ class calculateMetrics(object):
             initialPDBs = [initialPDBs[0]]*numLaterDsets
         l = []
         for pdb in initialPDBs:
-            if not pdb.endswith('.pdb'):
+            if not pdb.endswith(('.pdb', '.cif')):
                 l.append(pdb+'.pdb')
             else:
                 l.append(pdb)
@@ -198,20 +247,57 @@ class calculateMetrics(object):
         self.makeOutputDir(dirName=self.outputDataDir)
         self.makeOutputDir(dirName=self.pklFileDir)
 
-        pklFileNames = []
+        self.pklFiles = []
+        self.dsetPDBarrays = []
+
+        # parsed maps and pdb files are cached by file contents, such that
+        # unchanged inputs are not reparsed (e.g. on rerunning this step,
+        # or for identical maps across datasets)
+        if self.cacheSize > 0:
+            cache = fileCache(cacheDir=self.mapDir + 'RIDL-cache/',
+                              cacheSize=self.cacheSize, log=self.logFile)
+        else:
+            cache = None
 
         # set up the class to calculate metrics from maps
         maps2DensMets = maps2DensMetrics(
             filesIn=self.mapDir, filesOut=self.outputDataDir,
             pdbName=self.pdbFileList[0], atomTagMap=self.atomMapList[0],
-            logFile=self.logFile, calcFCmap=self.inclFCmets)
+            logFile=self.logFile, calcFCmap=self.inclFCmets,
+            numProcesses=self.numProcesses, cache=cache)
 
         # only add Fcalc map if it exists. Note, will cause error if
         # FcMapList = [] but inclFCmets = True
         if self.inclFCmets:
             maps2DensMets.FCmapIn = self.FcMapList[0]
 
-        for i in range(len(self.densMapList)):
+        if self.saveDensSamples:
+            self.setUpDensSampleStore(maps2DensMets=maps2DensMets)
+
+        if self.batchDsets or self.streamMaps:
+            if self.sepPDBperDataset or self.saveDsetFiles:
+                error(text='Metrics for all datasets can only be ' +
+                           'calculated together where a single ' +
+                           'atom-tagged map is used for the series, and ' +
+                           'per-dataset files are not saved. Processing ' +
+                           'each dataset in turn',
+                      log=self.logFile, type='warning')
+            else:
+                self.processDsetsTogether(maps2DensMets=maps2DensMets)
+                return
+
+        # when the same atom-tagged map is used throughout the series,
+        # datasets after the first depend only on the maps already read,
+        # and so can be processed concurrently
+        concurrent = (self.numDsetProcesses > 1 and
+                      not self.sepPDBperDataset and
+                      len(self.densMapList) > 2)
+        if concurrent:
+            numSerialDsets = 1
+        else:
+            numSerialDsets = len(self.densMapList)
+
+        for i in range(numSerialDsets):
 
             if i == 0:
                 mapsAlreadyRead = False
@@ -234,62 +320,192 @@ class calculateMetrics(object):
 
             maps2DensMets.maps2atmdensity(mapsAlreadyRead)
 
-            # save list of atom objects to a .pkl file
-            tag = self.densMapList[i].replace('_density.map', '')
+            self.keepDatasetPDBarray(PDBarray=maps2DensMets.PDBarray,
+                                     dsetIndex=i)
 
-            pklFileName = save_objectlist(maps2DensMets.PDBarray, tag)
+        if concurrent:
+            self.processLaterDsetsConcurrently(maps2DensMets=maps2DensMets)
 
-            move(pklFileName,
-                 '{}{}'.format(self.pklFileDir, pklFileName))
+    def setUpDensSampleStore(self,
+                             maps2DensMets=None):
 
-            pklFileNames.append(
-                '{}{}'.format(self.pklFileDir, pklFileName))
+        # keep the density values at the atom-tagged voxels of every
+        # dataset in a single density sample store. This requires the
+        # same atom-tagged map to be used throughout the series
 
-        self.pklFiles = pklFileNames
+        if self.sepPDBperDataset:
+            error(text='Density samples are not saved, since a separate ' +
+                       'atom-tagged map is used for each dataset',
+                  log=self.logFile, type='warning')
+            return
 
-    def post_processing(self):
+        storeName = '{}{}-densitySamples'.format(self.outputDataDir,
+                                                 self.seriesName)
+        maps2DensMets.densSampleStore = storeName
+        maps2DensMets.densSampleDsets = self.densMapList
+        maps2DensMets.densSampleDoses = self.doses
 
-        # group the per-atom density metrics for each dataset together
+        self.logFile.writeToLog(
+            str='Density values at atom-tagged voxels saved to: ' +
+                '{}.npy'.format(storeName))
+
+    def processDsetsTogether(self,
+                             maps2DensMets=None):
+
+        # calculate per-atom metrics for all datasets together, directly as
+        # (atoms x datasets) arrays for post_processing
 
         self.logFile.writeToLog(
-            str='Combining density metric information for each dataset ' +
-                'together within the damage series')
+            str='\nCalculating per-atom metrics for all ' +
+                '{} datasets together'.format(len(self.densMapList)))
+
+        if self.streamMaps:
+            if maps2DensMets.densSampleStore != '':
+                error(text='Density samples are not saved when maps are ' +
+                           'read slab by slab',
+                      log=self.logFile, type='warning')
+            metrics = maps2DensMets.calcDensMetricsStreamed(
+                densMapList=self.densMapList, memLimit=self.memLimit)
+        else:
+            metrics = maps2DensMets.calcDensMetricsAllDatasets(
+                densMapList=self.densMapList, memLimit=self.memLimit)
+        self.dsetMetrics = {'atoms': maps2DensMets.PDBarray,
+                            'metrics': metrics}
+
+    def processLaterDsetsConcurrently(self,
+                                      maps2DensMets=[]):
+
+        # calculate per-atom metrics for all datasets after the first
+        # across a pool of processes. Each worker starts from the state of
+        # 'maps2DensMets' after the first dataset (with the pdb file,
+        # atom-tagged map and Fcalc map already read) and returns only
+        # compact per-atom metric arrays. Results are collected and kept
+        # in dose order. The number of concurrent datasets is limited such
+        # that their estimated combined memory use is within memLimit,
+        # where each worker holds its own copy of that state along with
+        # the arrays of the dataset being processed
+
+        numDsets = len(self.densMapList) - 1
+        numConcurrent = min(self.numDsetProcesses, numDsets)
+
+        if self.memLimit is not None:
+            workerMem = (maps2DensMets.estimateStateMemory() +
+                         maps2DensMets.estimateDatasetMemory())
+            maxForMem = max(1, int(self.memLimit*1e9//workerMem))
+            numConcurrent = min(numConcurrent, maxForMem)
 
-        txt = 'Input pkl files for post processing chosen from input file:'
-        for file in self.pklFiles:
-            txt += '\n\t{}'.format(file.replace(self.outDir, ""))
-        self.logFile.writeToLog(str=txt)
+        self.logFile.writeToLog(
+            str='\nProcessing {} later datasets, '.format(numDsets) +
+                '{} at a time'.format(numConcurrent))
 
-        # next read in the pdb structure file as list of atom objects
-        initialPDBlist = PDBtoList(pdbFileName=self.get1stDsetPDB())
+        pool = Pool(processes=numConcurrent,
+                    initializer=initLaterDsetWorker,
+                    initargs=(maps2DensMets,))
+        try:
+            results = pool.imap(processLaterDset, self.densMapList[1:])
+            for i, (metrics, dsetLog, failure) in enumerate(results, 1):
 
-        # retrieve object lists of atoms for each damage set
-        ln = '\nReading in pkl files for higher dataset structures...'
-        self.logFile.writeToLog(str=ln)
+                self.logFile.writeToLog(
+                    str='\n---------------------------------\n' +
+                        'Higher dose dataset {} starts here'.format(i))
+                dsetLog.writeBufferTo(log=self.logFile)
+
+                if failure is not None:
+                    error(text='Processing of dataset ' +
+                               '{} failed '.format(self.densMapList[i]) +
+                               'within a worker process:\n{}'.format(failure),
+                          log=self.logFile, type='error')
+
+                maps2DensMets.setDensMetricArrays(metrics=metrics)
+                self.keepDatasetPDBarray(PDBarray=maps2DensMets.PDBarray,
+                                         dsetIndex=i)
+        except BaseException:
+            # stop the datasets still being processed
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
 
-        dList = []
-        for pkl_filename in self.pklFiles:
-            ln = 'Damage file number: {}'.format(len(dList)+1)
-            self.logFile.writeToLog(str=ln)
-            PDB_ret = retrieve_objectlist(
-                fileName=pkl_filename, logFile=self.logFile)
+    def keepDatasetPDBarray(self,
+                            PDBarray=[], dsetIndex=0):
 
-            # remove pkl file since no longer needed
-            remove(pkl_filename)
+        # keep the list of atom objects for a dataset for post_processing,
+        # also saving it to file if requested. The atoms are copied, since
+        # the same atom objects are reused for each dataset where a single
+        # atom-tagged map is used for the series
 
-            # add new retrieved damage set list to dList
-            dList.append(PDB_ret)
+        self.dsetPDBarrays.append([copy(atom) for atom in PDBarray])
+
+        if self.saveDsetFiles:
+            self.pklFiles.append(
+                self.saveDatasetPDBarray(PDBarray=PDBarray,
+                                         dsetIndex=dsetIndex))
+
+    def saveDatasetPDBarray(self,
+                            PDBarray=[], dsetIndex=0):
+
+        # save list of atom objects to a .pkl file and return its path
+
+        tag = self.densMapList[dsetIndex].replace('_density.map', '')
+
+        pklFileName = save_objectlist(PDBarray, tag)
+
+        move(pklFileName,
+             '{}{}'.format(self.pklFileDir, pklFileName))
+
+        return '{}{}'.format(self.pklFileDir, pklFileName)
+
+    def post_processing(self):
+
+        # group the per-atom density metrics for each dataset together
 
-        # create a list of atom objects with attributes as lists varying over
-        # dose range, only including atoms present in ALL damage datasets
         self.logFile.writeToLog(
-            str='New list of atoms over full dose range calculated...')
-        combinedAtoms = combinedAtomList(
-            datasetList=dList, numLigRegDsets=len(dList), doseList=self.doses,
-            initialPDBList=initialPDBlist, outputDir=self.outputDataDir,
-            seriesName=self.seriesName, inclFCmetrics=self.inclFCmets)
+            str='Combining density metric information for each dataset ' +
+                'together within the damage series')
+
+        # next read in the pdb structure file as list of atom objects
+        initialPDBlist = lazyAtomList(
+            table=readPDBtable(pdbFileName=self.get1stDsetPDB()))
+
+        if self.dsetMetrics is not None:
+            # use the (atoms x datasets) metric arrays calculated for all
+            # datasets together within map_processing
+            self.logFile.writeToLog(
+                str='New list of atoms over full dose range calculated...')
+            combinedAtoms = combinedAtomList(
+                datasetList=[], numLigRegDsets=len(self.densMapList),
+                doseList=self.doses, initialPDBList=initialPDBlist,
+                outputDir=self.outputDataDir, seriesName=self.seriesName,
+                inclFCmetrics=self.inclFCmets)
+            combinedAtoms.getMultiDoseAtomListFromMetrics(
+                logFile=self.logFile, **self.dsetMetrics)
+            self.dsetMetrics = None
+        else:
+            if self.dsetPDBarrays is not None:
+                # use the object lists of atoms for each damage set held
+                # from map_processing
+                self.logFile.writeToLog(
+                    str='Using per-atom metrics for each dataset directly ' +
+                        'from map processing')
+                dList = self.dsetPDBarrays
+                self.dsetPDBarrays = None
+            else:
+                dList = self.readDatasetPDBarrays()
 
-        combinedAtoms.getMultiDoseAtomList(logFile=self.logFile)
+            # create a list of atom objects with attributes as lists varying
+            # over dose range, only including atoms present in ALL damage
+            # datasets
+            self.logFile.writeToLog(
+                str='New list of atoms over full dose range calculated...')
+            combinedAtoms = combinedAtomList(
+                datasetList=dList, numLigRegDsets=len(dList),
+                doseList=self.doses, initialPDBList=initialPDBlist,
+                outputDir=self.outputDataDir, seriesName=self.seriesName,
+                inclFCmetrics=self.inclFCmets)
+
+            combinedAtoms.getMultiDoseAtomList(logFile=self.logFile)
 
         # calculate 'average' variant Dloss metrics
         combinedAtoms.calcAdditionalMetrics(newMetric='average')
@@ -334,6 +550,34 @@ class calculateMetrics(object):
             inputfile.write('\npklDataFile ' + self.pklDataFile)
             inputfile.close()
 
+    def readDatasetPDBarrays(self):
+
+        # retrieve object lists of atoms for each damage set from the pkl
+        # files chosen (e.g. those saved by an earlier map_processing run)
+
+        txt = 'Input pkl files for post processing chosen from input file:'
+        for file in self.pklFiles:
+            txt += '\n\t{}'.format(file.replace(self.outDir, ""))
+        self.logFile.writeToLog(str=txt)
+
+        ln = '\nReading in pkl files for higher dataset structures...'
+        self.logFile.writeToLog(str=ln)
+
+        dList = []
+        for pkl_filename in self.pklFiles:
+            ln = 'Damage file number: {}'.format(len(dList)+1)
+            self.logFile.writeToLog(str=ln)
+            PDB_ret = retrieve_objectlist(
+                fileName=pkl_filename, logFile=self.logFile)
+
+            # remove pkl file since no longer needed
+            remove(pkl_filename)
+
+            # add new retrieved damage set list to dList
+            dList.append(PDB_ret)
+
+        return dList
+
     def get1stDsetPDB(self):
 
         # retrieve name of first dataset pdb coordinate file.
@@ -353,3 +597,42 @@ class calculateMetrics(object):
         else:
             ln = '\n'
         self.logFile.writeToLog(str=ln)
+
+
+# the state of a later-dataset worker process, set by initLaterDsetWorker
+laterDsetState = {}
+
+
+def initLaterDsetWorker(maps2DensMets=None):
+
+    # process pool initializer. Store the maps2DensMetrics object (with the
+    # maps for the first dataset already read) for the worker lifetime
+
+    laterDsetState['maps2DensMets'] = maps2DensMets
+
+
+def processLaterDset(densMapName=''):
+
+    # calculate per-atom metrics for a later dataset within a worker
+    # process. Log output is buffered and returned along with the metric
+    # arrays, so that it can be written to the main log in dose order.
+    # Any failure (including a fatal error reported through errors.error,
+    # which exits) is caught and returned as a traceback in place of the
+    # metric arrays, since a worker that exits never returns its result
+    # and the pool would wait for it indefinitely. The failure is then
+    # reported as a fatal error by the main process
+
+    maps2DensMets = laterDsetState['maps2DensMets']
+    maps2DensMets.log = bufferedLogFile(fileName=maps2DensMets.log.logFile,
+                                        fileDir=maps2DensMets.log.fileDir)
+
+    # pool workers cannot start pools of their own
+    maps2DensMets.numProcesses = 1
+
+    try:
+        maps2DensMets.densMapIn = densMapName
+        maps2DensMets.maps2atmdensity(mapsAlreadyRead=True)
+    except BaseException:
+        return None, maps2DensMets.log, format_exc()
+
+    return maps2DensMets.getDensMetricArrays(), maps2DensMets.log, None
@@ -12,6 +12,25 @@ class StructurePDB(object):
 
     # A class for coordinate PDB file atom
 
+    # residue and atom type lists used to categorise atoms. These are
+    # shared by all atoms (rather than copied per atom)
+    nucAcidTypes = ['DA', 'DC', 'DG', 'DT',
+                    'A', 'C', 'G', 'U']
+
+    aminoAcids = ['ALA', 'ARG', 'ASN', 'ASP',
+                  'CYS', 'GLN', 'GLU', 'GLY',
+                  'HIS', 'ILE', 'LEU', 'LYS',
+                  'MET', 'PHE', 'PRO', 'SER',
+                  'THR', 'TRP', 'TYR', 'VAL']
+
+    mainchainProtein = ['N',  'CA', 'C', 'O']
+
+    mainchainNucAcid = ["P", "OP1", "O5'", "C5'",
+                        "C4'", "C3'", "O3'", "C2'",
+                        "C1'", "O4'", "OP2"]
+
+    phosphateNucAcid = ["P",  "OP1", "OP2"]
+
     def __init__(self,
                  atomnum=0, residuenum=0, atomtype="", basetype="",
                  chaintype='A', X_coord=0, Y_coord=0, Z_coord=0,
@@ -50,23 +69,6 @@ class StructurePDB(object):
         # whether atom is ATOM or HETATM in PDB file
         self.atomOrHetatm = atomOrHetatm
 
-        self.nucAcidTypes = ['DA', 'DC', 'DG', 'DT',
-                             'A', 'C', 'G', 'U']
-
-        self.aminoAcids = ['ALA', 'ARG', 'ASN', 'ASP',
-                           'CYS', 'GLN', 'GLU', 'GLY',
-                           'HIS', 'ILE', 'LEU', 'LYS',
-                           'MET', 'PHE', 'PRO', 'SER',
-                           'THR', 'TRP', 'TYR', 'VAL']
-
-        self.mainchainProtein = ['N',  'CA', 'C', 'O']
-
-        self.mainchainNucAcid = ["P", "OP1", "O5'", "C5'",
-                                 "C4'", "C3'", "O3'", "C2'",
-                                 "C1'", "O4'", "OP2"]
-
-        self.phosphateNucAcid = ["P",  "OP1", "OP2"]
-
     def protein_or_nucleicacid(self):
 
         # determine whether the current atom is
@@ -248,6 +250,125 @@ class singlePDB(StructurePDB):
         self.rangedensity = np.linalg.norm(self.maxdensity - self.mindensity)
 
 
+class PDBtable(object):
+
+    # the ATOM/HETATM records of a coordinate file held as typed columns,
+    # with one array per singlePDB attribute read from file (see
+    # PDBFileManipulation.readPDBtable). Atom objects are created from
+    # the columns only when required (see lazyAtomList)
+
+    columnAttrs = ['atomOrHetatm', 'atomnum', 'atomtype', 'basetype',
+                   'chaintype', 'residuenum', 'X_coord', 'Y_coord',
+                   'Z_coord', 'Occupancy', 'Bfactor', 'atomID']
+
+    def __init__(self,
+                 columns={}):
+
+        # dictionary of attribute name to per-atom array
+        self.columns = columns
+
+        self.numAtoms = len(columns['atomnum']) if columns else 0
+
+    def __len__(self):
+        return self.numAtoms
+
+    def take(self,
+             indices=[]):
+
+        # a new table holding the atoms at 'indices' (in that order)
+
+        return PDBtable(
+            columns={k: v[indices] for k, v in self.columns.items()})
+
+    def sortedBy(self,
+                 attr='atomnum'):
+
+        # a new table with atoms sorted by an attribute. The sort is
+        # stable, as for list.sort
+
+        return self.take(np.argsort(self.columns[attr], kind='mergesort'))
+
+    def getAtom(self,
+                index=0):
+
+        # a single atom as a singlePDB object
+
+        atom = singlePDB()
+        for attr, vals in self.columns.items():
+            setattr(atom, attr, vals[index].item())
+        return atom
+
+    def getAtoms(self):
+
+        # all atoms as a list of singlePDB objects
+
+        attrs = list(self.columns.keys())
+        colVals = [self.columns[attr].tolist() for attr in attrs]
+        atoms = []
+        for vals in zip(*colVals):
+            atom = singlePDB()
+            atom.__dict__.update(zip(attrs, vals))
+            atoms.append(atom)
+        return atoms
+
+
+class lazyAtomList(object):
+
+    # a list of singlePDB atoms backed by a PDBtable, in table order,
+    # where each atom object is only created on first access. Created
+    # atoms are kept, such that any attributes set on them persist.
+    # Iterating over (or sorting) the list creates all atoms
+
+    def __init__(self,
+                 table=None):
+
+        self.table = table
+
+        # the atom objects created so far (None if not yet created)
+        self.atoms = [None]*len(table)
+        self.numCreated = 0
+
+    def __len__(self):
+        return len(self.atoms)
+
+    def __getitem__(self, index):
+
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+        atom = self.atoms[index]
+        if atom is None:
+            atom = self.atoms[index] = self.table.getAtom(index)
+            self.numCreated += 1
+        return atom
+
+    def __iter__(self):
+        self.createAllAtoms()
+        return iter(self.atoms)
+
+    def createAllAtoms(self):
+
+        # create any atom objects not yet created
+
+        if self.numCreated == len(self):
+            return
+        allAtoms = self.table.getAtoms()
+        self.atoms = [a if a is not None else b
+                      for a, b in zip(self.atoms, allAtoms)]
+        self.numCreated = len(self)
+
+    def sort(self,
+             key=None, reverse=False):
+        self.createAllAtoms()
+        self.atoms.sort(key=key, reverse=reverse)
+
+    def __reduce__(self):
+        # pickled as a plain list, with all atoms created
+        return (list, (list(self),))
+
+
 class multiPDB(StructurePDB):
 
     # A subclass for a collection of multiple
@@ -316,6 +437,11 @@ class MapInfo:
                         'mean': meandensity}
         self.vxls_val = vxls_val
 
+        # whether atom-tagged map values are exact atom numbers (as read
+        # from the int32 atom numbers of a sparse atom map, see
+        # atomTagMap.py)
+        self.exactTags = False
+
         # specify params for conversion from fractional
         # unit cell indices to xyz coordinates here
         # so not computed for each individual voxel
@@ -70,10 +70,11 @@ class cleanUpFinalFiles():
     def removeAtomtaggedMap(self,
                             fName=''):
 
-        # remove file if it is an 'atom-tagged' map
+        # remove file if it is an 'atom-tagged' map (or the sparse form
+        # held alongside such a map, see atomTagMap.py)
 
         if not self.keepAtomTagMap:
-            if fName.endswith('_atoms.map'):
+            if fName.endswith(('_atoms.map', '_atoms_sparse.col')):
                 os.remove(self.mapDir+fName)
 
     def removeDensityMap(self,
@@ -0,0 +1,349 @@
+import json
+import numbers
+import os
+import struct
+import sys
+import numpy as np
+
+if sys.version_info[0] < 3:
+    import cPickle as pickle
+else:
+    import pickle
+
+# basestring is a builtin in python 2 only
+try:
+    basestring
+except NameError:
+    basestring = str
+
+# a simple columnar binary file format, used in place of pickle streams
+# to save lists of atoms and damage series metrics. A file consists of:
+#   - an 8 byte signature (fileSignature below)
+#   - the length of the header in bytes (little-endian uint64)
+#   - a JSON header, holding the name, dtype, shape and offset of each
+#     array, together with any other (JSON serialisable) information
+#   - the raw arrays themselves, each aligned to 'alignment' bytes
+# Arrays can then be memory-mapped directly from file on reading, rather
+# than being rebuilt object by object
+
+fileSignature = b'RIDLCOL1'
+alignment = 64
+
+
+def alignOffset(offset=0):
+
+    # round an offset up to the next multiple of the array alignment
+
+    return -(-offset//alignment)*alignment
+
+
+def isColumnarFile(fileName=''):
+
+    # whether a file is in the columnar format (rather than a pickle)
+
+    with open(fileName, 'rb') as f:
+        return f.read(len(fileSignature)) == fileSignature
+
+
+def writeColumnarFile(fileName='', columns={}, header={}):
+
+    # write a dictionary of named numpy arrays to a columnar file,
+    # together with a JSON serialisable 'header' dictionary
+
+    arrays = []
+    layout = {}
+    offset = 0
+    for name in sorted(columns):
+        arr = np.ascontiguousarray(columns[name])
+        if arr.dtype.hasobject:
+            raise TypeError('Column "{}" has object dtype'.format(name))
+        layout[name] = {'dtype': arr.dtype.str,
+                        'shape': list(arr.shape),
+                        'offset': offset}
+        arrays.append(arr)
+        offset = alignOffset(offset + arr.nbytes)
+
+    info = json.dumps({'header': header, 'columns': layout}).encode('utf-8')
+    dataStart = alignOffset(len(fileSignature) + 8 + len(info))
+
+    # an existing file is removed rather than overwritten in place, such
+    # that any columnarFile still reading from it is unaffected
+    if os.path.exists(fileName):
+        os.remove(fileName)
+
+    with open(fileName, 'wb') as f:
+        f.write(fileSignature)
+        f.write(struct.pack('<Q', len(info)))
+        f.write(info)
+        for name, arr in zip(sorted(columns), arrays):
+            f.write(b'\0'*(dataStart + layout[name]['offset'] - f.tell()))
+            arr.tofile(f)
+
+    return fileName
+
+
+class columnarFile(object):
+
+    # read access to a columnar file. The header is read on opening,
+    # while each array is only read (or memory-mapped) when first
+    # requested through getColumn. The file is held open until the
+    # columnarFile is garbage collected
+
+    def __init__(self,
+                 fileName='', mmap=True):
+
+        self.fileName = fileName
+
+        # whether arrays are memory-mapped (copy-on-write), rather than
+        # read into memory
+        self.mmap = mmap
+
+        self.file = open(fileName, 'rb')
+        if self.file.read(len(fileSignature)) != fileSignature:
+            self.file.close()
+            raise IOError('File {} is not in columnar format'.format(fileName))
+        infoLen = struct.unpack('<Q', self.file.read(8))[0]
+        info = json.loads(self.file.read(infoLen).decode('utf-8'))
+
+        # the JSON header stored with the arrays
+        self.header = info['header']
+
+        # dtype, shape and offset of each array
+        self.layout = info['columns']
+        self.dataStart = alignOffset(len(fileSignature) + 8 + infoLen)
+
+        # arrays read so far
+        self.columns = {}
+
+    def getColumnNames(self):
+        return sorted(self.layout)
+
+    def hasColumn(self,
+                  name=''):
+        return name in self.layout
+
+    def getColumn(self,
+                  name=''):
+
+        # a single named array. Raises KeyError if not in the file
+
+        if name not in self.columns:
+            layout = self.layout[name]
+            dtype = np.dtype(str(layout['dtype']))
+            shape = tuple(layout['shape'])
+            offset = self.dataStart + layout['offset']
+            count = int(np.prod(shape))
+            if self.mmap and count > 0:
+                arr = np.asarray(np.memmap(self.file, dtype=dtype, mode='c',
+                                           offset=offset, shape=shape))
+            else:
+                self.file.seek(offset)
+                arr = np.fromfile(self.file, dtype=dtype, count=count)
+                arr = arr.reshape(shape)
+            self.columns[name] = arr
+
+        return self.columns[name]
+
+
+class lazyColumns(dict):
+
+    # a dictionary of arrays held in a columnar file, where each array is
+    # only read from file on first access. Until then, an entry holds the
+    # name of its column within the file
+
+    def __init__(self,
+                 colFile=None, colNames={}):
+
+        dict.__init__(self, colNames)
+        self.colFile = colFile
+
+        # keys not yet read from file
+        self.unread = set(colNames)
+
+    def __getitem__(self, key):
+        if key in self.unread:
+            dict.__setitem__(self, key, self.colFile.getColumn(
+                dict.__getitem__(self, key)))
+            self.unread.discard(key)
+        return dict.__getitem__(self, key)
+
+    def __setitem__(self, key, val):
+        self.unread.discard(key)
+        dict.__setitem__(self, key, val)
+
+    def __delitem__(self, key):
+        self.unread.discard(key)
+        dict.__delitem__(self, key)
+
+    def __reduce__(self):
+        # pickled as a plain dictionary, with all arrays read
+        return (dict, (self.items(),))
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        if key in self:
+            val = self[key]
+            del self[key]
+            return val
+        return dict.pop(self, key, *default)
+
+    def items(self):
+        return [(k, self[k]) for k in self]
+
+    def values(self):
+        return [self[k] for k in self]
+
+    def copy(self):
+        return dict(self.items())
+
+
+def pickledColumn(obj=None):
+
+    # an object which has no columnar form, pickled into a byte array.
+    # Used only for information outside of the atom identities and
+    # metric values (e.g. half-dose fits)
+
+    return np.frombuffer(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL),
+                         dtype=np.uint8)
+
+
+def unpickleColumn(arr=[]):
+    return pickle.loads(np.asarray(arr, dtype=np.uint8).tobytes())
+
+
+def typeKind(valType=float):
+
+    # the column type for attribute values of type valType, or None if
+    # such values cannot be held in a typed column
+
+    if issubclass(valType, (bool, np.bool_)):
+        return 'bool'
+    if issubclass(valType, numbers.Integral):
+        return 'int'
+    if issubclass(valType, (float, np.floating)):
+        return 'float'
+    if issubclass(valType, basestring):
+        return 'str'
+    return None
+
+
+def atomsToColumns(atoms=[], columns={}, prefix='atoms', exclude=[]):
+
+    # add the attributes of a list of atom objects to 'columns', with one
+    # typed array per attribute. Attributes equal for all atoms (e.g. the
+    # StructurePDB residue type lists) are stored once in the returned
+    # group information, and anything else without a columnar form is
+    # pickled into a single byte array. Returns the group information,
+    # to be stored in the file header (see columnsToAtoms)
+
+    info = {'numAtoms': len(atoms), 'columns': [], 'constants': {}}
+
+    if len(atoms) == 0:
+        return info
+
+    cls = type(atoms[0])
+    if any(type(a) is not cls for a in atoms):
+        # mixed atom classes are not supported in columnar form
+        columns[prefix + '.pickled'] = pickledColumn(atoms)
+        info['pickledList'] = prefix + '.pickled'
+        return info
+
+    info['module'] = cls.__module__
+    info['class'] = cls.__name__
+
+    attrs = []
+    for attrNames in sorted(set(tuple(a.__dict__) for a in atoms)):
+        for attr in attrNames:
+            if attr not in exclude and attr not in attrs:
+                attrs.append(attr)
+
+    missing = object()
+    pickled = {}
+    for attr in attrs:
+        vals = [a.__dict__.get(attr, missing) for a in atoms]
+        kinds = set(typeKind(t) for t in set(map(type, vals)))
+        if len(kinds) == 1 and None not in kinds:
+            colName = '{}.{}'.format(prefix, attr)
+            columns[colName] = np.array(vals)
+            info['columns'].append([attr, colName])
+            continue
+        if isinstance(vals[0], list) and isJsonable(vals[0]):
+            if all(isinstance(v, list) and v == vals[0] for v in vals):
+                info['constants'][attr] = vals[0]
+                continue
+        pickled[attr] = {i: v for i, v in enumerate(vals) if v is not missing}
+
+    if pickled:
+        columns[prefix + '.pickled'] = pickledColumn(pickled)
+        info['pickled'] = prefix + '.pickled'
+
+    return info
+
+
+def columnsToAtoms(colFile=None, info={}):
+
+    # rebuild a list of atom objects from a columnar file, given the group
+    # information returned by atomsToColumns
+
+    if 'pickledList' in info:
+        return unpickleColumn(colFile.getColumn(info['pickledList']))
+
+    numAtoms = info['numAtoms']
+    if numAtoms == 0:
+        return []
+
+    cls = getattr(__import__(str(info['module'])), str(info['class']))
+    attrs = [str(attr) for attr, colName in info['columns']]
+    colVals = [colFile.getColumn(colName).tolist()
+               for attr, colName in info['columns']]
+    constants = {str(k): v for k, v in info['constants'].items()}
+
+    atoms = []
+    new = cls.__new__
+    for vals in zip(*colVals) if colVals else [()]*numAtoms:
+        atom = new(cls)
+        # each atom holds its own copy of each constant (list) attribute
+        atomDict = {k: copyJsonable(v) for k, v in constants.items()}
+        atomDict.update(zip(attrs, vals))
+        atom.__dict__ = atomDict
+        atoms.append(atom)
+
+    if 'pickled' in info:
+        for attr, vals in unpickleColumn(
+                colFile.getColumn(info['pickled'])).items():
+            for i, val in vals.items():
+                setattr(atoms[i], attr, val)
+
+    return atoms
+
+
+def copyJsonable(obj=None):
+
+    # a copy of a JSON serialisable object, with every list and dict
+    # within it copied
+
+    if isinstance(obj, list):
+        return [copyJsonable(v) for v in obj]
+    if isinstance(obj, dict):
+        return {k: copyJsonable(v) for k, v in obj.items()}
+
+    return obj
+
+
+def isJsonable(obj=None):
+
+    # whether an object can be stored within a JSON header unchanged
+
+    try:
+        return json.loads(json.dumps(obj)) == obj
+    except (TypeError, ValueError):
+        return False
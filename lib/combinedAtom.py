@@ -1,7 +1,54 @@
 from classHolder import StructurePDB
+from doseSeriesStore import doseSeriesStore, densMetricView
 from scipy import stats
 import numpy as np
 
+# metrics whose 'Standard' values are multiplied by -1 when stored (see
+# combinedAtom.getDensMetricInfo)
+needSignChange = ['loss', 'mean-negOnly', 'density_weighted_mean_negOnly',
+                  'density_weighted_loss']
+
+
+def linRegressRows(x=[], Y=[]):
+
+    # least-squares linear regression of each row of Y against x, in
+    # closed form for all rows at once. Returns per-row arrays of the
+    # slope, intercept, r value, two-sided p-value and slope standard
+    # error, following scipy.stats.linregress. Requires len(x) >= 2
+
+    TINY = 1.0e-20
+    x = np.asarray(x, dtype=np.float64)
+    Y = np.asarray(Y, dtype=np.float64)
+    n = len(x)
+
+    xmean = np.mean(x)
+    ymean = np.mean(Y, 1)
+    xm = x - xmean
+    ym = Y - ymean[:, np.newaxis]
+    ssxm = np.dot(xm, xm)/n
+    ssxym = np.dot(ym, xm)/n
+    ssym = np.einsum('ij,ij->i', ym, ym)/n
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = np.clip(ssxym/np.sqrt(ssxm*ssym), -1.0, 1.0)
+        r = np.where(ssym == 0, np.where(ssxym == 0, np.nan, 0.0), r)
+
+        slope = ssxym/ssxm
+        intercept = ymean - slope*xmean
+
+        if n == 2:
+            prob = np.where(Y[:, 0] == Y[:, 1], 1.0, 0.0)
+            slopeStderr = np.zeros(len(Y))
+            prob[np.isnan(slope)] = np.nan
+            slopeStderr[np.isnan(slope)] = np.nan
+        else:
+            df = n - 2
+            t = r*np.sqrt(df/((1.0 - r + TINY)*(1.0 + r + TINY)))
+            prob = 2*stats.t.sf(np.abs(t), df)
+            slopeStderr = np.sqrt((1 - r**2)*ssym/ssxm/df)
+
+    return slope, intercept, r, prob, slopeStderr
+
 
 class combinedAtom(StructurePDB):
 
@@ -18,8 +65,39 @@ class combinedAtom(StructurePDB):
                                            basetype, chaintype, X_coord,
                                            Y_coord, Z_coord, atomID)
 
-        # dictionary of density metrics to be filled
-        self.densMetric = {}
+        # the columnar store holding this atom's density metrics, and the
+        # row of the store for this atom. A standalone atom has its own
+        # single-row store, until it is moved into a store shared by a
+        # whole structure (see combinedAtomList)
+        self.store = doseSeriesStore(numAtoms=1)
+        self.row = 0
+
+    @property
+    def densMetric(self):
+
+        # dictionary of density metrics, of the form
+        # densMetric[metric][normType]['values'/'average'/'lin reg'/..].
+        # This is a view onto the atom's row of its store, such that
+        # per-dataset values are returned as slices of the store arrays
+
+        return densMetricView(store=self.store, row=self.row)
+
+    def __setstate__(self, state):
+
+        # atoms pickled before the columnar store was introduced hold
+        # densMetric as nested dictionaries. These are moved into a new
+        # single-row store
+
+        oldDensMetric = state.pop('densMetric', None)
+        self.__dict__.update(state)
+        if oldDensMetric is not None:
+            self.store = doseSeriesStore(numAtoms=1)
+            self.row = 0
+            for metric, normTypes in oldDensMetric.items():
+                for normType, entries in normTypes.items():
+                    for key, val in entries.items():
+                        self.store.setEntry(metric=metric, normType=normType,
+                                            row=0, key=key, val=val)
 
     def getPresentDatasets(self):
 
@@ -47,19 +125,11 @@ class combinedAtom(StructurePDB):
         # map peaks, however these are multipled by -1, such that
         # higher positive Dloss values indicate a larger negative
         # difference map peak
-        needSignChange = ['loss', 'mean-negOnly',
-                          'density_weighted_mean_negOnly',
-                          'density_weighted_loss']
         if metric in needSignChange and normType == 'Standard':
             values = list(-np.array(values))
 
-        try:
-            self.densMetric[metric]
-        except KeyError:
-            self.densMetric[metric] = {}
-
-        self.densMetric[metric][normType] = {}
-        self.densMetric[metric][normType]['values'] = values
+        self.store.setEntry(metric=metric, normType=normType, row=self.row,
+                            key='values', val=values)
 
     def calcAvMetric(self,
                      type='Standard', densMetric='loss'):
@@ -86,16 +156,17 @@ class combinedAtom(StructurePDB):
         if len(self.densMetric[metric][normType]['values']) == 0:
             return
 
-        self.densMetric[metric][normType]['lin reg'] = {}
         y = np.array(self.densMetric[metric][normType]['values'][0:len(x)])
         linRegRslts = stats.linregress(x, y)
 
         statsLbls = ['slope', 'intercept', 'r_squared', 'p_value', 'std_err']
 
+        linReg = {}
         for v1, v2 in zip(statsLbls, linRegRslts):
             if v1 == 'r_value':
                 v2 = v2**2
-            self.densMetric[metric][normType]['lin reg'][v1] = v2
+            linReg[v1] = v2
+        self.densMetric[metric][normType]['lin reg'] = linReg
 
     def calcNormalisedMetric(self,
                              normWeights=[], metric='loss', version=2,
@@ -199,13 +270,10 @@ class combinedAtom(StructurePDB):
         # is a net loss, gain or disordering of density associated
         # with a specific atom
 
-        self.getDensMetricInfo(metric='net', normType=normType, values=[])
-
-        for d in range(0, self.getNumDatasets()):
-            absMaxLoss = np.abs(self.densMetric['loss'][normType]['values'][d])
-            absMaxGain = np.abs(self.densMetric['gain'][normType]['values'][d])
-            metricVal = (absMaxLoss - absMaxGain)
-            self.densMetric['net'][normType]['values'].append(metricVal)
+        absMaxLoss = np.abs(self.densMetric['loss'][normType]['values'])
+        absMaxGain = np.abs(self.densMetric['gain'][normType]['values'])
+        self.getDensMetricInfo(metric='net', normType=normType,
+                               values=list(absMaxLoss - absMaxGain))
 
     def calcVectorWeightedMetric(self,
                                  metric='loss', normType='Standard',
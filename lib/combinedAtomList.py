@@ -1,12 +1,23 @@
 from __future__ import division
 import matplotlib.pyplot as plt
 from bioInfo import bioInfo
-from PDBFileManipulation import writePDBline_DamSite
+from PDBFileManipulation import writePDBline_DamSite, readSpaceGroup,\
+    readUnitCell
+from mmCIFFileManipulation import isMmCIFfile, writeMmCIFline_DamSite,\
+    readMmCIFitems, mmCIFdataBlock, mmCIFatomSiteHeader
 from matplotlib.gridspec import GridSpec
 from findMetricChange import findBchange
-from combinedAtom import combinedAtom
+from combinedAtom import combinedAtom, needSignChange, linRegressRows
+from atomNeighbours import atomNeighbourIndex
+from crystalContacts import crystalContacts, readSymOps
+from groupedStats import groupedStatsTable, groupedStatNames
+from doseSeriesStore import doseSeriesStore, consolidateStores, \
+    getDensMetricArray, storeToColumns, storeFromColumns
+from columnarFile import atomsToColumns, columnsToAtoms, pickledColumn, \
+    unpickleColumn, isJsonable
 from metricNormalisation import metricNormalisation
 from pandas import DataFrame
+from collections import deque
 import string
 from scipy.stats import ttest_ind, skew, kurtosis, mstats, ks_2samp
 from scipy.stats import linregress, f, anderson_ksamp
@@ -18,11 +29,21 @@ import sys
 import warnings
 warnings.filterwarnings('ignore')
 
+# intern is a builtin in python 2 only
+try:
+    intern
+except NameError:
+    from sys import intern
+
 
 class combinedAtomList(object):
 
     # class for list of atom objects defined by combinedAtom class
 
+    # the atom attributes by which atoms are selected in getAtom, in the
+    # order of the getAtom arguments (chain, resnum, restype, atomtype)
+    atomLookupAttrs = ['chaintype', 'residuenum', 'basetype', 'atomtype']
+
     def __init__(self,
                  datasetList=[], numLigRegDsets=1, doseList=[],
                  initialPDBList=[], outputDir='./', partialDatasets=True,
@@ -56,6 +77,9 @@ class combinedAtomList(object):
         if self.numLigRegDatasets == 0:
             self.numLigRegDatasets = len(self.datasetList[0].mindensity)
 
+        # the columnar store of density metrics shared by atomList
+        self.store = doseSeriesStore()
+
         bInfo = bioInfo()
         self.aminoAcids = bInfo.getAminoAcids()
 
@@ -93,56 +117,38 @@ class combinedAtomList(object):
         self.printOrWriteToLog(
             logFile=logFile, txt='Locating common atoms to ALL datasets...:')
 
-        singDimAttrs = ['atomnum', 'residuenum', 'atomtype', 'basetype',
-                        'chaintype', 'X_coord', 'Y_coord', 'Z_coord']
+        singDimAttrs, multiDimAttrs = self.getMultiDoseAttrs()
 
-        multiDimAttrs = ['Bfactor', 'Occupancy', 'meandensity', 'maxdensity',
-                         'mindensity', 'mediandensity', 'numvoxels',
-                         'stddensity', 'min90tile', 'max90tile', 'min95tile',
-                         'max95tile', 'meanNegOnly', 'meanPosOnly']
+        # index each later dataset by atom ID, such that each atom is
+        # located with a single hash lookup per dataset. Atoms sharing an
+        # ID within a dataset are matched in their order of appearance
+        laterDsetIndices = [self.indexDatasetByAtomID(dataset=dataset)
+                            for dataset in self.datasetList[1:]]
 
-        if self.inclFCderivedMetrics:
-            extraMetrics = ['fracOfMaxAtomDensAtMin', 'densityWeightedMean',
-                            'densityWeightedMin', 'densityWeightedMax',
-                            'densityWeightedMeanNegOnly',
-                            'densityWeightedMeanPosOnly']
-
-            for w in extraMetrics:
-                multiDimAttrs.append(w)
+        # per-dataset metric values for each included atom, in order
+        metricRows = []
 
         for atom in self.datasetList[0]:
             atm_counter = 1
             atomDict = {attr: getattr(atom, attr) for attr in singDimAttrs}.copy()
             atomDict.update({attr: [getattr(atom, attr)] for attr in multiDimAttrs})
-
-            # list of index of same atom in each later dataset
-            indexindataset = []
+            atomID = intern(atom.getAtomID())
 
             # check whether atom in all datasets:
-            for dataset in self.datasetList[1:]:
-                found = False
-                k = -1
-                for otheratom in dataset:
-                    k += 1
-                    if atom.getAtomID() == otheratom.getAtomID():
-                        atm_counter += 1
-                        for attr in multiDimAttrs:
-                            atomDict[attr].append(getattr(otheratom, attr))
-                        indexindataset.append(k)
-                        found = True
-                        break
-                if not found:
+            for dsetIndex in laterDsetIndices:
+                matches = dsetIndex.get(atomID)
+                if matches:
+                    # remove this located atom from the later dataset
+                    # index now that it has been located
+                    otheratom = matches.popleft()[1]
+                    atm_counter += 1
+                    for attr in multiDimAttrs:
+                        atomDict[attr].append(getattr(otheratom, attr))
+                else:
                     # if atom not in dataset, add dummy value
-                    indexindataset.append(-1)
                     for attr in multiDimAttrs:
                         atomDict[attr].append(np.nan)
 
-            # remove this located atom from the later dataset now
-            # that it has been located --> to make loop faster
-            for j in range(1, len(indexindataset)+1):
-                if indexindataset[j-1] != -1:
-                    self.datasetList[j].pop(indexindataset[j-1])
-
             if atm_counter != len(self.datasetList) and not self.partialDatasets:
                 self.printOrWriteToLog(
                     logFile=logFile,
@@ -153,15 +159,9 @@ class combinedAtomList(object):
 
             else:
                 newatom = combinedAtom()
-                for attr in singDimAttrs+multiDimAttrs:
-                    if attr[0] != '_':
-                        if not isinstance(atomDict[attr], list):
-                            setattr(newatom, attr, atomDict[attr])
-                        else:
-                            metName = self.findMetricName(attr)
-                            newatom.getDensMetricInfo(
-                                metric=metName, normType='Standard',
-                                values=atomDict[attr])
+                for attr in singDimAttrs:
+                    setattr(newatom, attr, atomDict[attr])
+                metricRows.append([atomDict[attr] for attr in multiDimAttrs])
 
                 if atm_counter != len(self.datasetList):
                     self.printOrWriteToLog(
@@ -182,9 +182,269 @@ class combinedAtomList(object):
                 txt='# atoms removed since not in all datasets: {}'.format(
                     numNotFoundAtoms))
 
+        # as before, only the atoms not located remain in later datasets
+        for dataset, dsetIndex in zip(self.datasetList[1:], laterDsetIndices):
+            remaining = sorted(
+                k for matches in dsetIndex.values() for k, a in matches)
+            dataset[:] = [dataset[k] for k in remaining]
+
+        metricVals = np.array(metricRows, dtype=np.float64).reshape(
+            len(PDBdoses), len(multiDimAttrs), len(self.datasetList))
+        self.setAtomListAndStore(
+            atoms=PDBdoses, attrs=multiDimAttrs,
+            metricVals={attr: metricVals[:, j, :]
+                        for j, attr in enumerate(multiDimAttrs)})
+
         self.printOrWriteToLog(logFile=logFile, txt='---> Finished!')
 
-        self.atomList = PDBdoses
+    def getMultiDoseAtomListFromMetrics(self,
+                                        atoms=[], metrics={}, logFile=''):
+
+        # as getMultiDoseAtomList, but for a series in which every dataset
+        # shares the same list of atoms (a single atom-tagged map used for
+        # the whole series), with the per-atom density metrics for every
+        # dataset already held as (atoms x datasets) arrays in 'metrics'
+        # (see maps2DensMetrics.calcDensMetricsAllDatasets). No matching
+        # of atoms between datasets is then required
+
+        self.printOrWriteToLog(
+            logFile=logFile,
+            txt='Using per-atom metrics for all datasets at once ' +
+                '(same atoms in every dataset)...')
+
+        singDimAttrs, multiDimAttrs = self.getMultiDoseAttrs()
+        numDsets = np.shape(metrics['meandensity'])[1]
+
+        PDBdoses = []
+        for atom in atoms:
+            newatom = combinedAtom()
+            for attr in singDimAttrs:
+                setattr(newatom, attr, getattr(atom, attr))
+            PDBdoses.append(newatom)
+
+        # the pdb file attributes are the same for every dataset
+        metricVals = {}
+        for attr in multiDimAttrs:
+            if attr in metrics:
+                metricVals[attr] = np.asarray(metrics[attr], dtype=np.float64)
+            else:
+                vals = np.array([getattr(atom, attr) for atom in atoms],
+                                dtype=np.float64)
+                metricVals[attr] = np.repeat(vals[:, np.newaxis], numDsets,
+                                             axis=1)
+
+        self.setAtomListAndStore(atoms=PDBdoses, attrs=multiDimAttrs,
+                                 metricVals=metricVals)
+
+        self.printOrWriteToLog(logFile=logFile, txt='---> Finished!')
+
+    def getMultiDoseAttrs(self):
+
+        # the atom attributes shared by all datasets, and the attributes
+        # (per-atom metrics) taking a value for each dataset
+
+        singDimAttrs = ['atomnum', 'residuenum', 'atomtype', 'basetype',
+                        'chaintype', 'X_coord', 'Y_coord', 'Z_coord']
+
+        multiDimAttrs = ['Bfactor', 'Occupancy', 'meandensity', 'maxdensity',
+                         'mindensity', 'mediandensity', 'numvoxels',
+                         'stddensity', 'min90tile', 'max90tile', 'min95tile',
+                         'max95tile', 'meanNegOnly', 'meanPosOnly']
+
+        if self.inclFCderivedMetrics:
+            extraMetrics = ['fracOfMaxAtomDensAtMin', 'densityWeightedMean',
+                            'densityWeightedMin', 'densityWeightedMax',
+                            'densityWeightedMeanNegOnly',
+                            'densityWeightedMeanPosOnly']
+
+            for w in extraMetrics:
+                multiDimAttrs.append(w)
+
+        return singDimAttrs, multiDimAttrs
+
+    def setAtomListAndStore(self,
+                            atoms=[], attrs=[], metricVals={}):
+
+        # hold the per-dataset metric values for all included atoms in a
+        # single columnar store, shared by every atom in the list.
+        # 'metricVals' gives an (atoms x datasets) array for each of the
+        # attributes 'attrs'
+
+        numDsets = metricVals[attrs[0]].shape[1]
+        store = doseSeriesStore(numAtoms=len(atoms), numDatasets=numDsets)
+        store.setIdentity(atoms=atoms)
+        for attr in attrs:
+            vals = metricVals[attr]
+            metName = self.findMetricName(attr)
+            if metName in needSignChange:
+                vals = -vals
+            store.setValues(metric=metName, normType='Standard', values=vals)
+        for i, atom in enumerate(atoms):
+            atom.store = store
+            atom.row = i
+
+        self.store = store
+        self.atomList = atoms
+        self.atomListChanged()
+
+    def __getstate__(self):
+
+        # any atom lists not yet read from a columnar file are read
+        # before the list is saved
+
+        for attr in list(self.__dict__.get('unreadAttrs', {})):
+            getattr(self, attr)
+        state = dict(self.__dict__)
+        for attr in ('unreadAttrs', 'atomListVersion', 'atomLookup',
+                     'neighbourIndex', 'presenceMask', 'groupIndex'):
+            state.pop(attr, None)
+
+        return state
+
+    def __setstate__(self, state):
+
+        # ensure atoms unpickled from an older format (with per-atom
+        # densMetric dictionaries) are moved into a single shared store
+
+        self.__dict__.update(state)
+        if 'atomList' in state:
+            self.store = consolidateStores(atoms=self.atomList)
+
+    def getColumnarState(self,
+                         columns={}):
+
+        # add the state of the list to 'columns' as typed arrays, for
+        # saving in columnar form (see savevariables.saveGenericObject).
+        # The atom lists and metric store are held as arrays, the weights
+        # of any metric normalisation as per-dataset arrays, and other
+        # attributes within the returned (JSON serialisable) header where
+        # possible. Anything else is pickled into a single byte array
+
+        state = {'attrs': {}}
+        pickled = {}
+        for attr, val in self.__getstate__().items():
+            if attr == 'store':
+                continue
+            elif attr == 'atomList':
+                self.store = consolidateStores(atoms=val)
+                state['store'] = storeToColumns(
+                    store=self.store, columns=columns, prefix='store')
+                state['atomList'] = atomsToColumns(
+                    atoms=val, columns=columns, prefix='atomList',
+                    exclude=['store'])
+            elif attr == 'initialPDBList':
+                state['initialPDBList'] = atomsToColumns(
+                    atoms=val, columns=columns, prefix='initialPDBList')
+            elif attr == 'datasetList':
+                state['datasetList'] = [
+                    atomsToColumns(atoms=dataset, columns=columns,
+                                   prefix='datasetList.{}'.format(i))
+                    for i, dataset in enumerate(val)]
+            elif attr == 'metricNormWeights':
+                weights = {'normaliseTo': val.normaliseTo, 'metrics': []}
+                for metric in val.meanweight:
+                    colName = 'metricNormWeights.{}'.format(
+                        len(weights['metrics']))
+                    columns[colName + '.mean'] = val.meanweight[metric]
+                    columns[colName + '.std'] = val.stdweight[metric]
+                    weights['metrics'].append([metric, colName])
+                state['metricNormWeights'] = weights
+            elif isJsonable(val):
+                state['attrs'][attr] = val
+            else:
+                pickled[attr] = val
+
+        if pickled:
+            columns['pickled'] = pickledColumn(pickled)
+            state['pickled'] = 'pickled'
+
+        return state
+
+    def setColumnarState(self,
+                         colFile=None, state={}):
+
+        # restore the state of the list from a columnar file, given the
+        # header returned by getColumnarState. Atom identities are read
+        # immediately, while metric values are read from file as each
+        # metric is first used (see doseSeriesStore.storeFromColumns),
+        # and the per-dataset atom lists only if used (see __getattr__)
+
+        for attr, val in state['attrs'].items():
+            setattr(self, str(attr), val)
+
+        if 'store' in state:
+            self.store = storeFromColumns(colFile=colFile,
+                                          info=state['store'])
+            self.atomList = columnsToAtoms(colFile=colFile,
+                                           info=state['atomList'])
+            for atom in self.atomList:
+                atom.store = self.store
+            self.atomListChanged()
+        else:
+            self.store = doseSeriesStore()
+
+        self.unreadAttrs = {}
+        for attr in ('initialPDBList', 'datasetList'):
+            if attr in state:
+                self.unreadAttrs[attr] = (colFile, state[attr])
+        if 'metricNormWeights' in state:
+            weights = state['metricNormWeights']
+            self.metricNormWeights = metricNormalisation(
+                self.atomList, normaliseTo=weights['normaliseTo'])
+            for metric, colName in weights['metrics']:
+                metric = str(metric)
+                self.metricNormWeights.meanweight[metric] = \
+                    colFile.getColumn(colName + '.mean')
+                self.metricNormWeights.stdweight[metric] = \
+                    colFile.getColumn(colName + '.std')
+        if 'pickled' in state:
+            self.__dict__.update(
+                unpickleColumn(colFile.getColumn(state['pickled'])))
+
+    def __getattr__(self, attr):
+
+        # read an atom list not yet read from a columnar file (see
+        # setColumnarState) on first access
+
+        unreadAttrs = self.__dict__.get('unreadAttrs', {})
+        if attr not in unreadAttrs:
+            raise AttributeError(attr)
+        colFile, info = unreadAttrs.pop(attr)
+        if attr == 'datasetList':
+            val = [columnsToAtoms(colFile=colFile, info=i) for i in info]
+        else:
+            val = columnsToAtoms(colFile=colFile, info=info)
+        setattr(self, attr, val)
+
+        return val
+
+    def getDensMetricArray(self,
+                           metric='loss', normType='Standard', atoms=None):
+
+        # per-dataset values of a metric as an atoms x datasets array,
+        # ordered as 'atoms' (atomList by default)
+
+        if atoms is None:
+            atoms = self.atomList
+
+        return getDensMetricArray(atoms=atoms, metric=metric,
+                                  normType=normType)
+
+    def indexDatasetByAtomID(self,
+                             dataset=[]):
+
+        # map each (interned) atom ID within a dataset to a queue of the
+        # (index, atom) pairs with that ID, in order of appearance
+
+        index = {}
+        for k, atom in enumerate(dataset):
+            atomID = intern(atom.getAtomID())
+            if atomID in index:
+                index[atomID].append((k, atom))
+            else:
+                index[atomID] = deque([(k, atom)])
+
+        return index
 
     def printOrWriteToLog(self, logFile='', txt=''):
 
@@ -237,7 +497,7 @@ class combinedAtomList(object):
 
         # get structure-wide average of selected density metric
 
-        densList = [atom.densMetric[densMet][normType]['values'] for atom in self.atomList]
+        densList = self.getDensMetricArray(metric=densMet, normType=normType)
         densMean = np.nanmean(densList, 0)
         densStd = np.nanstd(densList, 0)
         return densMean, densStd
@@ -245,15 +505,19 @@ class combinedAtomList(object):
     def getAtom(self, chain='', restype='', resnum='',
                 atomtype='', printOutput=False):
 
-        # get atom(s) matching specified description if found
+        # get atom(s) matching specified description if found. Atoms are
+        # found through an index of atomList by the specified attributes
+        # (see getAtomLookup), and returned in atomList order
+
+        vals = [chain, resnum, restype, atomtype]
+        attrs = tuple(attr for attr, val in zip(self.atomLookupAttrs, vals)
+                      if val != '')
+        if attrs == ():
+            foundAtoms = list(self.atomList)
+        else:
+            key = tuple(val for val in vals if val != '')
+            foundAtoms = list(self.getAtomLookup(attrs).get(key, []))
 
-        foundAtoms = []
-        for atom in self.atomList:
-            if atom.chaintype == chain or chain == '':
-                if atom.residuenum == resnum or resnum == '':
-                    if atom.basetype == restype or restype == '':
-                        if atom.atomtype == atomtype or atomtype == '':
-                            foundAtoms.append(atom)
         if len(foundAtoms) != 0:
             if printOutput:
                 print('Found {} atom(s) matching description'.format(
@@ -263,6 +527,48 @@ class combinedAtomList(object):
             print('Atom matching description not found')
         return []
 
+    def atomListChanged(self):
+
+        # record that atomList has been changed in place (reordered or
+        # filtered), such that the indices of atomList (see getAtomLookup
+        # and getNeighbourIndex) are rebuilt on next use. Replacing
+        # atomList or changing its length is detected without this
+
+        self.atomListVersion = getattr(self, 'atomListVersion', 0) + 1
+
+    def getAtomListKey(self):
+
+        # the identity, length and version of atomList, for which the
+        # indices of atomList remain valid. Each index also holds a
+        # reference to atomList, such that its identity is not reused
+
+        return (id(self.atomList), len(self.atomList),
+                getattr(self, 'atomListVersion', 0))
+
+    def getAtomLookup(self,
+                      attrs=()):
+
+        # a dictionary from the values of the atom attributes 'attrs' to
+        # the atoms of atomList with those values (in atomList order).
+        # The dictionary for each combination of attributes is built on
+        # first use, and all are rebuilt once atomList changes
+
+        key = self.getAtomListKey()
+        cached = getattr(self, 'atomLookup', None)
+        if cached is None or cached['key'] != key:
+            cached = self.atomLookup = {'key': key, 'lookups': {},
+                                        'atomList': self.atomList}
+
+        lookups = cached['lookups']
+        if attrs not in lookups:
+            lookup = {}
+            for atom in self.atomList:
+                lookup.setdefault(tuple(getattr(atom, attr) for attr in attrs),
+                                  []).append(atom)
+            lookups[attrs] = lookup
+
+        return lookups[attrs]
+
     def getDensMetrics(self):
 
         # get a list of all density metrics and normalisations that
@@ -404,13 +710,23 @@ class combinedAtomList(object):
                     self.atomList, normaliseTo=normalisationSet)
             self.metricNormWeights.calculateWeights(metric)
 
-        if newMetric == 'standardised':
-            data = [atm.densMetric[metric]['Standard']['values'] for atm in self.atomList]
+        if newMetric == 'Standardised':
+            data = self.getDensMetricArray(metric=metric)
             meand = np.nanmean(data, 0)
             stdd = np.nanstd(data, 0)
 
-        # loop over all atoms in list and calculate additional
-        # metrics for each atom in atomList
+        # where atoms share a columnar store, calculate the new metric for
+        # all atoms at once
+        rows = self.getStoreRows()
+        if rows is not None and not (newMetric == 'lin reg' and
+                                     self.numLigRegDatasets < 3):
+            self.calcAdditionalMetricsForStore(
+                rows=rows, metric=metric, normType=normType,
+                newMetric=newMetric, vector=vector)
+            return
+
+        # otherwise loop over all atoms in list and calculate
+        # additional metrics for each atom in atomList
         for atom in self.atomList:
 
             if newMetric == 'Calpha normalised':
@@ -451,6 +767,90 @@ class combinedAtomList(object):
                     metric=metric, normType='Standard',
                     meanOfDistn=meand, stdOfDistn=stdd)
 
+    def getStoreRows(self):
+
+        # the rows of the columnar store for each atom in atomList, or None
+        # if the atoms do not share a single store
+
+        if len(self.atomList) == 0:
+            return None
+        store = self.atomList[0].store
+        if not all(atom.store is store for atom in self.atomList):
+            return None
+
+        return np.array([atom.row for atom in self.atomList], dtype=np.int64)
+
+    def calcAdditionalMetricsForStore(self,
+                                      rows=[], metric='loss',
+                                      normType='Standard',
+                                      newMetric='Calpha normalised',
+                                      vector=[]):
+
+        # batch version of the per-atom calculations within
+        # calcAdditionalMetrics, for atoms sharing a columnar store. Each
+        # new metric is calculated for all atoms (store 'rows') in a
+        # single array expression, giving the same values as the
+        # corresponding combinedAtom methods
+
+        store = self.atomList[0].store
+
+        def setVals(metric=metric, normType='Standard', values=[]):
+            store.setValues(metric=metric, normType=normType, values=values,
+                            rows=rows)
+
+        if newMetric in ('Calpha normalised', 'X-normalised'):
+            # see combinedAtom.calcNormalisedMetric
+            vals = store.getValues(metric, 'Standard')[rows]
+            weight1 = self.metricNormWeights.meanweight[metric]
+            weight2 = self.metricNormWeights.stdweight[metric]
+            setVals(normType=newMetric,
+                    values=np.sign(weight1)*np.divide(vals-weight1, weight2))
+
+        elif newMetric == 'lin reg':
+            # see combinedAtom.calcLinReg
+            x = np.array(range(2, self.numLigRegDatasets+1))
+            vals = store.getValues(metric, 'Standard')[rows][:, :len(x)]
+            linRegRslts = linRegressRows(x=x, Y=vals)
+            statsLbls = ['slope', 'intercept', 'r_squared', 'p_value',
+                         'std_err']
+            store.setLinReg(metric=metric, normType='Standard',
+                            stats=dict(zip(statsLbls, linRegRslts)),
+                            rows=rows)
+
+        elif newMetric == 'net':
+            absMaxLoss = np.abs(store.getValues('loss', 'Standard')[rows])
+            absMaxGain = np.abs(store.getValues('gain', 'Standard')[rows])
+            setVals(metric='net', values=absMaxLoss - absMaxGain)
+
+        elif newMetric == 'dataset 1 subtracted':
+            vals = store.getValues(metric, 'Standard')[rows]
+            setVals(normType=newMetric, values=vals - vals[:, :1])
+
+        elif newMetric == 'average':
+            store.setAverage(
+                metric=metric, normType=normType,
+                vals=np.nanmean(store.getValues(metric, normType)[rows], 1),
+                rows=rows)
+
+        elif newMetric in ('vector weighted', 'vector subtracted'):
+            vals = store.getValues(metric, 'Standard')[rows]
+            if len(vector) != vals.shape[1]:
+                print('Incompatible metric and per-dataset ' +
+                      'scale vector lengths')
+                return
+            if newMetric == 'vector weighted':
+                setVals(normType='vector-weighted',
+                        values=vals/np.array(vector))
+            else:
+                setVals(normType='vector-subtracted',
+                        values=vals - np.array(vector))
+
+        elif newMetric == 'Standardised':
+            vals = store.getValues(metric, 'Standard')[rows]
+            meand = np.nanmean(vals, 0)
+            stdd = np.nanstd(vals, 0)
+            setVals(normType=newMetric, values=(vals-meand)/stdd)
+
     def writeMetric2File(self,
                          where='./', groupBy='none', metric='loss',
                          normType='Standard', sortby='metric', numDP=2):
@@ -484,39 +884,39 @@ class combinedAtomList(object):
 
         # retrieve metric stats depending on groupBy
         if groupBy != 'none':
-            # create dictionary for stats over datasets
-            if groupBy == 'atomtype':
-                TypeDic = self.groupByAtmType()
-            elif groupBy == 'residue':
-                TypeDic = self.groupByResType()
-            statDic = {k: [] for k in list(TypeDic.keys())}
-
-            for d in range(metricLength):
-                if groupBy == 'atomtype':
-                    a, b = self.getPerAtmtypeStats(
-                        metric=metric, normType=normType, dataset=d, n=1)
-                elif groupBy == 'residue':
-                    a, b = self.getPerResidueStats(
-                        metric=metric, normType=normType, dataset=d, n=1)
-                for key in list(b.keys()):
-                    statDic[key].append(b[key]['mean'])
-                    statDic[key].append(b[key]['std'])
+            # create dictionary for stats over datasets, for the groups
+            # present within the first dataset. The stats of every
+            # dataset are found together (see getGroupedStatsTable)
+            table = self.getGroupedStatsTable(
+                metric=metric, normType=normType, groupBy=groupBy)
+            statDic = {}
+            for g in self.getGroupOrder(table=table, dataset=0):
+                statDic[table['keys'][g]] = [
+                    val for d in range(metricLength)
+                    for val in (table['mean'][g, d], table['std'][g, d])]
 
             for i, k in enumerate(statDic.keys()):
                 roundedVals = [round(v, numDP) for v in statDic[k]]
                 csvfile.write(
                     '{},{},{}\n'.format(i, k, ','.join(map(str, roundedVals))))
         else:
-            # sort atom list by atom number or damage metric
+            # sort atom list by atom number or damage metric. Stable
+            # sorts are used, as for list.sort
+            vals = self.getDensMetricArray(metric=metric, normType=normType)
             if sortby == 'atomnum':
-                self.atomList.sort(key=lambda x: x.atomnum)
+                order = np.argsort([atom.atomnum for atom in self.atomList],
+                                   kind='mergesort')
             else:
-                self.atomList.sort(
-                    key=lambda x: x.densMetric[metric][normType]['values'][0], reverse=True)
-            for atom in self.atomList:
+                order = np.argsort(-vals[:, 0], kind='mergesort')
+            self.atomList[:] = [self.atomList[i] for i in order]
+            self.atomListChanged()
+
+            # values are rounded for all atoms at once (as numpy rounds
+            # each single value) and written as python floats
+            roundedVals = np.round(vals[order], numDP).tolist()
+            for atom, atomVals in zip(self.atomList, roundedVals):
                 csvfile.write('{},{},'.format(atom.atomnum, atom.getAtomID()))
-                roundedVals = [round(v, numDP) for v in atom.densMetric[metric][normType]['values']]
-                csvfile.write(','.join(map(str, roundedVals)))
+                csvfile.write(','.join(map(str, atomVals)))
                 csvfile.write('\n')
         csvfile.close()
 
@@ -529,6 +929,7 @@ class combinedAtomList(object):
         # known consistent order
 
         self.atomList.sort(key=lambda x: x.atomnum)
+        self.atomListChanged()
 
     def findProbAboveAvDam(self,
                            metric='loss', normType='Calpha normalised',
@@ -541,12 +942,10 @@ class combinedAtomList(object):
         # average Dloss. Could be used as an overall
         # indicator for damage to the structure
 
+        vals = self.getDensMetricArray(metric=metric, normType=normType)
         for d in self.getDsetList():
-            count = 0
-            for atm in self.atomList:
-                if d in atm.getPresentDatasets():
-                    if atm.densMetric[metric][normType]['values'][d] > threshold:
-                        count += 1
+            count = np.count_nonzero(
+                self.getPresenceMask(dataset=d) & (vals[:, d] > threshold))
 
             prob = float(count)/self.getNumAtoms()
 
@@ -831,12 +1230,11 @@ class combinedAtomList(object):
 
         if atmList == []:
             atmList = self.atomList
+            present = self.getPresenceMask(dataset=dataset)
+        else:
+            present = self.getPresenceMask(dataset=dataset, atoms=atmList)
 
-        newList = []
-        for atom in atmList:
-            if dataset in atom.getPresentDatasets():
-                newList.append(atom)
-        return newList
+        return [atmList[i] for i in np.flatnonzero(present)]
 
     def findTopAtomOfType(self,
                           metric='loss', normType='Standard',
@@ -888,7 +1286,9 @@ class combinedAtomList(object):
 
         if dataset != 'all':
             atomList = self.getAtomListWithoutPartialAtoms(dataset=dataset)
-            atomList.sort(key=lambda x: x.densMetric[metric][normType]['values'][dataset], reverse=r)
+            atomList = self.sortAtomsByMetric(
+                atoms=atomList, metric=metric, normType=normType,
+                dataset=dataset, reverse=r)
 
             if n != 'all':
                 return atomList[:int(n)]
@@ -901,7 +1301,9 @@ class combinedAtomList(object):
             for d in self.getDsetList():
 
                 atomList = self.getAtomListWithoutPartialAtoms(dataset=d)
-                atomList.sort(key=lambda x: x.densMetric[metric][normType]['values'][d], reverse=False)
+                atomList = self.sortAtomsByMetric(
+                    atoms=atomList, metric=metric, normType=normType,
+                    dataset=d)
 
                 for i, atom in enumerate(atomList):
                     if d == 0:
@@ -917,30 +1319,59 @@ class combinedAtomList(object):
             atomList = [t[0] for t in top]
             return atomList
 
+    def sortAtomsByMetric(self,
+                          atoms=[], metric='loss', normType='Standard',
+                          dataset=0, reverse=False):
+
+        # return a new list of atoms sorted by metric value at a dataset.
+        # The sort is stable (as list.sort, including when reversed)
+
+        if len(atoms) == 0:
+            return []
+
+        vals = self.getDensMetricArray(
+            metric=metric, normType=normType, atoms=atoms)[:, dataset]
+        if reverse:
+            vals = -vals
+
+        return [atoms[i] for i in np.argsort(vals, kind='mergesort')]
+
     def getTopNAtomsPDBfile(self,
                             metric='loss', normType='Standard', dataset=0,
                             n='all',  pdbFile='untitled.pdb'):
 
         # for a given metric type, determine top n damage sites.
         # 'n' is integer (not 'all' here). method writes locations
-        # of top damage sites to pdb file
+        # of top damage sites to pdb file (or to mmCIF file if the
+        # template 'pdbFile' is in mmCIF format)
 
-        pdbIn = open(pdbFile, 'r')
-        pdbOutName = '{}top{}-{}D{}sites-dset{}.pdb'.format(
-            self.outputDir, n, normType, metric, dataset)
+        mmCIF = isMmCIFfile(pdbFile)
+        pdbOutName = '{}top{}-{}D{}sites-dset{}{}'.format(
+            self.outputDir, n, normType, metric, dataset,
+            '.cif' if mmCIF else '.pdb')
         pdbOut = open(pdbOutName, 'w')
 
-        headerInfo = 'REMARK Top {} damage sites as indicated by the {} D{} metric.\n'.format(n, normType, metric)
+        headerInfo = ['Top {} damage sites as indicated by the {} D{} metric.'.format(n, normType, metric)]
         if dataset == 'all':
-            headerInfo += 'REMARK All datasets within damage series ' +\
-                          'are present (increasing chain index).\n'
+            headerInfo.append('All datasets within damage series ' +
+                              'are present (increasing chain index).')
         else:
-            headerInfo += 'REMARK File contains information for dataset {}.\n'.format(dataset)
-        pdbOut.write(headerInfo)
-
-        for l in pdbIn.readlines():
-            if l.startswith(('CRYST1', 'SCALE1', 'SCALE2', 'SCALE3')):
-                pdbOut.write(l)
+            headerInfo.append('File contains information for dataset {}.'.format(dataset))
+
+        if mmCIF:
+            pdbOut.write(mmCIFdataBlock(fileName=pdbOutName,
+                                        items=readMmCIFitems(pdbFile)))
+            pdbOut.write(''.join('# {}\n'.format(h) for h in headerInfo))
+            pdbOut.write(mmCIFatomSiteHeader())
+            writeLine = writeMmCIFline_DamSite
+        else:
+            pdbOut.write(''.join('REMARK {}\n'.format(h) for h in headerInfo))
+            pdbIn = open(pdbFile, 'r')
+            for l in pdbIn.readlines():
+                if l.startswith(('CRYST1', 'SCALE1', 'SCALE2', 'SCALE3')):
+                    pdbOut.write(l)
+            pdbIn.close()
+            writeLine = writePDBline_DamSite
 
         if dataset == 'all':
             datasets = self.getDsetList()
@@ -952,18 +1383,23 @@ class combinedAtomList(object):
             # next get top n metric sites and write to file
             topAtms = self.getTopNAtoms(
                 metric=metric, normType=normType, dataset=d, n=n)
+            # mmCIF files allow multi-character chain IDs beyond the
+            # 26th dataset
+            if mmCIF and d >= len(chains):
+                chain = chains[d//len(chains) - 1] + chains[d % len(chains)]
+            else:
+                chain = chains[d]
             count = 0
             for atm in topAtms:
                 count += 1
                 # generate pdb line - note: absolute value of metric
                 # taken since Bfactor>0 (for displaying in pymol etc.)
-                l = writePDBline_DamSite(
-                    atom=atm, index=count, chain=chains[d],
+                l = writeLine(
+                    atom=atm, index=count, chain=chain,
                     damValue=np.abs(atm.densMetric[metric][normType]['values'][d]))
                 pdbOut.write(l+'\n')
 
-        pdbOut.write('END')
-        pdbIn.close()
+        pdbOut.write('#\n' if mmCIF else 'END')
         pdbOut.close()
         return pdbOutName
 
@@ -1330,10 +1766,9 @@ class combinedAtomList(object):
         # for a given metric type, determine per-atom-type
         # statistics on the distribution of damage
 
-        atmtypeDict = self.groupByAtmType(dataset=dataset)
-
-        statsDic = self.getStats(metric=metric, normType=normType,
-                                 dataset=dataset, dic=atmtypeDict)
+        statsDic = self.getGroupedStats(
+            metric=metric, normType=normType, dataset=dataset,
+            groupBy='atomtype')
 
         statsString = self.reportStats(
             stats=statsDic, name='Type', sortby=sortby,
@@ -1348,11 +1783,9 @@ class combinedAtomList(object):
         # for a given metric type, determine per-residue
         # statistics on the distribution of damage
 
-        # group atoms by residue type
-        resDict = self.groupByResType(dataset=dataset)
-
-        statsDic = self.getStats(
-            metric=metric, normType=normType,  dataset=dataset, dic=resDict)
+        statsDic = self.getGroupedStats(
+            metric=metric, normType=normType, dataset=dataset,
+            groupBy='residue')
 
         statsString = self.reportStats(
             stats=statsDic, name='Residue', sortby=sortby,
@@ -1367,11 +1800,9 @@ class combinedAtomList(object):
         # for a given metric type, determine per-chain
         # statistics on the distribution of damage
 
-        # group atoms by chain type
-        chainDict = self.groupByChainType(dataset=dataset)
-
-        statsDic = self.getStats(
-            metric=metric, normType=normType, dataset=dataset, dic=chainDict)
+        statsDic = self.getGroupedStats(
+            metric=metric, normType=normType, dataset=dataset,
+            groupBy='chain')
 
         statsString = self.reportStats(
             stats=statsDic, name='Chain', sortby=sortby,
@@ -1386,9 +1817,9 @@ class combinedAtomList(object):
         # for a given metric type, determine per-chain
         # statistics on the distribution of damage
 
-        statsDic = self.getStats(
-            metric=metric, normType=normType,
-            dataset=dataset, dic={'Structure': self.atomList})
+        statsDic = self.getGroupedStats(
+            metric=metric, normType=normType, dataset=dataset,
+            groupBy='structure')
 
         statsString = self.reportStats(
             stats=statsDic, name='Structure', normType=normType, n=1)
@@ -1400,30 +1831,110 @@ class combinedAtomList(object):
                  dataset=0, dic={}):
 
         # output distribution stats for each element
-        # in dictionary dic as a new dictionary
+        # in dictionary dic as a new dictionary. The stats
+        # of all elements are found together (see groupedStats.py)
+
+        keys = list(dic.keys())
+        atoms = [atom for k in keys for atom in dic[k]]
+        groupCodes = np.repeat(np.arange(len(keys)),
+                               [len(dic[k]) for k in keys])
+        vals = self.getDensMetricArray(
+            metric=metric, normType=normType, atoms=atoms)[:, [dataset]]
+
+        table = groupedStatsTable(vals=vals, groupCodes=groupCodes,
+                                  numGroups=len(keys))
+        table['keys'] = keys
+
+        return self.statsDictFromTable(
+            table=table, dataset=0, groups=range(len(keys)))
+
+    def getGroupedStats(self,
+                        metric='loss', normType='Standard', dataset=0,
+                        groupBy='atomtype'):
+
+        # the stats dictionary (as getStats) for the groups of atoms
+        # present within a dataset, grouped as for groupAtomsBy (or all
+        # atoms, as a single 'Structure' group, for groupBy='structure')
+
+        if dataset not in range(self.getPresenceMask().shape[1]):
+            return {}
+        table = self.getGroupedStatsTable(
+            metric=metric, normType=normType, groupBy=groupBy,
+            datasets=[dataset])
+        if groupBy == 'structure':
+            return self.statsDictFromTable(table=table, dataset=0)
+
+        return self.statsDictFromTable(
+            table=table, dataset=0,
+            groups=self.getGroupOrder(table=table, dataset=0))
+
+    def getGroupedStatsTable(self,
+                             metric='loss', normType='Standard',
+                             groupBy='atomtype', datasets=None):
+
+        # the stats of a metric for every group of atoms and every dataset
+        # (see groupedStats.groupedStatsTable), with the group keys as
+        # 'keys'. Atoms are grouped by 'atomtype', 'residue' or 'chain'
+        # (see getGroupIndex), including only atoms present within each
+        # dataset, or else all atoms form a single 'Structure' group. If
+        # 'datasets' (a list of dataset indices) is given, the table holds
+        # only these datasets, in the order given
+
+        vals = self.getDensMetricArray(metric=metric, normType=normType)
+        if datasets is not None:
+            vals = vals[:, datasets]
+        if groupBy == 'structure':
+            groupKeys = ['Structure']
+            groupCodes = np.zeros(len(self.atomList), dtype=np.int64)
+            present = None
+        else:
+            groupKeys, groupCodes = self.getGroupIndex(groupBy=groupBy)
+            present = self.getPresenceMask()
+            if datasets is not None:
+                present = present[:, datasets]
+
+        table = groupedStatsTable(vals=vals, present=present,
+                                  groupCodes=groupCodes,
+                                  numGroups=len(groupKeys))
+        table['keys'] = groupKeys
+
+        return table
+
+    def getGroupOrder(self,
+                      table={}, dataset=0):
+
+        # the groups of a grouped stats table with atoms present within a
+        # dataset, ordered by their first atom (as for groupAtomsBy)
+
+        groups = np.flatnonzero(table['#atoms'][:, dataset] > 0)
+        order = np.argsort(table['firstAtom'][groups, dataset],
+                           kind='mergesort')
+
+        return groups[order].tolist()
+
+    def statsDictFromTable(self,
+                           table={}, dataset=0, groups=None):
+
+        # the stats of a single dataset from a grouped stats table, as a
+        # dictionary per group key (as returned by getStats). Undefined
+        # asymmetry scores and normality tests are given as 'N/A' and
+        # 'n/a', as for calcAsymmetryAboutZero and testForNormality
+
+        if groups is None:
+            groups = range(len(table['keys']))
 
         getStatsPerKey = {}
-        for k in list(dic.keys()):
-            metricList = [atom.densMetric[metric][normType]['values'][dataset] for atom in dic[k]]
-            statsDic = {}
-            m = metricList
-            statsDic['#atoms'] = len(m)
-            statsDic['mean'] = np.mean(m)
-            statsDic['std'] = np.std(m)
-            statsDic['skew'] = self.calculateSkew(metricList=m)
-            statsDic['kurtosis'] = self.calculateKurtosis(metricList=m)
-            # statsDic['ratio'] = self.calcNetRatio(metricList=m)
-            # statsDic['zero-asym1'] = self.calcAsymmetryAboutZero(vals=m, method=1)
-            statsDic['asymmetry score'] = self.calcAsymmetryAboutZero(vals=m)
-
-            statsDic['outliers'] = self.calcNumOutliers(
-                metricList=m, metric=metric, normType=normType)
-            statsDic['normality'] = self.testForNormality(metricList=m)
-
-            statsDic['returnOrder'] = ['mean', 'std', '#atoms', 'outliers',
-                                       'skew', 'kurtosis', 'asymmetry score']
-
-            getStatsPerKey[k] = statsDic
+        for g in groups:
+            statsDic = {stat: table[stat][g, dataset]
+                        for stat in groupedStatNames + ['normality']}
+            if not np.isnan(statsDic['outliers']):
+                statsDic['outliers'] = int(statsDic['outliers'])
+            if np.isnan(statsDic['asymmetry score']):
+                statsDic['asymmetry score'] = 'N/A'
+            if np.isnan(statsDic['normality']):
+                statsDic['normality'] = 'n/a'
+            statsDic['returnOrder'] = list(groupedStatNames)
+            getStatsPerKey[table['keys'][g]] = statsDic
 
         return getStatsPerKey
 
@@ -1782,46 +2293,105 @@ class combinedAtomList(object):
 
         # group atoms in a dictionary by atom type
 
-        atmtypeDict = {}
-        for atom in self.atomList:
-            if dataset not in atom.getPresentDatasets():
-                continue
-            atmtype = '-'.join([atom.basetype, atom.atomtype])
-            if atmtype not in list(atmtypeDict.keys()):
-                atmtypeDict[atmtype] = [atom]
-            else:
-                atmtypeDict[atmtype].append(atom)
-        return atmtypeDict
+        return self.groupAtomsBy(groupBy='atomtype', dataset=dataset)
 
     def groupByResType(self,
                        dataset=0):
 
         # group atoms in a dictionary by residue type
 
-        resDict = {}
-        for atom in self.atomList:
-            if dataset not in atom.getPresentDatasets():
-                continue
-            if atom.basetype not in list(resDict.keys()):
-                resDict[atom.basetype] = [atom]
-            else:
-                resDict[atom.basetype].append(atom)
-        return resDict
+        return self.groupAtomsBy(groupBy='residue', dataset=dataset)
 
     def groupByChainType(self,
                          dataset=0):
 
         # group atoms in a dictionary by chain type
 
-        chainDict = {}
-        for atom in self.atomList:
-            if dataset not in atom.getPresentDatasets():
-                continue
-            if atom.chaintype not in list(chainDict.keys()):
-                chainDict[atom.chaintype] = [atom]
+        return self.groupAtomsBy(groupBy='chain', dataset=dataset)
+
+    def groupAtomsBy(self,
+                     groupBy='atomtype', dataset=0):
+
+        # group the atoms present within a dataset in a dictionary by
+        # atom type, residue type or chain ('groupBy' as for
+        # getGroupIndex). Groups are ordered by their first atom and
+        # atoms within a group are in atomList order
+
+        groupKeys, groupCodes = self.getGroupIndex(groupBy=groupBy)
+        rows = np.flatnonzero(self.getPresenceMask(dataset=dataset))
+        codes = groupCodes[rows]
+
+        order = np.argsort(codes, kind='mergesort')
+        uniqueCodes, firsts, counts = np.unique(
+            codes, return_index=True, return_counts=True)
+        starts = np.cumsum(counts) - counts
+
+        groupDict = {}
+        for i in np.argsort(firsts, kind='mergesort'):
+            groupRows = rows[order[starts[i]:starts[i] + counts[i]]]
+            groupDict[groupKeys[uniqueCodes[i]]] = [self.atomList[r]
+                                                    for r in groupRows]
+        return groupDict
+
+    def getPresenceMask(self,
+                        dataset=None, atoms=None):
+
+        # an atoms x datasets array of whether each atom is present within
+        # each dataset (has a 'loss' value, as for
+        # combinedAtom.getPresentDatasets), or a single dataset column of
+        # it if 'dataset' is given. For atomList (the default 'atoms'),
+        # the mask is found once and kept until atomList changes (see
+        # atomListChanged)
+
+        if atoms is None:
+            key = self.getAtomListKey()
+            cached = getattr(self, 'presenceMask', None)
+            if cached is None or cached['key'] != key:
+                cached = self.presenceMask = {
+                    'key': key, 'atomList': self.atomList,
+                    'mask': self.getPresenceMask(atoms=self.atomList)}
+            mask = cached['mask']
+        else:
+            mask = ~np.isnan(self.getDensMetricArray(
+                metric='loss', normType='Standard', atoms=atoms))
+
+        if dataset is None:
+            return mask
+        if dataset not in range(mask.shape[1]):
+            return np.zeros(len(mask), dtype=bool)
+        return mask[:, dataset]
+
+    def getGroupIndex(self,
+                      groupBy='atomtype'):
+
+        # the group of each atom of atomList, by 'atomtype' (residue and
+        # atom type, e.g. 'GLU-CD'), 'residue' (residue type) or 'chain'.
+        # Returns the list of group keys (in order of first atom) and an
+        # array of the index of each atom's group within the list. Group
+        # indices are found once and kept until atomList changes
+
+        key = self.getAtomListKey()
+        cached = getattr(self, 'groupIndex', None)
+        if cached is None or cached['key'] != key:
+            cached = self.groupIndex = {
+                'key': key, 'atomList': self.atomList, 'groups': {}}
+
+        if groupBy not in cached['groups']:
+            if groupBy == 'atomtype':
+                groupOf = lambda atom: '-'.join([atom.basetype, atom.atomtype])
+            elif groupBy == 'residue':
+                groupOf = lambda atom: atom.basetype
             else:
-                chainDict[atom.chaintype].append(atom)
-        return chainDict
+                groupOf = lambda atom: atom.chaintype
+
+            codes = {}
+            groupCodes = np.array(
+                [codes.setdefault(groupOf(atom), len(codes))
+                 for atom in self.atomList], dtype=np.int64)
+            groupKeys = sorted(codes, key=codes.get)
+            cached['groups'][groupBy] = (groupKeys, groupCodes)
+
+        return cached['groups'][groupBy]
 
     def checkSpecificAtomsExist(self,
                                 AtomSet=[['GLU', 'CA']]):
@@ -3211,14 +3781,10 @@ class combinedAtomList(object):
         for ind in type2:
             atoms2 += self.getAtom(restype=ind[0], atomtype=ind[1])
 
-        densVals, minDists = [], []
-        for atom1 in atoms1:
-            densVals.append(atom1.densMetric[densMet][normType]['values'][dataset])
-            distList = []
-            for atom2 in atoms2:
-                distList.append(self.getDistanceBetweenAtoms(
-                    atom1=atom1, atom2=atom2))
-            minDists.append(min(distList))
+        densVals = [atom1.densMetric[densMet][normType]['values'][dataset]
+                    for atom1 in atoms1]
+        minAtms, minDists = self.getMinDistsToAtoms(
+            atoms1=atoms1, atoms2=atoms2)
 
         yLabel = '{} D{}'.format(normType, densMet)
         xLabel = '{} {} distance'.format(type1, type2)
@@ -3252,22 +3818,32 @@ class combinedAtomList(object):
 
         atms2 = self.getAtom(restype=resType2, atomtype=atomType2)
 
-        minAtm = []
-        minDist = 1e6
-        for atm2 in atms2:
-            dist = self.getDistanceBetweenAtoms(atom1=atm1[0], atom2=atm2)
-            try:
-                minDist
-            except NameError:
-                minDist = dist
-                minAtm = atm2
-                continue
+        minAtms, minDists = self.getMinDistsToAtoms(
+            atoms1=atm1[:1], atoms2=atms2)
+
+        return minAtms[0], minDists[0]
+
+    def getMinDistsToAtoms(self,
+                           atoms1=[], atoms2=[]):
 
-            if minDist > dist:
-                minDist = dist
-                minAtm = atm2
+        # for each atom of 'atoms1', get the nearest atom of 'atoms2'
+        # and the distance to it (or [] and 1e6 if 'atoms2' is empty).
+        # The nearest atoms are found for all of 'atoms1' at once,
+        # through a spatial index of the positions of 'atoms2'
 
-        return minAtm, minDist
+        index = atomNeighbourIndex(coords=[a.getXYZ() for a in atoms2])
+        inds, dists = index.nearest(points=[a.getXYZ() for a in atoms1])
+
+        minAtms, minDists = [], []
+        for i, dist in zip(inds[:, 0], dists[:, 0]):
+            if i < 0:
+                minAtms.append([])
+                minDists.append(1e6)
+            else:
+                minAtms.append(atoms2[i])
+                minDists.append(dist)
+
+        return minAtms, minDists
 
     def scatterAtmsByDistToOtherAtms(
         self, atomType1='OH', resType1='TYR', atomType2='CB', resType2='CYS',
@@ -3278,16 +3854,11 @@ class combinedAtomList(object):
         # (e.g. CYS-SG) and make scatter plot
 
         atms1 = self.getAtom(restype=resType1, atomtype=atomType1)
+        atms2 = self.getAtom(restype=resType2, atomtype=atomType2)
 
-        xVals = []
-        yVals = []
-        for atm1 in atms1:
-            info = self.getMinDistToAtomType(
-                atomType1=atm1.atomtype, resType1=atm1.basetype,
-                resNum1=atm1.residuenum, chainType1=atm1.chaintype,
-                atomType2=atomType2, resType2=resType2)
-            xVals.append(info[1])
-            yVals.append(atm1.densMetric[metric][normType]['values'])
+        minAtms, xVals = self.getMinDistsToAtoms(atoms1=atms1, atoms2=atms2)
+        yVals = [atm1.densMetric[metric][normType]['values']
+                 for atm1 in atms1]
 
         for d in self.getDsetList():
             Rsquared = self.plotScatterPlot(
@@ -3302,6 +3873,119 @@ class combinedAtomList(object):
 
             print('Dataset {} --> R^2 = {}'.format(d+1, round(Rsquared, 4)))
 
+    def getNeighbourIndex(self):
+
+        # the spatial index of the atom positions of atomList (see
+        # atomNeighbours.py), built on first use. Atoms are grouped both
+        # by residue and by atom ID, such that atoms of the same residue
+        # (or the same atom ID) as a query atom can be disregarded. The
+        # index is rebuilt once atomList changes (see atomListChanged),
+        # but not if atom coordinates are changed in place
+
+        key = self.getAtomListKey()
+        cached = getattr(self, 'neighbourIndex', None)
+        if cached is not None and cached['key'] == key:
+            return cached
+
+        atoms = list(self.atomList)
+        codes = {'res': {}, 'atom': {}}
+        groups = {'res': [], 'atom': []}
+        for atom in atoms:
+            for groupType, groupKey in self.getNeighbourGroupKeys(atom):
+                code = codes[groupType].setdefault(
+                    groupKey, len(codes[groupType]))
+                groups[groupType].append(code)
+
+        self.neighbourIndex = {
+            'key': key, 'atomList': self.atomList, 'atoms': atoms,
+            'codes': codes,
+            'index': atomNeighbourIndex(
+                coords=[atom.getXYZ() for atom in atoms], groups=groups)}
+
+        return self.neighbourIndex
+
+    def getNeighbourGroupKeys(self,
+                              atom=''):
+
+        # the residue and atom ID group keys of an atom, as used to
+        # disregard atoms of the same residue or atom ID as a query atom
+
+        atomID = atom.getAtomID()
+        return [('res', tuple(atomID.split('-')[:-1])), ('atom', atomID)]
+
+    def getNeighbourAtoms(self,
+                          atoms=[], distLimMax=4, distLimMin=0,
+                          ignoreSame='res'):
+
+        # batch version of getAtomsWithinDist, finding the atoms within
+        # a distance range of each of 'atoms' in a single query of the
+        # spatial index of the atom positions. Returns a dictionary of
+        # 'atoms' and 'distances' per atom, with found atoms ordered as
+        # in atomList
+
+        neighbourIndex = self.getNeighbourIndex()
+        index = neighbourIndex['index']
+
+        groupType, pointGroups = None, []
+        if ignoreSame in ('res', 'atom'):
+            groupType = ignoreSame
+            codes = neighbourIndex['codes'][ignoreSame]
+            for atom in atoms:
+                groupKey = dict(self.getNeighbourGroupKeys(atom))[ignoreSame]
+                pointGroups.append(codes.get(groupKey, -1))
+
+        neighbours = index.withinDist(
+            points=[atom.getXYZ() for atom in atoms], distLimMax=distLimMax,
+            distLimMin=distLimMin, groupType=groupType,
+            pointGroups=pointGroups)
+
+        return [{'atoms': [neighbourIndex['atoms'][i] for i in inds],
+                 'distances': list(dists)} for inds, dists in neighbours]
+
+    def getCrystalContactAtoms(self,
+                               atoms=[], distLimMax=4, distLimMin=0,
+                               pdbName='', symmetrygroup='', printText=True):
+
+        # batch search for the atoms in contact with each of 'atoms'
+        # within the crystal, including symmetry-related copies of the
+        # structure (see crystalContacts.py). The unit cell is read from
+        # coordinate file 'pdbName', as is the space group unless given
+        # by 'symmetrygroup'. As for getNeighbourAtoms, atoms of the same
+        # residue (within the same copy of the structure) are
+        # disregarded. Returns a dictionary of contact 'atoms' (the atoms
+        # of atomList of which the contacts are copies), 'distances' and
+        # 'symOps' per atom, with contacts ordered by distance, or None if
+        # the crystal symmetry could not be found
+
+        cell = readUnitCell(pdbFileName=pdbName)
+        if symmetrygroup == '':
+            symmetrygroup = readSpaceGroup(pdbFileName=pdbName)
+        symOps = readSymOps(spaceGroup=symmetrygroup)
+
+        if cell is None or symOps == []:
+            if printText:
+                print('Unable to find the unit cell and symmetry ' +
+                      'operators of space group "{}" '.format(symmetrygroup) +
+                      'for {}'.format(pdbName))
+            return None
+
+        neighbourIndex = self.getNeighbourIndex()
+        codes = neighbourIndex['codes']['res']
+        pointGroups = [codes.get(dict(self.getNeighbourGroupKeys(atom))['res'],
+                                 -1) for atom in atoms]
+
+        contacts = crystalContacts(
+            coords=neighbourIndex['index'].coords, cell=cell, symOps=symOps,
+            groups=neighbourIndex['index'].groups['res'])
+        found = contacts.withinDist(
+            points=[atom.getXYZ() for atom in atoms], distLimMax=distLimMax,
+            distLimMin=distLimMin, pointGroups=pointGroups)
+
+        return [{'atoms': [neighbourIndex['atoms'][i] for i in inds],
+                 'distances': list(dists),
+                 'symOps': [symOps[op] for op in ops]}
+                for inds, ops, shifts, dists in found]
+
     def getAtomsWithinDist(self,
                            atom='', distLimMax=4, distLimMin=0,
                            printText=False, ignoreSame='res'):
@@ -3310,20 +3994,10 @@ class combinedAtomList(object):
         # of selected atomtype. Disregards atoms of
         # same exact residue by default
 
-        nearAtmDic = {'atoms': [], 'distances': []}
+        nearAtmDic = self.getNeighbourAtoms(
+            atoms=[atom], distLimMax=distLimMax, distLimMin=distLimMin,
+            ignoreSame=ignoreSame)[0]
 
-        for otheratom in self.atomList:
-            if ignoreSame == 'res':
-                if (otheratom.getAtomID()).split('-')[:-1] == (atom.getAtomID()).split('-')[:-1]:
-                    continue
-            elif ignoreSame == 'atom':
-                if otheratom.getAtomID() == atom.getAtomID():
-                    continue
-            dist = self.getDistanceBetweenAtoms(atom1=atom, atom2=otheratom)
-            if dist < distLimMax:
-                if dist > distLimMin:
-                    nearAtmDic['atoms'].append(otheratom)
-                    nearAtmDic['distances'].append(dist)
         if printText:
             print('{} in total within {}-{} Angstrom of {}'.format(
                 len(nearAtmDic['atoms']), round(distLimMin, 2),
@@ -3347,17 +4021,12 @@ class combinedAtomList(object):
 
         # find max distance away from atom
         keyAtm = atm[0]
-        maxDist = 0
-        for othAtm in self.atomList:
-            dist = self.getDistanceBetweenAtoms(atom1=keyAtm, atom2=othAtm)
-            if dist > maxDist:
-                maxDist = dist
+        index = self.getNeighbourIndex()['index']
+        maxDist = np.max(index.getDistances(
+            point=keyAtm.getXYZ(), inds=np.arange(index.numAtoms)))
 
         foundAtms = self.getAtomsWithinDist(atom=keyAtm, distLimMax=maxDist+1)
 
-        for i, atm in enumerate(foundAtms['atoms']):
-            dist = foundAtms['distances'][i]
-
         distArr = np.array(foundAtms['distances'])
         groupedDic = {}
         order = []
@@ -3596,71 +4265,36 @@ class combinedAtomList(object):
         # and types of surrounding atoms if 'crystConts' is True then crystal
         # contacts will also be located here
 
-        if crystConts:
-            from NCONTjob import NCONTjob
-
-            ncont = NCONTjob(
-                inputPDBfile=pdbName, outputDir=self.outputDir,
-                symGroup=symmetrygroup, seriesName=self.seriesName,
-                printText=printText)
-            success = ncont.run()
+        atoms = self.getAtom(restype=restype, atomtype=atomtype)
 
-            if not success:
+        # the contacts of all atoms are found in a single batch, including
+        # contacts to symmetry-related atoms if 'crystConts' is True
+        if crystConts:
+            nearAtmsList = self.getCrystalContactAtoms(
+                atoms=atoms, distLimMax=distLim, pdbName=pdbName,
+                symmetrygroup=symmetrygroup, printText=printText)
+            if nearAtmsList is None:
                 return
-            logFile = self.outputDir+'/'+ncont.outputLogfile
-
-        atoms = self.getAtom(restype=restype, atomtype=atomtype)
+        else:
+            nearAtmsList = self.getNeighbourAtoms(
+                atoms=atoms, distLimMax=distLim)
 
         groupA, groupB, groupAContacts = [], [], []
-        for atom in atoms:
+        for atom, nearAtms in zip(atoms, nearAtmsList):
             nearCarboxyl = False
-
-            if crystConts:
-                atomFound = False
-                readLog = open(logFile, 'r')
-                for l in readLog.readlines():
-                    if atomFound and len(l[0:5].strip()) != 0:
-                        # reset if new atom info reached
-                        atomFound = False
-
-                    if (atom.basetype == l[11:14] and
-                        str(atom.residuenum) == l[7:10].strip() and
-                        atom.chaintype == l[4] and
-                            atom.atomtype == l[19:21]):
-                        atomFound = True
-                        if printText:
-                            print('found atom: {}'.format(atom.getAtomID()))
-
-                    if atomFound:
-                        if (l[39:42] in ('GLU', 'ASP') and
-                            l[47:50] in ['OE1', 'OE2', 'OD1', 'OD2'] and
-                                float(l[58:62]) < distLim):
-                            resNum = l[35:38].strip()
-                            chain = l[32]
-                            if printText:
-                                print('contact found! - {}-{}-{}-{}'.format(
-                                    chain, resNum, l[39:42], l[47:50]))
-                            contactAtom = self.getAtom(
-                                chain=chain, restype=l[39:42],
-                                resnum=resNum, atomtype=l[47:50])
-                            nearCarboxyl = True
-                            break
-                readLog.close()
-
-            else:
-                nearAtms = self.getAtomsWithinDist(
-                    atom=atom, distLimMax=distLim)
-                nearCarboxyl = False
-                for atom2 in nearAtms['atoms']:
-                    if atom2.atomtype in ['OE1', 'OE2', 'OD1', 'OD2']:
-                        if atom2.basetype in ['GLU', 'ASP']:
-                            contactAtom = atom2
-                            nearCarboxyl = True
-                            break
+            for atom2 in nearAtms['atoms']:
+                if atom2.atomtype in ['OE1', 'OE2', 'OD1', 'OD2']:
+                    if atom2.basetype in ['GLU', 'ASP']:
+                        contactAtom = atom2
+                        nearCarboxyl = True
+                        break
 
             if nearCarboxyl:
+                if printText:
+                    print('contact found! - {} to {}'.format(
+                        atom.getAtomID(), contactAtom.getAtomID()))
                 groupA.append(atom)
-                groupAContacts.append(contactAtom[0])
+                groupAContacts.append(contactAtom)
             else:
                 groupB.append(atom)
 
@@ -3968,31 +4602,35 @@ class combinedAtomList(object):
             except ValueError:
                 print('Unexpected assignment of "criteria" parameter')
 
-        numHighAtoms = 0
+        if sign not in ('above', 'below'):
+            print('"sign" parameter must take either "above" or "below"')
+            return
+
+        # an atom is 'high' unless its value is at or beyond the threshold
+        # (such that missing values are counted as high), while a
+        # neighbour is only 'high' if its value is past the threshold
+        vals = self.getDensMetricArray(
+            metric=densMet, normType=normType)[:, dataset]
+        if sign == 'above':
+            isHigh = ~(vals <= thres)
+            isHighNeighbour = vals > thres
+        else:
+            isHigh = ~(vals >= thres)
+            isHighNeighbour = vals < thres
+
+        # the neighbours of all high atoms are found in a single query of
+        # the spatial index, with neighbours given as atomList positions
+        highAtms = [self.atomList[i] for i in np.flatnonzero(isHigh)]
+        rowOf = {id(atm): i for i, atm in enumerate(self.atomList)}
+        nearAtmsList = self.getNeighbourAtoms(
+            atoms=highAtms, distLimMax=distance)
+
+        numHighAtoms = len(highAtms)
         numHighNearAtoms = 0
-        for atm in self.atomList:
-            atmMetric = atm.densMetric[densMet][normType]['values'][dataset]
-            if sign == 'above':
-                if atmMetric <= thres:
-                    continue
-            elif sign == 'below':
-                if atmMetric >= thres:
-                    continue
-            else:
-                print('"sign" parameter must take either "above" or "below"')
-                return
-            numHighAtoms += 1
-            nearAtms = self.getAtomsWithinDist(atom=atm, distLimMax=distance)
-            for nearAtm in nearAtms['atoms']:
-                nearAtmMetric = nearAtm.densMetric[densMet][normType]['values'][dataset]
-                if sign == 'above':
-                    if nearAtmMetric > thres:
-                        numHighNearAtoms += 1
-                        break
-                else:
-                    if nearAtmMetric < thres:
-                        numHighNearAtoms += 1
-                        break
+        for nearAtms in nearAtmsList:
+            nearRows = [rowOf[id(nearAtm)] for nearAtm in nearAtms['atoms']]
+            if np.any(isHighNeighbour[nearRows]):
+                numHighNearAtoms += 1
         probHighAtom = float(numHighAtoms)/self.getNumAtoms()
         probHighNeighbourAndHighAtom = float(numHighNearAtoms)/self.getNumAtoms()
         probHighNeighGivenHighAtom = probHighNeighbourAndHighAtom/probHighAtom
@@ -4023,9 +4661,9 @@ class combinedAtomList(object):
 
         self.calcAverageMetricOverDoses(metric=densMet, normType=normType)
 
-        for atm in atms:
-            nearAtms = self.getAtomsWithinDist(atom=atm, distLimMax=distance)
+        nearAtmsList = self.getNeighbourAtoms(atoms=atms, distLimMax=distance)
 
+        for atm, nearAtms in zip(atms, nearAtmsList):
             densList, distList = [], []
             i = -1
             for nearAtm in nearAtms['atoms']:
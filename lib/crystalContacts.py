@@ -0,0 +1,286 @@
+from __future__ import division
+from scipy.spatial import cKDTree
+from fractions import Fraction
+import os
+import re
+import numpy as np
+
+# in-process search for contacts between the atoms of a model and all
+# atoms of the crystal, including the symmetry-related copies of the
+# model (as previously found with the CCP4 program NCONT). The
+# symmetry operators of a space group are read from the CCP4 syminfo.lib
+# file, and the unit cell from the CRYST1 record (or mmCIF cell items)
+# of the coordinate file.
+#
+# Only the symmetry images (copies of the model under each operator and
+# lattice translation) that lie within the contact distance of the
+# query atoms are generated. These are found in fractional coordinates,
+# in which each lattice translation is a shift by whole cells, such that
+# the cells to consider for each operator follow from the fractional
+# bounds of the model and its image. A single k-d tree over the
+# generated images then answers all contact queries in one batch. The
+# images are held in cartesian coordinates, such that the search holds
+# for any (including non-orthogonal) unit cell
+
+# the CCP4 symmetry library, found from the SYMINFO environment variable
+# or within the CCP4 library directory (CLIBD)
+symInfoLibName = 'syminfo.lib'
+
+
+def symInfoFileName():
+
+    # the CCP4 symmetry library file, or None if not found
+
+    if os.path.isfile(os.environ.get('SYMINFO', '')):
+        return os.environ['SYMINFO']
+    fileName = os.path.join(os.environ.get('CLIBD', ''), symInfoLibName)
+    if os.path.isfile(fileName):
+        return fileName
+
+    return None
+
+
+def spaceGroupKey(name=''):
+
+    # a space group name or number in a form for matching (without
+    # spaces or quotes, and in upper case)
+
+    return str(name).replace(' ', '').replace("'", '').upper()
+
+
+def readSymOps(spaceGroup='', symInfoFile=None):
+
+    # the symmetry operators (as strings, e.g. '-x+1/2,-y,z+1/2') of a
+    # space group, from a CCP4 syminfo.lib file. The space group may be
+    # given by number, or by any of its CCP4, Hermann-Mauguin or older
+    # symbols (with or without spaces). Each operator is combined with
+    # each centring operator. Returns [] if the space group is not found
+
+    if symInfoFile is None:
+        symInfoFile = symInfoFileName()
+    if symInfoFile is None:
+        return []
+
+    key = spaceGroupKey(spaceGroup)
+    with open(symInfoFile, 'r') as symInfo:
+        names, symOps, cenOps = [], [], []
+        for line in symInfo:
+            line = line.strip()
+            if line.startswith('begin_spacegroup'):
+                names, symOps, cenOps = [], [], []
+            elif line.startswith('number'):
+                names.append(line.split()[1])
+            elif line.startswith('symbol'):
+                fields = line.split(None, 2)
+                if fields[1] in ('ccp4', 'xHM', 'old'):
+                    names += re.findall(r"'([^']*)'", fields[2]) or \
+                        fields[2:]
+            elif line.startswith('symop'):
+                symOps.append(line.split()[1])
+            elif line.startswith('cenop'):
+                cenOps.append(line.split()[1])
+            elif line.startswith('end_spacegroup'):
+                if key in [spaceGroupKey(n) for n in names]:
+                    break
+        else:
+            return []
+
+    return [combineSymOps(symOp, cenOp) for cenOp in cenOps
+            for symOp in symOps]
+
+
+def parseSymOp(symOp=''):
+
+    # the rotation (3 x 3) and translation (3) parts of a symmetry
+    # operator string, acting on fractional coordinates
+
+    rotation = np.zeros((3, 3))
+    translation = np.zeros(3)
+    for i, expr in enumerate(symOp.lower().replace(' ', '').split(',')):
+        for sign, term in re.findall(r'([+-]?)([^+-]+)', expr):
+            factor = -1 if sign == '-' else 1
+            if term[-1] in 'xyz':
+                coeff = term[:-1].rstrip('*')
+                rotation[i, 'xyz'.index(term[-1])] += \
+                    factor*float(Fraction(coeff) if coeff else 1)
+            else:
+                translation[i] += factor*float(Fraction(term))
+
+    return rotation, translation
+
+
+def combineSymOps(symOp='', cenOp=''):
+
+    # the operator string for a symmetry operator followed by a
+    # centring operator
+
+    rot1, trans1 = parseSymOp(symOp)
+    rot2, trans2 = parseSymOp(cenOp)
+
+    return formatSymOp(np.dot(rot2, rot1), np.dot(rot2, trans1) + trans2)
+
+
+def formatSymOp(rotation=[], translation=[]):
+
+    # the operator string for a rotation and translation (with the
+    # translation reduced to within a single cell)
+
+    exprs = []
+    for row, trans in zip(rotation, np.mod(translation, 1)):
+        expr = ''
+        for coeff, axis in zip(row, 'xyz'):
+            if coeff != 0:
+                expr += '{}{}{}'.format(
+                    '-' if coeff < 0 else '+',
+                    '' if abs(coeff) == 1 else
+                    '{}*'.format(Fraction(abs(coeff)).limit_denominator(12)),
+                    axis)
+        if trans != 0:
+            expr += '+{}'.format(Fraction(trans).limit_denominator(12))
+        exprs.append(expr.lstrip('+'))
+
+    return ','.join(exprs)
+
+
+def orthogonalisationMatrix(cell=[]):
+
+    # the matrix converting fractional to cartesian coordinates for the
+    # unit cell (a, b, c, alpha, beta, gamma), in the standard pdb
+    # convention (a along x, b within the xy plane)
+
+    a, b, c = cell[:3]
+    cosA, cosB, cosG = np.cos(np.radians(cell[3:6]))
+    sinG = np.sin(np.radians(cell[5]))
+    volume = a*b*c*np.sqrt(1 - cosA**2 - cosB**2 - cosG**2 +
+                           2*cosA*cosB*cosG)
+
+    return np.array([[a, b*cosG, c*cosB],
+                     [0, b*sinG, c*(cosA - cosB*cosG)/sinG],
+                     [0, 0, volume/(a*b*sinG)]])
+
+
+class crystalContacts(object):
+
+    # contacts between query points and the atoms of a crystal, built
+    # from the model atom coordinates 'coords', the unit cell 'cell' and
+    # symmetry operator strings 'symOps'. If given, 'groups' holds an
+    # integer group label (e.g. residue) per atom, such that atoms of the
+    # model itself (not a symmetry image) in the same group as a query
+    # point can be excluded. See the module description above
+
+    def __init__(self,
+                 coords=[], cell=[], symOps=[], groups=None):
+
+        self.coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+        self.symOps = list(symOps)
+        self.groups = groups if groups is None else np.asarray(groups)
+
+        self.orthMatrix = orthogonalisationMatrix(cell)
+        self.fracMatrix = np.linalg.inv(self.orthMatrix)
+        self.fracCoords = np.dot(self.coords, self.fracMatrix.T)
+
+        self.rotations, self.translations = [], []
+        for symOp in self.symOps:
+            rotation, translation = parseSymOp(symOp)
+            self.rotations.append(rotation)
+            self.translations.append(translation)
+
+    def isModelImage(self,
+                     opIndex=0, shift=[]):
+
+        # whether a symmetry image is the model itself (the identity
+        # operator without lattice translation)
+
+        return (np.array_equal(self.rotations[opIndex], np.eye(3)) and
+                np.allclose(self.translations[opIndex] + shift, 0))
+
+    def getImagesNearPoints(self,
+                            points=[], distLimMax=4):
+
+        # the symmetry images of the model atoms within the fractional
+        # bounds of 'points' extended by 'distLimMax'. Returns the model
+        # atom index, operator index, lattice translation (as an
+        # (images x 3) array) and coordinates of each image atom, and
+        # whether it belongs to the model itself (see isModelImage)
+
+        fracPoints = np.dot(points, self.fracMatrix.T)
+        # the extent in fractional coordinates of a sphere of radius
+        # 'distLimMax' is set by the lengths of the rows of fracMatrix
+        margin = distLimMax*np.sqrt(np.sum(self.fracMatrix**2, axis=1))
+        lower = fracPoints.min(axis=0) - margin
+        upper = fracPoints.max(axis=0) + margin
+
+        atomInds, opInds, shifts, inModel, imageCoords = [], [], [], [], []
+        for op, (rotation, translation) in enumerate(
+                zip(self.rotations, self.translations)):
+            image = np.dot(self.fracCoords, rotation.T) + translation
+            shiftRanges = [range(int(np.ceil(lower[k] - image[:, k].max())),
+                                 int(np.floor(upper[k] - image[:, k].min()))
+                                 + 1) for k in range(3)]
+            for i in shiftRanges[0]:
+                for j in shiftRanges[1]:
+                    for k in shiftRanges[2]:
+                        shift = np.array([i, j, k])
+                        shifted = image + shift
+                        near = np.flatnonzero(np.all(
+                            (shifted >= lower) & (shifted <= upper), axis=1))
+                        if len(near) == 0:
+                            continue
+                        atomInds.append(near)
+                        opInds.append(np.full(len(near), op, dtype=np.int64))
+                        shifts.append(np.tile(shift, (len(near), 1)))
+                        inModel.append(np.full(
+                            len(near), self.isModelImage(op, shift),
+                            dtype=bool))
+                        imageCoords.append(np.dot(shifted[near],
+                                                  self.orthMatrix.T))
+
+        if len(atomInds) == 0:
+            return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+                    np.zeros((0, 3), dtype=np.int64), np.zeros(0, dtype=bool),
+                    np.zeros((0, 3)))
+
+        return (np.concatenate(atomInds), np.concatenate(opInds),
+                np.concatenate(shifts), np.concatenate(inModel),
+                np.concatenate(imageCoords))
+
+    def withinDist(self,
+                   points=[], distLimMax=4, distLimMin=0, pointGroups=None):
+
+        # for each query point, the crystal atoms at a distance greater
+        # than 'distLimMin' and less than 'distLimMax'. If 'pointGroups'
+        # is given (a group label per point), atoms of the model itself in
+        # the same group as the point are excluded. Returns a list of
+        # (model atom indices, operator indices, lattice translations,
+        # distances) per point, with contacts ordered by distance
+
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+                 np.zeros((0, 3), dtype=np.int64), np.zeros(0))
+        if len(points) == 0 or len(self.coords) == 0:
+            return [empty for p in points]
+
+        atomInds, opInds, shifts, inModel, imageCoords = \
+            self.getImagesNearPoints(points=points, distLimMax=distLimMax)
+        if len(atomInds) == 0:
+            return [empty for p in points]
+
+        tree = cKDTree(imageCoords)
+        found = tree.query_ball_point(points, r=distLimMax*(1 + 1e-9) + 1e-9)
+
+        contacts = []
+        for i, point in enumerate(points):
+            inds = np.asarray(found[i], dtype=np.int64)
+            dists = np.sqrt(np.sum(np.square(imageCoords[inds] - point),
+                                   axis=1))
+            keep = (dists < distLimMax) & (dists > distLimMin)
+            if pointGroups is not None and self.groups is not None:
+                keep &= ~(inModel[inds] &
+                          (self.groups[atomInds[inds]] == pointGroups[i]))
+            inds, dists = inds[keep], dists[keep]
+            order = np.argsort(dists, kind='mergesort')
+            inds, dists = inds[order], dists[order]
+            contacts.append((atomInds[inds], opInds[inds], shifts[inds],
+                             dists))
+
+        return contacts
@@ -0,0 +1,136 @@
+from __future__ import division
+from columnarFile import columnarFile, writeColumnarFile
+from atomTagMap import mapInfoHeader, mapInfoFromHeader
+from segmentedStats import voxelGrouping
+import os
+import numpy as np
+
+# a store of the density map values at the atom-tagged voxels, for every
+# dataset of a damage series (processed with a single atom-tagged map).
+# New per-atom metrics, plots or training sets can then be found from the
+# store, without rereading the density maps themselves. A store consists
+# of two files:
+#   - <storeName>.npy: a (voxels x datasets) float32 matrix of density
+#     values, with voxels in the order of the atom-tagged map voxels. The
+#     matrix is Fortran-ordered, such that each dataset is held as one
+#     contiguous block and is written (or read) as a unit, as each
+#     dataset is processed. The matrix is memory-mapped on reading
+#   - <storeName>.col: a columnar file (see columnarFile.py) holding the
+#     linear map index and atom number of each voxel, the grouping of
+#     the voxels by atom (see segmentedStats.voxelGrouping), the atom map
+#     header information and the density map name of each dataset
+
+
+def densitySampleFileNames(storeName=''):
+
+    # the matrix and index files of a density sample store
+
+    return storeName + '.npy', storeName + '.col'
+
+
+def createDensitySampleStore(storeName='', atomMap=None, atomIndices=[],
+                             grouping=None, dsetNames=[], doses=[]):
+
+    # create an (empty) density sample store for the atom-tagged map voxels
+    # (with header 'atomMap', linear indices 'atomIndices' and grouping
+    # 'grouping') and for the density maps 'dsetNames'. Any existing store
+    # of the same name is replaced
+
+    matrixName, indexName = densitySampleFileNames(storeName)
+
+    header = mapInfoHeader(atomMap)
+    header['datasets'] = list(dsetNames)
+    header['doses'] = [float(d) for d in doses]
+    columns = {'voxelIndices': atomIndices,
+               'atomNums': atomMap.vxls_val,
+               'order': grouping.order, 'keys': grouping.keys,
+               'starts': grouping.starts, 'counts': grouping.counts}
+    writeColumnarFile(fileName=indexName, columns=columns, header=header)
+
+    if os.path.exists(matrixName):
+        os.remove(matrixName)
+    np.lib.format.open_memmap(matrixName, mode='w+', dtype=np.float32,
+                              shape=(len(atomIndices), len(dsetNames)),
+                              fortran_order=True)
+
+
+def writeDensitySamples(storeName='', dsetName='', vals=[]):
+
+    # write the density values at the atom-tagged voxels for the dataset
+    # with density map 'dsetName'. Each dataset is written separately,
+    # such that datasets can be written from separate processes
+
+    matrixName, indexName = densitySampleFileNames(storeName)
+    dsetNames = columnarFile(fileName=indexName, mmap=False).header[
+        'datasets']
+
+    matrix = np.lib.format.open_memmap(matrixName, mode='r+')
+    matrix[:, dsetNames.index(dsetName)] = vals
+    matrix.flush()
+    del matrix
+
+
+class densitySampleStore(object):
+
+    # read access to a density sample store (see module description)
+
+    def __init__(self,
+                 storeName=''):
+
+        self.storeName = storeName
+        matrixName, indexName = densitySampleFileNames(storeName)
+        index = columnarFile(fileName=indexName, mmap=True)
+
+        # the atom-tagged map header information (as a MapInfo object,
+        # with the atom number of each voxel as vxls_val)
+        self.atomMap = mapInfoFromHeader(index.header)
+        self.atomMap.vxls_val = index.getColumn('atomNums')
+
+        # the linear map index of each voxel
+        self.voxelIndices = index.getColumn('voxelIndices')
+
+        # the grouping of the voxels by atom number
+        self.grouping = voxelGrouping(
+            layout=[index.getColumn(name) for name in
+                    ('order', 'keys', 'starts', 'counts')])
+
+        # the density map name and dose of each dataset
+        self.datasets = [str(d) for d in index.header['datasets']]
+        self.doses = index.header['doses']
+
+        # the (voxels x datasets) density value matrix
+        self.samples = np.load(matrixName, mmap_mode='r')
+
+    def getNumDatasets(self):
+        return len(self.datasets)
+
+    def getDatasetIndex(self,
+                        dsetName=''):
+        return self.datasets.index(dsetName)
+
+    def getDataset(self,
+                   dsetIndex=0):
+
+        # the density values of a single dataset, in voxel order
+
+        return self.samples[:, dsetIndex]
+
+    def groupDataset(self,
+                     dsetIndex=0):
+
+        # the density values of a single dataset grouped by atom number,
+        # as used for the per-atom metrics (see voxelGrouping.group)
+
+        return self.grouping.group(self.getDataset(dsetIndex))
+
+    def getAtomSamples(self,
+                       atomNum=0):
+
+        # the density values of all voxels of a single atom, for every
+        # dataset (as a voxels x datasets array)
+
+        i = self.grouping.segIndex[atomNum]
+        start = self.grouping.starts[i]
+        rows = self.grouping.order[start:start + self.grouping.counts[i]]
+
+        return self.samples[rows, :]
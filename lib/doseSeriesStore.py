@@ -0,0 +1,514 @@
+from columnarFile import lazyColumns, pickledColumn, unpickleColumn
+import numpy as np
+
+
+class doseSeriesStore(object):
+
+    # a columnar store of per-atom density metrics over a damage series.
+    # For each (metric, normalisation type) pair, the values for all atoms
+    # are held in one contiguous float array of shape atoms x datasets,
+    # with per-atom averages and linear regression statistics held as
+    # per-atom columns. Typed identity columns (chain, residue number,
+    # residue type, atom type and atom number) allow whole-structure
+    # selections to be made as array expressions. Each combinedAtom
+    # refers to a single row of a store, through which its densMetric
+    # dictionary is provided as a view (see densMetricView below)
+
+    identityAttrs = ['chaintype', 'residuenum', 'basetype', 'atomtype',
+                     'atomnum']
+
+    def __init__(self,
+                 numAtoms=0, numDatasets=0):
+
+        # number of atoms (rows) in the store
+        self.numAtoms = numAtoms
+
+        # number of datasets (columns) per metric
+        self.numDatasets = numDatasets
+
+        # per-dataset values: {metric: {normType: atoms x datasets array}}
+        self.values = {}
+
+        # average over datasets: {metric: {normType: per-atom array}}
+        self.average = {}
+
+        # linear regression stats: {metric: {normType: {stat: array}}}
+        self.linReg = {}
+
+        # any other per-atom entries (e.g. half-dose fits), which are not
+        # suited to a columnar form: {metric: {normType: {row: {key: val}}}}
+        self.extras = {}
+
+        # identity columns: {attribute: per-atom array}
+        self.identity = {}
+
+    def setIdentity(self,
+                    atoms=[]):
+
+        # fill the typed identity columns from a list of atoms,
+        # ordered by row
+
+        for attr in self.identityAttrs:
+            self.identity[attr] = np.array([getattr(a, attr) for a in atoms])
+
+    def getMetrics(self):
+
+        # list of metrics with any stored information
+
+        metrics = []
+        for d in (self.values, self.average, self.linReg, self.extras):
+            for metric in d:
+                if metric not in metrics:
+                    metrics.append(metric)
+        return metrics
+
+    def getNormTypes(self,
+                     metric='loss'):
+
+        # list of normalisation types with any stored information for metric
+
+        normTypes = []
+        for d in (self.values, self.average, self.linReg, self.extras):
+            for normType in d.get(metric, {}):
+                if normType not in normTypes:
+                    normTypes.append(normType)
+        return normTypes
+
+    def getValues(self,
+                  metric='loss', normType='Standard'):
+
+        # the atoms x datasets array of values for a metric. Raises
+        # KeyError if the metric has not been stored
+
+        return self.values[metric][normType]
+
+    def setValues(self,
+                  metric='loss', normType='Standard', values=[], rows=None):
+
+        # set the values of a metric for all atoms (an atoms x datasets
+        # array) or for the atoms in 'rows' only. Atoms not set
+        # take nan values
+
+        values = np.asarray(values, dtype=np.float64)
+
+        if metric not in self.values:
+            self.values[metric] = {}
+        if normType not in self.values[metric]:
+            self.values[metric][normType] = np.full(
+                (self.numAtoms, self.numDatasets), np.nan)
+
+        if rows is None:
+            self.values[metric][normType][:] = values
+        else:
+            self.values[metric][normType][rows] = values
+
+    def getColumn(self,
+                  columns={}, metric='loss', normType='Standard'):
+
+        # a per-atom column from 'columns' (either averages or a single
+        # linear regression stat). Raises KeyError if not stored
+
+        return columns[metric][normType]
+
+    def setColumn(self,
+                  columns={}, metric='loss', normType='Standard', vals=[],
+                  rows=None):
+
+        # set a per-atom column within 'columns' (either averages or a
+        # single linear regression stat) for all atoms or those in 'rows'
+
+        if metric not in columns:
+            columns[metric] = {}
+        if normType not in columns[metric]:
+            columns[metric][normType] = np.full(self.numAtoms, np.nan)
+
+        if rows is None:
+            columns[metric][normType][:] = vals
+        else:
+            columns[metric][normType][rows] = vals
+
+    def getAverage(self,
+                   metric='loss', normType='Standard'):
+        return self.getColumn(self.average, metric, normType)
+
+    def setAverage(self,
+                   metric='loss', normType='Standard', vals=[], rows=None):
+        self.setColumn(self.average, metric, normType, vals, rows)
+
+    def getLinReg(self,
+                  metric='loss', normType='Standard'):
+
+        # dictionary of per-atom linear regression stat columns
+
+        return self.linReg[metric][normType]
+
+    def setLinReg(self,
+                  metric='loss', normType='Standard', stats={}, rows=None):
+
+        # set per-atom linear regression stats, where 'stats' is a
+        # dictionary of stat name to per-atom values
+
+        if metric not in self.linReg:
+            self.linReg[metric] = {}
+
+        # stat columns are nested one level below the normalisation type
+        for stat, vals in stats.items():
+            self.setColumn(self.linReg[metric], normType, stat, vals, rows)
+
+    def getExtras(self,
+                  metric='loss', normType='Standard', row=0):
+
+        # dictionary of other stored entries for a single atom
+
+        return self.extras.get(metric, {}).get(normType, {}).get(row, {})
+
+    def setExtra(self,
+                 metric='loss', normType='Standard', row=0, key='', val=None):
+
+        # set another (non-columnar) entry for a single atom
+
+        if metric not in self.extras:
+            self.extras[metric] = {}
+        if normType not in self.extras[metric]:
+            self.extras[metric][normType] = {}
+        if row not in self.extras[metric][normType]:
+            self.extras[metric][normType][row] = {}
+        self.extras[metric][normType][row][key] = val
+
+    def getEntryKeys(self,
+                     metric='loss', normType='Standard', row=0):
+
+        # the entries (e.g. 'values', 'average', 'lin reg') stored for a
+        # single atom for a metric and normalisation type
+
+        keys = []
+        if normType in self.values.get(metric, {}):
+            keys.append('values')
+        if normType in self.average.get(metric, {}):
+            keys.append('average')
+        if normType in self.linReg.get(metric, {}):
+            keys.append('lin reg')
+        for key in self.getExtras(metric, normType, row):
+            if key not in keys:
+                keys.append(key)
+        return keys
+
+    def getEntry(self,
+                 metric='loss', normType='Standard', row=0, key='values'):
+
+        # a single stored entry for a single atom. Per-dataset values are
+        # returned as a view into the store. Raises KeyError if not stored
+
+        extras = self.getExtras(metric, normType, row)
+        if key in extras:
+            return extras[key]
+        if key == 'values':
+            return self.getValues(metric, normType)[row]
+        if key == 'average':
+            return self.getAverage(metric, normType)[row]
+        if key == 'lin reg':
+            stats = self.getLinReg(metric, normType)
+            return {stat: stats[stat][row] for stat in stats}
+        raise KeyError(key)
+
+    def setEntry(self,
+                 metric='loss', normType='Standard', row=0, key='values',
+                 val=None):
+
+        # set a single entry for a single atom. Per-dataset values of a
+        # length other than the number of datasets are held separately
+
+        if key == 'values':
+            if self.numAtoms == 1 and self.numDatasets == 0:
+                self.numDatasets = len(val)
+            if len(val) == self.numDatasets:
+                self.setValues(metric, normType, val, rows=row)
+                self.getExtras(metric, normType, row).pop('values', None)
+                return
+        elif key == 'average':
+            self.setAverage(metric, normType, val, rows=row)
+            return
+        elif key == 'lin reg':
+            self.setLinReg(metric, normType, val, rows=row)
+            return
+        self.setExtra(metric, normType, row, key, val)
+
+    def addRowsFrom(self,
+                    store=None, rowMap=[]):
+
+        # copy all stored information from another store into this one,
+        # where row i of 'store' becomes row rowMap[i] of this store
+
+        rowMap = np.asarray(rowMap)
+        if self.numDatasets == 0:
+            self.numDatasets = store.numDatasets
+        for metric, normTypes in store.values.items():
+            for normType, vals in normTypes.items():
+                if vals.shape[1] == self.numDatasets:
+                    self.setValues(metric, normType, vals, rows=rowMap)
+                else:
+                    for i, row in enumerate(rowMap):
+                        self.setExtra(metric, normType, row, 'values',
+                                      list(vals[i]))
+        for metric, normTypes in store.average.items():
+            for normType, vals in normTypes.items():
+                self.setAverage(metric, normType, vals, rows=rowMap)
+        for metric, normTypes in store.linReg.items():
+            for normType, stats in normTypes.items():
+                self.setLinReg(metric, normType, stats, rows=rowMap)
+        for metric, normTypes in store.extras.items():
+            for normType, rows in normTypes.items():
+                for row, entries in rows.items():
+                    for key, val in entries.items():
+                        self.setEntry(metric, normType, rowMap[row], key, val)
+
+
+def consolidateStores(atoms=[]):
+
+    # move the densMetric information of a list of atoms into a single
+    # shared store (with one row per atom, in list order) if the atoms
+    # do not already share one. Returns the shared store
+
+    if len(atoms) == 0:
+        return doseSeriesStore()
+
+    store = atoms[0].store
+    if all(a.store is store for a in atoms):
+        return store
+
+    numDatasets = max(a.store.numDatasets for a in atoms)
+    newStore = doseSeriesStore(numAtoms=len(atoms), numDatasets=numDatasets)
+
+    # atoms sharing an old store are copied across together
+    byStore = {}
+    for i, a in enumerate(atoms):
+        key = id(a.store)
+        if key not in byStore:
+            byStore[key] = (a.store, {})
+        byStore[key][1][a.row] = i
+    for oldStore, rowMap in byStore.values():
+        oldRows = list(rowMap.keys())
+        newStore.addRowsFrom(store=subsetStore(oldStore, oldRows),
+                             rowMap=[rowMap[r] for r in oldRows])
+
+    newStore.setIdentity(atoms)
+    for i, a in enumerate(atoms):
+        a.store = newStore
+        a.row = i
+
+    return newStore
+
+
+def subsetStore(store=None, rows=[]):
+
+    # a new store holding only the rows 'rows' of 'store' (in that order)
+
+    rows = np.asarray(rows, dtype=np.int64)
+    oldToNew = {r: i for i, r in enumerate(rows.tolist())}
+    new = doseSeriesStore(numAtoms=len(rows), numDatasets=store.numDatasets)
+    for metric, normTypes in store.values.items():
+        for normType, vals in normTypes.items():
+            new.setValues(metric, normType, vals[rows])
+    for metric, normTypes in store.average.items():
+        for normType, vals in normTypes.items():
+            new.setAverage(metric, normType, vals[rows])
+    for metric, normTypes in store.linReg.items():
+        for normType, stats in normTypes.items():
+            new.setLinReg(metric, normType,
+                          {s: v[rows] for s, v in stats.items()})
+    for metric, normTypes in store.extras.items():
+        for normType, oldRows in normTypes.items():
+            for row, entries in oldRows.items():
+                if row in oldToNew:
+                    for key, val in entries.items():
+                        new.setExtra(metric, normType, oldToNew[row], key,
+                                     val)
+    return new
+
+
+def storeToColumns(store=None, columns={}, prefix='store'):
+
+    # add the arrays of a store to 'columns', for saving in columnar form
+    # (see columnarFile). Entries without a columnar form (see extras
+    # above) are pickled into a single byte array. Returns the layout of
+    # the store, to be kept in the file header (see storeFromColumns)
+
+    info = {'numAtoms': store.numAtoms, 'numDatasets': store.numDatasets,
+            'values': [], 'average': [], 'linReg': [], 'identity': []}
+
+    for key, d in (('values', store.values), ('average', store.average)):
+        for metric, normTypes in d.items():
+            for normType, vals in normTypes.items():
+                colName = '{}.{}.{}'.format(prefix, key, len(info[key]))
+                columns[colName] = vals
+                info[key].append([metric, normType, colName])
+    for metric, normTypes in store.linReg.items():
+        for normType, stats in normTypes.items():
+            for stat, vals in stats.items():
+                colName = '{}.linReg.{}'.format(prefix, len(info['linReg']))
+                columns[colName] = vals
+                info['linReg'].append([metric, normType, stat, colName])
+    for attr, vals in store.identity.items():
+        colName = '{}.identity.{}'.format(prefix, attr)
+        columns[colName] = vals
+        info['identity'].append([attr, colName])
+    if store.extras:
+        columns[prefix + '.extras'] = pickledColumn(store.extras)
+        info['extras'] = prefix + '.extras'
+
+    return info
+
+
+def storeFromColumns(colFile=None, info={}):
+
+    # rebuild a store from a columnar file, given the layout returned by
+    # storeToColumns. Identity columns are read immediately, while each
+    # metric array is only read from file on first access (see
+    # lazyColumns), such that only the metrics used are read
+
+    store = doseSeriesStore(numAtoms=info['numAtoms'],
+                            numDatasets=info['numDatasets'])
+
+    colNames = {'values': {}, 'average': {}, 'linReg': {}}
+    for key in ('values', 'average'):
+        for metric, normType, colName in info[key]:
+            colNames[key].setdefault(metric, {})[normType] = colName
+    for metric, normType, stat, colName in info['linReg']:
+        colNames['linReg'].setdefault(metric, {}).setdefault(
+            normType, {})[stat] = colName
+
+    for metric, normTypes in colNames['values'].items():
+        store.values[metric] = lazyColumns(colFile, normTypes)
+    for metric, normTypes in colNames['average'].items():
+        store.average[metric] = lazyColumns(colFile, normTypes)
+    for metric, normTypes in colNames['linReg'].items():
+        store.linReg[metric] = {normType: lazyColumns(colFile, stats)
+                                for normType, stats in normTypes.items()}
+    for attr, colName in info['identity']:
+        store.identity[attr] = colFile.getColumn(colName)
+    if 'extras' in info:
+        store.extras = unpickleColumn(colFile.getColumn(info['extras']))
+
+    return store
+
+
+def getDensMetricArray(atoms=[], metric='loss', normType='Standard'):
+
+    # per-dataset values of a metric for a list of atoms, as an atoms x
+    # datasets array ordered as 'atoms'. Where the atoms share a store,
+    # this is read directly from the store array (without a copy if the
+    # atoms are in row order)
+
+    if len(atoms) == 0:
+        return np.empty((0, 0))
+
+    store = atoms[0].store
+    if not all(a.store is store for a in atoms):
+        return np.array([a.densMetric[metric][normType]['values']
+                         for a in atoms], dtype=np.float64)
+
+    vals = store.getValues(metric, normType)
+    rows = np.array([a.row for a in atoms], dtype=np.int64)
+    if len(rows) == store.numAtoms and np.all(rows == np.arange(len(rows))):
+        return vals
+    return vals[rows]
+
+
+class storeView(object):
+
+    # base class for read/write dictionary-style views onto a store.
+    # Subclasses provide keys, __getitem__ and __setitem__
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __len__(self):
+        return len(self.keys())
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def values(self):
+        return [self[k] for k in self.keys()]
+
+    def update(self, other={}):
+        for k, v in other.items():
+            self[k] = v
+
+
+class densMetricView(storeView):
+
+    # atom.densMetric: a view of one row of a store, keyed by metric
+
+    def __init__(self,
+                 store=None, row=0):
+
+        self.store = store
+        self.row = row
+
+    def keys(self):
+        return self.store.getMetrics()
+
+    def __getitem__(self, metric):
+        if metric not in self.store.getMetrics():
+            raise KeyError(metric)
+        return metricView(self.store, self.row, metric)
+
+    def __setitem__(self, metric, normTypes):
+        metricView(self.store, self.row, metric).update(normTypes)
+
+
+class metricView(storeView):
+
+    # atom.densMetric[metric]: keyed by normalisation type
+
+    def __init__(self,
+                 store=None, row=0, metric='loss'):
+
+        self.store = store
+        self.row = row
+        self.metric = metric
+
+    def keys(self):
+        return self.store.getNormTypes(self.metric)
+
+    def __getitem__(self, normType):
+        if normType not in self.store.getNormTypes(self.metric):
+            raise KeyError(normType)
+        return normTypeView(self.store, self.row, self.metric, normType)
+
+    def __setitem__(self, normType, entries):
+        normTypeView(self.store, self.row, self.metric, normType).update(
+            entries)
+
+
+class normTypeView(storeView):
+
+    # atom.densMetric[metric][normType]: keyed by entry type
+    # ('values', 'average', 'lin reg' or any other stored entry)
+
+    def __init__(self,
+                 store=None, row=0, metric='loss', normType='Standard'):
+
+        self.store = store
+        self.row = row
+        self.metric = metric
+        self.normType = normType
+
+    def keys(self):
+        return self.store.getEntryKeys(self.metric, self.normType, self.row)
+
+    def __getitem__(self, key):
+        return self.store.getEntry(self.metric, self.normType, self.row, key)
+
+    def __setitem__(self, key, val):
+        self.store.setEntry(self.metric, self.normType, self.row, key, val)
@@ -0,0 +1,195 @@
+from __future__ import division
+from columnarFile import columnarFile, writeColumnarFile
+import hashlib
+import json
+import os
+
+# a cache of parsed input files (atom-tagged maps, Fcalc map values and
+# coordinate files), held as columnar files (see columnarFile.py) within
+# a cache directory. Each cache entry is keyed by the kind of entry and
+# the content hashes of the files it was parsed from, such that entries
+# are reused for any byte-identical input (e.g. the same maps reread on
+# a rerun of the metric calculation, or identical maps for different
+# datasets of a series) and are never reused once an input changes.
+# Entries are memory-mapped on reading. The total size of the entries
+# is capped, with the least recently used entries removed first
+#
+# Content hashes are themselves recorded in the cache directory against
+# the size and modification time of each hashed file, such that an
+# unchanged file is not reread to find its hash
+
+# version of the layout of the cache entries. Entries written with a
+# different version are never read (and are eventually evicted)
+cacheVersion = 1
+
+# the default cap on the total size of the cache entries (GB)
+defaultCacheSize = 2.0
+
+cacheEntryExt = '.col'
+hashIndexName = 'fileHashes.json'
+
+
+def fileContentHash(fileName='', blockSize=2**22):
+
+    # the SHA-1 hash of the contents of a file, read in blocks
+
+    digest = hashlib.sha1()
+    with open(fileName, 'rb') as f:
+        for block in iter(lambda: f.read(blockSize), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+class fileCache(object):
+
+    # a size-capped cache of parsed input files, held in 'cacheDir'. See
+    # the module description above
+
+    def __init__(self,
+                 cacheDir='./', cacheSize=defaultCacheSize, log=''):
+
+        # the cache directory (created if not present)
+        self.cacheDir = cacheDir
+
+        # the cap on the total size of the cache entries (bytes)
+        self.maxBytes = int(cacheSize*1e9)
+
+        # log file object
+        self.log = log
+
+        # file path to [size, modification time, content hash]
+        self.hashes = {}
+
+        if not os.path.isdir(self.cacheDir):
+            os.makedirs(self.cacheDir)
+        self.readHashIndex()
+
+    def readHashIndex(self):
+
+        # read the content hashes recorded in the cache directory. An
+        # unreadable index is ignored (and the files rehashed)
+
+        try:
+            with open(self.cacheDir + hashIndexName, 'r') as f:
+                self.hashes = json.load(f)
+        except (IOError, OSError, ValueError):
+            self.hashes = {}
+
+    def writeHashIndex(self):
+
+        # record the content hashes in the cache directory. The index is
+        # replaced as a whole, such that it is never read part-written
+
+        tmpName = '{}{}.{}.tmp'.format(self.cacheDir, hashIndexName,
+                                       os.getpid())
+        with open(tmpName, 'w') as f:
+            json.dump(self.hashes, f)
+        self.replaceFile(tmpName, self.cacheDir + hashIndexName)
+
+    def fileHash(self,
+                 fileName=''):
+
+        # the content hash of a file, only reading the file where it has
+        # changed size or modification time since last hashed
+
+        path = os.path.abspath(fileName)
+        fileStat = os.stat(path)
+        stamp = [fileStat.st_size, fileStat.st_mtime]
+
+        recorded = self.hashes.get(path)
+        if recorded is not None and recorded[:2] == stamp:
+            return recorded[2]
+
+        digest = fileContentHash(path)
+        self.hashes[path] = stamp + [digest]
+        self.writeHashIndex()
+
+        return digest
+
+    def entryName(self,
+                  kind='', fileNames=[]):
+
+        # the cache file for an entry of type 'kind' parsed from the
+        # files 'fileNames' (in that order)
+
+        digest = hashlib.sha1('{}:{}'.format(kind, cacheVersion).encode())
+        for fileName in fileNames:
+            digest.update(self.fileHash(fileName).encode())
+
+        return '{}{}_{}{}'.format(self.cacheDir, kind, digest.hexdigest(),
+                                  cacheEntryExt)
+
+    def get(self,
+            kind='', fileNames=[]):
+
+        # a cache entry as a (memory-mapped) columnarFile, or None if no
+        # entry exists for the current contents of 'fileNames'
+
+        entryName = self.entryName(kind=kind, fileNames=fileNames)
+        if not os.path.exists(entryName):
+            return None
+        try:
+            entry = columnarFile(fileName=entryName, mmap=True)
+        except (IOError, OSError, ValueError):
+            return None
+
+        # mark the entry as recently used
+        os.utime(entryName, None)
+
+        return entry
+
+    def put(self,
+            kind='', fileNames=[], columns={}, header={}):
+
+        # add an entry to the cache, then remove the least recently used
+        # entries while the cache is above its size cap. The entry is
+        # written under a temporary name, such that an entry is never
+        # read part-written
+
+        entryName = self.entryName(kind=kind, fileNames=fileNames)
+        tmpName = '{}.{}.tmp'.format(entryName, os.getpid())
+        writeColumnarFile(fileName=tmpName, columns=columns, header=header)
+        self.replaceFile(tmpName, entryName)
+        self.evict(keep=entryName)
+
+    def evict(self,
+              keep=''):
+
+        # remove the least recently used entries (other than 'keep')
+        # until the total size of the cache is within its cap
+
+        entries = []
+        for fName in os.listdir(self.cacheDir):
+            if fName.endswith(cacheEntryExt):
+                path = self.cacheDir + fName
+                fileStat = os.stat(path)
+                entries.append((fileStat.st_mtime, fileStat.st_size, path))
+
+        totalSize = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if totalSize <= self.maxBytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                # e.g. an entry still open elsewhere on windows
+                continue
+            totalSize -= size
+
+            if self.log != '':
+                self.log.writeToLog(
+                    str='Cache entry removed (cache size cap of ' +
+                        '{} GB reached): {}'.format(self.maxBytes/1e9, path),
+                    strip=False)
+
+    def replaceFile(self,
+                    fileFrom='', fileTo=''):
+
+        # rename a file over any existing file
+
+        if os.path.exists(fileTo):
+            os.remove(fileTo)
+        os.rename(fileFrom, fileTo)
@@ -0,0 +1,220 @@
+from __future__ import division
+from segmentedStats import groupByKey, segmentedSum, segmentedMin,\
+    segmentedMax
+from scipy.stats import chi2
+import numpy as np
+
+# summary statistics of a per-atom metric for groups of atoms (e.g. per
+# atom type, residue type or chain), found for every group and every
+# dataset at once. The atoms are sorted by group once, such that each
+# group occupies a contiguous segment of the (atoms x datasets) metric
+# values, and each statistic is then a segmented reduction (see
+# segmentedStats.py) over all datasets together. Atoms not present
+# within a dataset are masked out of that dataset's groups.
+#
+# The statistics follow the per-group calculations of
+# combinedAtomList.getStats: the mean, (population) standard deviation,
+# skew and kurtosis (as scipy.stats 1.1.0 with bias=True), the asymmetry
+# score (see combinedAtomList.calcAsymmetryAboutZero), the number of
+# outliers (see combinedAtomList.calcNumOutliers, with the mode from a
+# 100-bin histogram of each group, binned as np.histogram) and a
+# normality test p-value (see combinedAtomList.testForNormality, found
+# here from the same moments).
+# Statistics that are undefined for a group (e.g. a normality test for
+# fewer than 20 atoms) are nan
+
+# the statistics of a grouped stats table, in the order reported
+groupedStatNames = ['mean', 'std', '#atoms', 'outliers', 'skew', 'kurtosis',
+                    'asymmetry score']
+
+# the number of histogram bins used to find the mode of each group
+numModeBins = 100
+
+# the minimum number of atoms for a normality test
+minNormalityTestAtoms = 20
+
+
+def groupedStatsTable(vals=[], present=None, groupCodes=[], numGroups=None):
+
+    # the statistics of the per-atom metric values 'vals' (atoms x
+    # datasets) for the groups 'groupCodes' (the group index of each
+    # atom), including in each dataset only the atoms marked in
+    # 'present' (atoms x datasets, all atoms by default). Returns a
+    # dictionary of (groups x datasets) arrays for each statistic, and
+    # of the first (lowest) atom index of each group in each dataset
+
+    vals = np.asarray(vals, dtype=np.float64)
+    if vals.ndim == 1:
+        vals = vals[:, np.newaxis]
+    if present is None:
+        present = np.ones(vals.shape, dtype=bool)
+    present = np.asarray(present, dtype=bool).reshape(vals.shape)
+    groupCodes = np.asarray(groupCodes, dtype=np.int64)
+    if numGroups is None:
+        numGroups = groupCodes.max() + 1 if len(groupCodes) > 0 else 0
+
+    numDsets = vals.shape[1]
+    table = {stat: np.full((numGroups, numDsets), np.nan)
+             for stat in groupedStatNames + ['normality']}
+    table['#atoms'] = np.zeros((numGroups, numDsets), dtype=np.int64)
+    table['firstAtom'] = np.full((numGroups, numDsets), len(groupCodes),
+                                 dtype=np.int64)
+    if len(groupCodes) == 0:
+        return table
+
+    # segments of atoms per group, with datasets as rows
+    order, keys, starts, counts = groupByKey(groupCodes)
+    v = vals[order].T
+    mask = present[order].T
+    segIds = np.repeat(np.arange(len(keys)), counts)
+
+    num = segmentedSum(mask.astype(np.int64), starts)
+    table['#atoms'][keys] = num.T
+    table['firstAtom'][keys] = segmentedMin(
+        np.where(mask, order, len(groupCodes)), starts).T
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        # central moments (about the group mean)
+        mean = segmentedSum(np.where(mask, v, 0), starts)/num
+        devs = np.where(mask, v - mean[:, segIds], 0)
+        m2 = segmentedSum(devs**2, starts)/num
+        m3 = segmentedSum(devs**3, starts)/num
+        m4 = segmentedSum(devs**4, starts)/num
+
+        # skew and kurtosis are 0 and -3 for groups of (numerically) zero
+        # variance, including single atoms (see zeroVariance)
+        zeroVar = zeroVariance(mean=mean, m2=m2)
+        skew = np.where(zeroVar, 0, m3/m2**1.5)
+        kurtosis = np.where(zeroVar, 0, m4/m2**2) - 3
+        table['mean'][keys] = mean.T
+        table['std'][keys] = np.sqrt(m2).T
+        table['skew'][keys] = skew.T
+        table['kurtosis'][keys] = kurtosis.T
+
+        # asymmetry score: the sum of positive values over the sum of
+        # the magnitudes of the other values (undefined if all values
+        # are positive)
+        above = mask & (v > 0)
+        below = mask & ~(v > 0)
+        aboveSum = segmentedSum(np.where(above, v, 0), starts)
+        belowSum = segmentedSum(np.where(below, np.abs(v), 0), starts)
+        numBelow = segmentedSum(below.astype(np.int64), starts)
+        table['asymmetry score'][keys] = np.where(
+            numBelow > 0, aboveSum/belowSum, np.nan).T
+
+        table['outliers'][keys] = groupedNumOutliers(
+            v=v, mask=mask, starts=starts, segIds=segIds).T
+
+        table['normality'][keys] = normalityPValues(
+            num=num, skew=skew, kurtosis=kurtosis).T
+
+    return table
+
+
+def groupedNumOutliers(v=[], mask=[], starts=[], segIds=[]):
+
+    # the number of outliers of each segment of the (datasets x values)
+    # array 'v' (including only values within 'mask'): the values above
+    # the segment mode plus the distance from the mode to the segment
+    # minimum. The mode is the centre of the fullest bin of a histogram
+    # of each segment, binned exactly as by np.histogram. Segments
+    # holding nan values have an undefined (nan) number of outliers
+
+    num = segmentedSum(mask.astype(np.int64), starts)
+    hasNan = segmentedSum(mask & np.isnan(v), starts) > 0
+    first = segmentedMin(np.where(mask, v, np.inf), starts)
+    last = segmentedMax(np.where(mask, v, -np.inf), starts)
+
+    # the histogram range (as np.histogram for equal min and max)
+    sameVals = first == last
+    first = np.where(sameVals, first - 0.5, first)
+    last = np.where(sameVals, last + 0.5, last)
+    step = (last - first)/numModeBins
+
+    def edge(bins, lower, upper, binStep):
+        # bin edge 'bins', as np.linspace(lower, upper, numModeBins + 1)
+        return np.where(bins == numModeBins, upper, bins*binStep + lower)
+
+    # bin index of each value, corrected at the bin edges as for
+    # np.histogram
+    lower, upper, binStep = first[:, segIds], last[:, segIds], step[:, segIds]
+    valid = mask & ~hasNan[:, segIds]
+    vFill = np.where(valid, v, lower)
+    bins = ((vFill - lower)/(upper - lower)*numModeBins).astype(np.int64)
+    bins = np.clip(bins, 0, numModeBins)
+    bins[bins == numModeBins] -= 1
+    bins -= vFill < edge(bins, lower, upper, binStep)
+    bins += ((vFill >= edge(bins + 1, lower, upper, binStep)) &
+             (bins != numModeBins - 1))
+
+    # the fullest (first such) bin of each segment
+    numSegs = len(starts)
+    dsetIds = np.arange(v.shape[0])[:, np.newaxis]
+    flatBins = (dsetIds*numSegs + segIds)*numModeBins + bins
+    hist = np.bincount(flatBins[valid],
+                       minlength=v.shape[0]*numSegs*numModeBins)
+    modeBins = np.argmax(hist.reshape(v.shape[0], numSegs, numModeBins),
+                         axis=2)
+    mode = (edge(modeBins, first, last, step) +
+            edge(modeBins + 1, first, last, step))/2
+
+    distMin = segmentedMin(np.where(mask, v, np.inf), starts)
+    sudoMax = mode + np.abs(distMin - mode)
+    numOutliers = segmentedSum(valid & (v > sudoMax[:, segIds]), starts)
+
+    return np.where(hasNan | (num == 0), np.nan, numOutliers)
+
+
+def zeroVariance(mean=[], m2=[]):
+
+    # whether groups of values with means 'mean' and second central
+    # moments 'm2' have (numerically) zero variance. The skew and
+    # kurtosis of such groups are taken as 0 and -3, as by scipy.stats
+    # (for the pinned scipy 1.1.0) and scipy.stats.mstats. The variance
+    # is tested to within the precision of the mean, as for mstats, such
+    # that groups of equal values are found even where rounding of the
+    # mean leaves a small, non-zero variance
+
+    return m2 <= (np.finfo(np.float64).resolution*mean)**2
+
+
+def normalityPValues(num=[], skew=[], kurtosis=[]):
+
+    # p-values of the D'Agostino-Pearson test of whether values differ
+    # from a normal distribution (as scipy.stats.mstats.normaltest, used
+    # by combinedAtomList.testForNormality), from the number of values,
+    # skew and (Fisher) kurtosis of each group. Groups of fewer than
+    # 'minNormalityTestAtoms' values have an undefined (nan) p-value
+
+    n = np.asarray(num, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+
+        # skew test
+        y = skew*np.sqrt(((n + 1)*(n + 3))/(6.0*(n - 2)))
+        beta2 = (3.0*(n*n + 27*n - 70)*(n + 1)*(n + 3) /
+                 ((n - 2.0)*(n + 5)*(n + 7)*(n + 9)))
+        W2 = -1 + np.sqrt(2*(beta2 - 1))
+        delta = 1/np.sqrt(0.5*np.log(W2))
+        alpha = np.sqrt(2.0/(W2 - 1))
+        y = np.where(y == 0, 1, y)
+        zSkew = delta*np.log(y/alpha + np.sqrt((y/alpha)**2 + 1))
+
+        # kurtosis test
+        E = 3.0*(n - 1)/(n + 1)
+        varb2 = (24.0*n*(n - 2.)*(n - 3) /
+                 ((n + 1)*(n + 1.)*(n + 3)*(n + 5)))
+        x = (kurtosis + 3 - E)/np.sqrt(varb2)
+        sqrtbeta1 = (6.0*(n*n - 5*n + 2)/((n + 7)*(n + 9)) *
+                     np.sqrt((6.0*(n + 3)*(n + 5))/(n*(n - 2)*(n - 3))))
+        A = 6.0 + 8.0/sqrtbeta1*(2.0/sqrtbeta1 +
+                                 np.sqrt(1 + 4.0/(sqrtbeta1**2)))
+        term1 = 1 - 2./(9.0*A)
+        denom = 1 + x*np.sqrt(2/(A - 4.0))
+        denom = np.where(denom == 0, np.nan, denom)
+        term2 = np.sign(denom)*np.power(np.abs((1 - 2.0/A)/denom), 1/3.0)
+        zKurtosis = (term1 - term2)/np.sqrt(2/(9.0*A))
+
+        pValues = chi2.sf(zSkew**2 + zKurtosis**2, 2)
+
+    return np.where(n < minNormalityTestAtoms, np.nan, pValues)
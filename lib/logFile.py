@@ -69,3 +69,41 @@ class logFile():
         # get the current date and time
 
         return strftime("%Y-%m-%d %H:%M:%S", gmtime())
+
+
+class bufferedLogFile(logFile):
+
+    # a log that holds lines in memory rather than writing them to file,
+    # for use within worker processes. The held lines can later be written
+    # to a main log (in order) using writeBufferTo
+
+    def __init__(self,
+                 fileName='untitled-log', fileDir=''):
+
+        # the log file that held lines are destined for. Not written to
+        self.logFile = fileName
+        self.fileDir = fileDir
+        self.printToScreenMajor = False
+        self.printToScreenMinor = False
+        self.buffer = []
+
+    def writeToLog(self,
+                   str='', strip=True, forcePrint=False, timeStamp=False,
+                   priority='major'):
+
+        # hold line to be written to a log file later
+
+        if timeStamp is True:
+            str = '{}\t{}'.format(self.getTime(), str)
+
+        self.buffer.append({'str': str, 'strip': strip,
+                            'forcePrint': forcePrint, 'priority': priority})
+
+    def writeBufferTo(self,
+                      log=''):
+
+        # write all held lines to another log
+
+        for line in self.buffer:
+            log.writeToLog(**line)
+        self.buffer = []
@@ -9,6 +9,12 @@ from logFile import logFile
 from FFTjob import FFTjob
 from ENDjob import ENDjob
 from errors import error
+from PDBFileManipulation import readSpaceGroup, readPDBtable,\
+    renumberPDBFile
+from mmCIFFileManipulation import isMmCIFfile, coordFileExtension,\
+    renumberMmCIFFile
+from atomTagMap import atomTagChunkSize, sparseAtomMapName,\
+    writeSparseAtomMap, mergeAtomTagMaps
 import os.path
 import shutil
 import os
@@ -121,11 +127,15 @@ class makeMapsFromMTZs():
         self.SCALEIToutputMtz = '{}{}_SCALEITcombined.mtz'.format(
             self.outputDir, densMapNaming)
 
-        self.PDBCURoutputFile = '{}{}_PDBCUR.pdb'.format(
-            self.outputDir, atomMapNaming)
+        # coordinate files are kept in the format of the input file
+        # (pdb or mmCIF)
+        self.coordExt = coordFileExtension(inputPDBfile)
 
-        self.reorderedPDBFile = '{}{}_curated.pdb'.format(
-            self.outputDir, atomMapNaming)
+        self.PDBCURoutputFile = '{}{}_PDBCUR{}'.format(
+            self.outputDir, atomMapNaming, self.coordExt)
+
+        self.reorderedPDBFile = '{}{}_curated{}'.format(
+            self.outputDir, atomMapNaming, self.coordExt)
 
         if premadeAtomMap == '':
             self.atomTaggedMap = '{}{}_SFALL.map'.format(
@@ -179,11 +189,6 @@ class makeMapsFromMTZs():
 
             self.getAtomTaggedMap()
 
-            if self.cropToModel:
-                self.atomTaggedMap = self.cropMapToModel(self.atomTaggedMap)
-            else:
-                self.cropAtmTaggedMapToAsymUnit()
-
         # phenix maps are not currently a tested option
         if self.scaleType == 'PHENIX':
             self.generatePhenixDensMap()
@@ -357,31 +362,88 @@ class makeMapsFromMTZs():
         self.runLog.writeToLog(
             str='Renumbering input pdb file: {}'.format(self.PDBCURoutputFile))
 
-        pdbin = open(self.PDBCURoutputFile, 'r')
-        pdbout = open(self.reorderedPDBFile, 'w')
+        numAtoms = self.renumberCoordFile(fileIn=self.PDBCURoutputFile,
+                                          fileOut=self.reorderedPDBFile)
+
+        if numAtoms > 99999 and not isMmCIFfile(self.reorderedPDBFile):
+            error(text='Input model has {} atoms, beyond '.format(numAtoms) +
+                       'the 99,999 atoms that can be numbered within ' +
+                       'pdb format. Please provide the model in mmCIF ' +
+                       'format instead', log=self.runLog, type='error')
 
-        counter = 0
-        for line in pdbin.readlines():
-            if ('ATOM' not in line[0:4] and 'HETATM' not in line[0:6]):
-                pdbout.write(line)
-            else:
-                counter += 1
-                pdbout.write(line[0:6])
-                new_atomnum = " "*(5-len(str(counter))) + str(counter)
-                pdbout.write(new_atomnum)
-                pdbout.write(line[11:80]+'\n')
-        pdbin.close()
-        pdbout.close()
         self.runLog.writeToLog(
             str='Output pdb file: {}'.format(self.reorderedPDBFile))
 
+    def renumberCoordFile(self,
+                          fileIn='', fileOut='', atomRange=None):
+
+        # renumber the atoms of a pdb or mmCIF coordinate file (see
+        # PDBFileManipulation.renumberPDBFile). Returns number of atoms
+
+        if isMmCIFfile(fileIn):
+            return renumberMmCIFFile(fileIn=fileIn, fileOut=fileOut,
+                                     atomRange=atomRange)
+        return renumberPDBFile(fileIn=fileIn, fileOut=fileOut,
+                               atomRange=atomRange)
+
     def getAtomTaggedMap(self):
 
+        # generate the atom tagged map, cropped to the asymmetric unit
+        # (or model), together with its sparse form. Models of more than
+        # atomTagChunkSize atoms cannot be tagged exactly within a single
+        # SFALL map, and so are tagged in chunks of atoms, merged into a
+        # single map with exact int32 atom numbers (see atomTagMap.py)
+
+        numAtoms = len(readPDBtable(pdbFileName=self.reorderedPDBFile))
+        if numAtoms <= atomTagChunkSize:
+            self.runSFALL(inputPDBfile=self.reorderedPDBFile)
+            self.cropAtomTaggedMap()
+            writeSparseAtomMap(mapName=self.atomTaggedMap, log=self.runLog)
+            return
+
+        atomTaggedMap = self.atomTaggedMap
+        chunkMaps, chunkOffsets = [], []
+        for offset in range(0, numAtoms, atomTagChunkSize):
+            chunk = len(chunkMaps) + 1
+            self.runLog.writeToLog(
+                str='Tagging atoms {}-{} of {} (chunk {})'.format(
+                    offset + 1, min(offset + atomTagChunkSize, numAtoms),
+                    numAtoms, chunk))
+
+            chunkPDB = '{}{}_chunk{}{}'.format(
+                self.outputDir, self.atomMapNaming, chunk, self.coordExt)
+            self.renumberCoordFile(
+                fileIn=self.reorderedPDBFile, fileOut=chunkPDB,
+                atomRange=(offset + 1, offset + atomTagChunkSize))
+
+            self.atomTaggedMap = '{}{}_SFALL_chunk{}.map'.format(
+                self.outputDir, self.atomMapNaming, chunk)
+            self.runSFALL(inputPDBfile=chunkPDB)
+            self.cropAtomTaggedMap()
+            chunkMaps.append(self.atomTaggedMap)
+            chunkOffsets.append(offset)
+
+        self.atomTaggedMap = atomTaggedMap
+        numShared = mergeAtomTagMaps(
+            chunkMaps=chunkMaps, chunkOffsets=chunkOffsets,
+            mapOut=self.atomTaggedMap, log=self.runLog)
+
+        self.runLog.writeToLog(
+            str='Merged atom-tagged maps for {} chunks '.format(
+                len(chunkMaps)) +
+                'of atoms, with atom numbers written to ' +
+                '{}.\n{} voxels were tagged '.format(
+                    sparseAtomMapName(self.atomTaggedMap), numShared) +
+                'within more than one chunk (assigned to the first)')
+
+    def runSFALL(self,
+                 inputPDBfile=''):
+
         # run SFALL job to generate atom tagged map
 
         self.printStepNumber()
 
-        sfall = SFALLjob(inputPDBfile=self.reorderedPDBFile,
+        sfall = SFALLjob(inputPDBfile=inputPDBfile,
                          outputDir=self.outputDir, VDWR=self.sfall_VDWR,
                          symmetrygroup=self.spaceGroup, runLog=self.runLog,
                          outputMapFile=self.atomTaggedMap,
@@ -397,6 +459,15 @@ class makeMapsFromMTZs():
             error(text='Failure to successfully generate tagged atom map',
                   log=self.runLog)
 
+    def cropAtomTaggedMap(self):
+
+        # crop the atom-tagged map to the model or asymmetric unit
+
+        if self.cropToModel:
+            self.atomTaggedMap = self.cropMapToModel(self.atomTaggedMap)
+        else:
+            self.cropAtmTaggedMapToAsymUnit()
+
     def generatePhenixDensMap(self):
 
         # run phenix.fobs_minus_fobs to generate difference map
@@ -652,20 +723,16 @@ class makeMapsFromMTZs():
 
     def getSpaceGroup(self):
 
-        # parse the space group from the input pdb file
-
-        pdbin = open(self.reorderedPDBFile, 'r')
-        for line in pdbin.readlines():
-            if line.startswith('CRYST1'):
-                self.spaceGroup = line[55:66].replace(' ', '')
-                self.runLog.writeToLog(
-                    str='Retrieving space group from file:' +
-                        '{}.\nSpace group determined to be {}'.format(
-                            self.PDBCURoutputFile, self.spaceGroup))
+        # parse the space group from the input pdb (or mmCIF) file
 
-        try:
-            self.spaceGroup
-        except AttributeError:
+        spaceGroup = readSpaceGroup(pdbFileName=self.reorderedPDBFile)
+        if spaceGroup is not None:
+            self.spaceGroup = spaceGroup
+            self.runLog.writeToLog(
+                str='Retrieving space group from file:' +
+                    '{}.\nSpace group determined to be {}'.format(
+                        self.PDBCURoutputFile, self.spaceGroup))
+        else:
             error(
                 text='Unable to find space group from file: {}'.format(
                     self.PDBCURoutputFile),
@@ -763,6 +830,9 @@ class makeMapsFromMTZs():
             fm = '{}{}_FC.map'.format(self.outputDir, self.atomMapNaming)
 
         shutil.move(self.densityMap, dm)
+        if os.path.exists(sparseAtomMapName(self.atomTaggedMap)):
+            shutil.move(sparseAtomMapName(self.atomTaggedMap),
+                        sparseAtomMapName(am))
         shutil.move(self.atomTaggedMap, am)
 
         self.densityMap = dm
@@ -777,7 +847,8 @@ class makeMapsFromMTZs():
         # rename the final pdb file
 
         shutil.move(self.reorderedPDBFile,
-                    '{}{}.pdb'.format(self.outputDir, self.atomMapNaming))
+                    '{}{}{}'.format(self.outputDir, self.atomMapNaming,
+                                    self.coordExt))
 
     def cleanUpDir(self,
                    deleteUnwantedMapFiles=False,
@@ -815,8 +886,14 @@ class makeMapsFromMTZs():
                 if f.endswith('.mtz'):
                     os.remove(self.outputDir+f)
 
+            if deleteUnwantedMapFiles:
+                if (f.endswith('_sparse.col') and
+                        not f.endswith('_atoms_sparse.col')):
+                    os.remove(self.outputDir+f)
+
             if deleteUnwantedPdbFiles:
-                if f.endswith('_PDBCUR.pdb'):
+                if (f.endswith('_PDBCUR' + self.coordExt) or
+                        '_chunk' in f and f.endswith(self.coordExt)):
                     os.remove(self.outputDir+f)
 
     def findFilesInDir(self):
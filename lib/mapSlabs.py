@@ -0,0 +1,174 @@
+from __future__ import division
+from readMap import readMapHeader, findTaggedVoxels
+from atomTagMap import hasSparseAtomMap, sparseAtomMapName,\
+    mapInfoFromHeader
+from columnarFile import columnarFile
+from errors import error
+import mmap
+import os
+import numpy as np
+
+# slab-wise access to ccp4 maps, for processing maps too large to be held
+# in memory. The voxel block of a map is ordered with the fast axis
+# varying fastest and the slow axis slowest, such that a slab (a range of
+# whole sections along the slow axis) is a contiguous range of voxels.
+# Each slab is read through a read-only memory map of the voxel block,
+# such that only the pages of the current slab need be held in memory
+
+# the default (maximum) number of voxels per slab. A slab is always at
+# least a single section
+defaultSlabVoxels = 2**24
+
+
+def slabBounds(nxyz={}, slabVoxels=defaultSlabVoxels):
+
+    # the linear voxel range (start, stop) of each consecutive slab of a
+    # map with dimensions 'nxyz', each slab holding whole sections
+
+    sectionSize = nxyz['nx']*nxyz['ny']
+    numSections = nxyz['nz']
+    sectionsPerSlab = max(1, int(slabVoxels//sectionSize))
+
+    return [(s*sectionSize, min(s + sectionsPerSlab, numSections)*sectionSize)
+            for s in range(0, numSections, sectionsPerSlab)]
+
+
+class mapSlabReader(object):
+
+    # slab-wise read access to the voxels of a ccp4 map (of 4-byte float
+    # voxel values)
+
+    def __init__(self,
+                 mapName='', log=''):
+
+        self.mapName = mapName
+
+        fileSize = os.path.getsize(mapName)
+        with open(mapName, 'rb') as f:
+            bmf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            rho, dataStart, mapStdev, numVoxels = readMapHeader(
+                bmf=bmf, fileSize=fileSize, log=log)
+        finally:
+            bmf.close()
+
+        if rho.type != 2:
+            error(text='Only .map files of float voxel values (type 2) ' +
+                       'can be read slab-wise. Map type ' +
+                       '{} found for {}'.format(rho.type, mapName),
+                  log=log, type='error')
+
+        # the map header information (as a MapInfo object)
+        self.header = rho
+
+        self.numVoxels = numVoxels
+
+        # the voxel block, memory-mapped read-only
+        self.voxels = np.memmap(mapName, dtype=np.dtype('=f'), mode='r',
+                                offset=dataStart, shape=(self.numVoxels,))
+
+    def gather(self,
+               inds=[]):
+
+        # the voxel values at the linear indices 'inds'
+
+        return np.array(self.voxels[inds], dtype=np.float32)
+
+
+class atomMapSlabReader(object):
+
+    # slab-wise access to the atom-tagged voxels of an atom-tagged map.
+    # These are read from the sparse form of the map where present (see
+    # atomTagMap.py), or otherwise from the dense map itself
+
+    def __init__(self,
+                 mapName='', log=''):
+
+        self.mapName = mapName
+
+        if hasSparseAtomMap(mapName):
+            colFile = columnarFile(fileName=sparseAtomMapName(mapName),
+                                   mmap=True)
+            self.header = mapInfoFromHeader(colFile.header)
+            self.voxelIndices = colFile.getColumn('voxelIndices')
+            self.atomNums = colFile.getColumn('atomNums')
+            self.denseMap = None
+        else:
+            self.denseMap = mapSlabReader(mapName=mapName, log=log)
+            self.header = self.denseMap.header
+
+    def getTaggedVoxels(self,
+                        start=0, stop=0):
+
+        # the linear indices and atom numbers of the atom-tagged voxels
+        # with linear indices in the range [start, stop), as for readMap
+
+        if self.denseMap is None:
+            lower, upper = np.searchsorted(self.voxelIndices, [start, stop])
+            return (self.voxelIndices[lower:upper].astype(np.int64),
+                    np.array(self.atomNums[lower:upper]))
+
+        inds, vals = findTaggedVoxels(
+            voxels=self.denseMap.voxels[start:stop], start=start)
+
+        return inds, (vals // 100).astype(np.int32)
+
+
+class runningVoxelStats(object):
+
+    # summary statistics (number, mean, min, max and population standard
+    # deviation) of the voxel values read over a series of slabs. The
+    # mean and sum of squared deviations of each slab are combined with
+    # those of the slabs before, as for a parallel variance calculation
+
+    def __init__(self):
+
+        self.num = 0
+        self.mean = 0.
+        self.sumSqDevs = 0.
+        self.min = np.inf
+        self.max = -np.inf
+
+    def add(self,
+            vals=[]):
+
+        # include the values of another slab
+
+        num = len(vals)
+        if num == 0:
+            return
+
+        vals = np.asarray(vals, dtype=np.float64)
+        mean = np.mean(vals)
+        delta = mean - self.mean
+        total = self.num + num
+
+        self.sumSqDevs += (np.sum((vals - mean)**2) +
+                           delta**2*self.num*num/total)
+        self.mean += delta*num/total
+        self.num = total
+        self.min = min(self.min, np.min(vals))
+        self.max = max(self.max, np.max(vals))
+
+    def getStats(self):
+
+        # the statistics as used by maps2DensMetrics.reportDensMapInfo
+
+        return {'num': self.num, 'mean': self.mean, 'max': self.max,
+                'min': self.min, 'std': np.sqrt(self.sumSqDevs/self.num)}
+
+
+def lastSlabPerKey(slabKeys=[]):
+
+    # given the (unique) keys found within each slab in turn, return the
+    # sorted unique keys over all slabs and the last slab holding each
+
+    allKeys = np.concatenate([np.zeros(0, dtype=np.int64)] + list(slabKeys))
+    slabNums = np.repeat(np.arange(len(slabKeys)),
+                         [len(keys) for keys in slabKeys])
+
+    order = np.argsort(allKeys, kind='mergesort')
+    srtKeys = allKeys[order]
+    isLast = np.append(srtKeys[1:] != srtKeys[:-1], True)[:len(srtKeys)]
+
+    return srtKeys[isLast], slabNums[order][isLast]
@@ -1,10 +1,21 @@
 from __future__ import division
 from vxlsPerAtmAnalysisPlots import plotVxlsPerAtm, plotDensForAtm
 from densityAnalysisPlots import edens_scatter
-from PDBFileManipulation import PDBtoList
+from PDBFileManipulation import readPDBtable
+from classHolder import lazyAtomList, PDBtable
 from readMap import readMap
+from atomTagMap import maxExactTagAtomNum, maxExactTagValue,\
+    hasSparseAtomMap, readSparseAtomMap, sparseAtomMapName, mapInfoHeader,\
+    mapInfoFromHeader
+from densitySampleStore import createDensitySampleStore, writeDensitySamples
+from mapSlabs import mapSlabReader, atomMapSlabReader, runningVoxelStats,\
+    slabBounds, lastSlabPerKey, defaultSlabVoxels
+from segmentedStats import sortWithinSegments, segmentedMean, segmentedStd,\
+    segmentedMin, segmentedMax, segmentedPercentile, segmentedMaskedMean,\
+    segmentedSum, voxelGrouping, takeWithinRows
 import matplotlib.pyplot as plt
 from errors import error
+from multiprocessing import Pool, sharedctypes
 import numpy as np
 import sys
 import time
@@ -16,6 +27,17 @@ except ImportError:
     pass
 
 
+# the per-atom density metric attributes set by maps2DensMetrics for
+# a standard run
+densMetricAttrs = ['meandensity', 'mediandensity', 'mindensity',
+                   'maxdensity', 'stddensity', 'min90tile', 'max90tile',
+                   'min95tile', 'max95tile', 'numvoxels', 'meanPosOnly',
+                   'meanNegOnly', 'densityWeightedMean', 'densityWeightedMin',
+                   'densityWeightedMax', 'fracOfMaxAtomDensAtMin',
+                   'densityWeightedMeanPosOnly', 'densityWeightedMeanNegOnly',
+                   'rsddensity', 'rangedensity']
+
+
 class maps2DensMetrics(object):
 
     # assign values within a density map to specific atoms, using
@@ -26,7 +48,7 @@ class maps2DensMetrics(object):
                  filesIn='', filesOut='', pdbName='', atomTagMap='',
                  densityMap='', FCmap='',  plotScatter=False, plotHist=False,
                  logFile='./untitled.log', calcFCmap=True,
-                 doXYZanalysis=False):
+                 doXYZanalysis=False, numProcesses=1, cache=None):
 
         # the input directory
         self.filesIn = filesIn
@@ -61,6 +83,20 @@ class maps2DensMetrics(object):
         # whether to do analysis based on xyz of each voxel
         self.doXYZanalysis = doXYZanalysis
 
+        # number of processes to calculate per-atom metrics over
+        self.numProcesses = numProcesses
+
+        # the fileCache of parsed input files (None if not cached)
+        self.cache = cache
+
+        # the density sample store (see densitySampleStore.py) to which
+        # the density values at the atom-tagged voxels of each dataset are
+        # written ('' if not kept), together with the density map names
+        # and doses of the datasets it holds
+        self.densSampleStore = ''
+        self.densSampleDsets = []
+        self.densSampleDoses = []
+
     def maps2atmdensity(self,
                         mapsAlreadyRead=False):
 
@@ -73,7 +109,17 @@ class maps2DensMetrics(object):
         if not mapsAlreadyRead:
             self.readPDBfile()
             self.readAtomMap()
+            if self.densSampleStore != '':
+                createDensitySampleStore(
+                    storeName=self.densSampleStore, atomMap=self.atmmap,
+                    atomIndices=self.atomIndices, grouping=self.vxlGrouping,
+                    dsetNames=self.densSampleDsets,
+                    doses=self.densSampleDoses)
         self.readDensityMap()
+        if self.densSampleStore != '':
+            writeDensitySamples(storeName=self.densSampleStore,
+                                dsetName=self.densMapIn,
+                                vals=self.densmap.vxls_val)
         self.reportDensMapInfo()
         self.checkMapCompatibility()
 
@@ -86,7 +132,8 @@ class maps2DensMetrics(object):
         if self.plotHist:
             self.plotDensHistPlots()
 
-        self.calcDensMetrics(showProgress=False)
+        self.calcDensMetrics(showProgress=False,
+                             parallel=self.numProcesses > 1)
 
         if self.plotScatter:
             self.plotDensScatterPlots()
@@ -102,13 +149,21 @@ class maps2DensMetrics(object):
         self.startTimer()
         self.lgwrite(ln='Reading pdb file: {}'.format(self.pdbName))
 
-        # read in the pdb file to fill list of atom objects
-        self.PDBarray = PDBtoList('{}{}'.format(
-            self.filesIn, self.pdbName))
-        self.stopTimer()
+        # read in the pdb file to fill list of atom objects, making sure
+        # array of atoms ordered by atom number. Atom objects are only
+        # created once required
+        pdbFile = '{}{}'.format(self.filesIn, self.pdbName)
+        cached = self.getCacheEntry(kind='coordTable', fileNames=[pdbFile])
+        if cached is not None:
+            table = PDBtable(columns={name: cached.getColumn(name)
+                                      for name in cached.getColumnNames()})
+        else:
+            table = readPDBtable(pdbFileName=pdbFile).sortedBy('atomnum')
+            self.putCacheEntry(kind='coordTable', fileNames=[pdbFile],
+                               columns=table.columns)
 
-        # make sure array of atoms ordered by atom number
-        self.PDBarray.sort(key=lambda x: x.atomnum)
+        self.PDBarray = lazyAtomList(table=table)
+        self.stopTimer()
 
     def readAtomMap(self):
 
@@ -119,19 +174,55 @@ class maps2DensMetrics(object):
         self.lgwrite(ln='Reading atom-tagged map file...\n' +
                         'Atom map name: {}'.format(self.atomMapIn))
 
-        self.atmmap, self.atomIndices = readMap(
-            dirIn=self.filesIn, dirOut=self.filesOut, mapName=self.atomMapIn,
-            mapType='atom_map', log=self.log)
+        # the sparse form of the map holds only the atom-tagged voxels,
+        # and is read in place of the full map where present
+        mapName = self.filesIn + self.atomMapIn
+        useSparse = hasSparseAtomMap(mapName)
+        if useSparse:
+            self.atomMapFile = sparseAtomMapName(mapName)
+        else:
+            self.atomMapFile = mapName
+
+        cached = self.getCacheEntry(kind='atomMap',
+                                    fileNames=[self.atomMapFile])
+        if cached is not None:
+            self.atmmap = mapInfoFromHeader(cached.header)
+            self.atmmap.vxls_val = cached.getColumn('atomNums')
+            self.atomIndices = cached.getColumn('voxelIndices')
+            self.vxlGrouping = voxelGrouping(
+                layout=[cached.getColumn(name) for name in
+                        ('order', 'keys', 'starts', 'counts')])
+        else:
+            if useSparse:
+                self.atmmap, self.atomIndices = readSparseAtomMap(
+                    mapName=mapName, log=self.log)
+            else:
+                self.atmmap, self.atomIndices = readMap(
+                    dirIn=self.filesIn, dirOut=self.filesOut,
+                    mapName=self.atomMapIn, mapType='atom_map', log=self.log)
+
+            # group the voxels by atom number. This grouping does not
+            # change between datasets and so is reused for each density map
+            self.vxlGrouping = voxelGrouping(self.atmmap.vxls_val)
+
+            grouping = self.vxlGrouping
+            self.putCacheEntry(
+                kind='atomMap', fileNames=[self.atomMapFile],
+                header=mapInfoHeader(self.atmmap),
+                columns={'atomNums': self.atmmap.vxls_val,
+                         'voxelIndices': self.atomIndices,
+                         'order': grouping.order, 'keys': grouping.keys,
+                         'starts': grouping.starts,
+                         'counts': grouping.counts})
+
+        self.checkAtomTags()
         self.stopTimer()
 
         # find number of atoms in structure
         numAtms = len(self.PDBarray)
 
         # find atom numbers present in list (repeated atom numbers removed)
-        seen = set()
-        seenAdd = seen.add
-        uniqAtms = [x for x in self.atmmap.vxls_val if not
-                    (x in seen or seenAdd(x))]
+        uniqAtms = self.vxlGrouping.keys.tolist()
 
         # find set of atoms numbers not present
         # (i.e atoms not assigned to voxels)
@@ -140,6 +231,44 @@ class maps2DensMetrics(object):
             ln='Number of atoms not assigned to voxels: ' +
                '{}'.format(len(AtmsNotPres)))
 
+    def checkAtomTags(self,
+                      tagNums=None):
+
+        # check that the atom-tagged map identifies atoms exactly. Atom
+        # numbers recovered from float32 map values are only exact up to
+        # maxExactTagAtomNum, beyond which neighbouring atoms share tags
+        # (such maps must be tagged in chunks, see atomTagMap.py). Every
+        # tagged atom number must also be an atom of the model. The tagged
+        # atom numbers are those of the voxel grouping, unless given as
+        # (sorted, unique) 'tagNums'
+
+        if tagNums is None:
+            tagNums = self.vxlGrouping.keys
+        if len(tagNums) == 0:
+            return
+
+        if not self.atmmap.exactTags:
+            if (tagNums[-1] > maxExactTagAtomNum or
+                    self.atmmap.density['max'] >= maxExactTagValue):
+                error(text='Atom-tagged map values exceed the range ' +
+                           'over which 4-byte floats hold atom numbers ' +
+                           'exactly (atom numbers above {}). '.format(
+                                maxExactTagAtomNum) +
+                           'Atom tags collide, and voxels cannot be ' +
+                           'assigned to atoms reliably',
+                      log=self.log, type='error')
+
+        atomNums = np.array([atom.atomnum for atom in self.PDBarray])
+        unknownNums = np.setdiff1d(tagNums, atomNums)
+        if len(unknownNums) > 0:
+            error(text='{} atom numbers in the atom-tagged map '.format(
+                        len(unknownNums)) +
+                       'are not atoms of the model (e.g. {}). '.format(
+                        unknownNums[0]) +
+                       'Atom tags collide, or the map was not made ' +
+                       'from this model',
+                  log=self.log, type='error')
+
     def readDensityMap(self):
 
         # read in the density map
@@ -165,26 +294,73 @@ class maps2DensMetrics(object):
         self.lgwrite(ln='Reading Fcalc density map file...\n' +
                         'Density map name: {}'.format(self.FCmapIn))
 
-        self.FCmap = readMap(dirIn=self.filesIn, dirOut=self.filesOut,
-                             mapName=self.FCmapIn, mapType='density_map',
-                             atomInds=self.atomIndices, log=self.log)
-
+        # the Fcalc values gathered at the atom-tagged voxels depend on
+        # both the Fcalc map and the atom-tagged map read
+        cacheFiles = [self.filesIn + self.FCmapIn, self.atomMapFile]
+        cached = self.getCacheEntry(kind='FCvalues', fileNames=cacheFiles)
+        if cached is not None:
+            self.FCmap = mapInfoFromHeader(cached.header)
+            self.FCmap.vxls_val = cached.getColumn('vxls_val')
+        else:
+            self.FCmap = readMap(
+                dirIn=self.filesIn, dirOut=self.filesOut,
+                mapName=self.FCmapIn, mapType='density_map',
+                atomInds=self.atomIndices, log=self.log)
+            self.putCacheEntry(kind='FCvalues', fileNames=cacheFiles,
+                               header=mapInfoHeader(self.FCmap),
+                               columns={'vxls_val': self.FCmap.vxls_val})
+
+        # the Fcalc map is read once per run, so group by atom here
+        self.FCperAtom = self.vxlGrouping.group(self.FCmap.vxls_val)
         self.stopTimer()
 
+    def getCacheEntry(self,
+                      kind='', fileNames=[]):
+
+        # the cache entry (a columnarFile) for input files 'fileNames', or
+        # None if not cached (or no cache is used)
+
+        if self.cache is None:
+            return None
+        cached = self.cache.get(kind=kind, fileNames=fileNames)
+        if cached is not None:
+            self.lgwrite(ln='Read from cache: {}'.format(cached.fileName))
+
+        return cached
+
+    def putCacheEntry(self,
+                      kind='', fileNames=[], columns={}, header={}):
+
+        # add a cache entry for input files 'fileNames' (if a cache is used)
+
+        if self.cache is not None:
+            self.cache.put(kind=kind, fileNames=fileNames, columns=columns,
+                           header=header)
+
     def reportDensMapInfo(self,
-                          numSfs=4, mapType='density'):
+                          numSfs=4, mapType='density', vxlStats=None):
 
-        # report the density map summary information to a log file
+        # report the density map summary information to a log file. The
+        # statistics of the voxels assigned to structure are found from
+        # the map values held, unless given in 'vxlStats' (a dictionary
+        # of 'num', 'mean', 'max', 'min' and 'std' values)
 
         if mapType == 'density':
             mp = self.densmap
         elif mapType == 'calc':
             mp = self.FCmap
 
+        if vxlStats is None:
+            vxlStats = {'num': len(mp.vxls_val),
+                        'mean': np.mean(mp.vxls_val),
+                        'max': np.max(mp.vxls_val),
+                        'min': np.min(mp.vxls_val),
+                        'std': np.std(mp.vxls_val)}
+
         totalNumVxls = np.product(list(self.atmmap.nxyz.values()))
-        structureNumVxls = len(mp.vxls_val)
+        structureNumVxls = vxlStats['num']
         totalMean = mp.density['mean']
-        structureMean = np.mean(mp.vxls_val)
+        structureMean = vxlStats['mean']
         solvNumVxls = totalNumVxls - structureNumVxls
         solvMean = (totalNumVxls*totalMean -
                     structureNumVxls*structureMean)/solvNumVxls
@@ -194,18 +370,19 @@ class maps2DensMetrics(object):
                '\tmean structure density : {}\n'.format(
                 round(structureMean, numSfs)) +
                '\tmax structure density : {}\n'.format(
-                round(max(mp.vxls_val), numSfs)) +
+                round(vxlStats['max'], numSfs)) +
                '\tmin structure density : {}\n'.format(
-                round(min(mp.vxls_val), numSfs)) +
+                round(vxlStats['min'], numSfs)) +
                '\tstd structure density : {}\n'.format(
-                round(np.std(mp.vxls_val), numSfs)) +
+                round(vxlStats['std'], numSfs)) +
                '\t# voxels included : {}\n'.format(structureNumVxls) +
                '\nFor voxels assigned to solvent:\n' +
                '\tmean solvent-region density : {}\n'.format(
                 round(solvMean), numSfs) +
                '\t# voxels included : {}'.format(solvNumVxls))
 
-    def checkMapCompatibility(self):
+    def checkMapCompatibility(self,
+                              numAtomVxls=None):
 
         # check that atom-tagged and density map
         # can be combined successfully. This
@@ -258,28 +435,27 @@ class maps2DensMetrics(object):
                 ln='The atom and density map are of compatible format!')
         self.stopTimer()
 
+        # the number of atom-tagged voxels is that of the atom-tagged map
+        # read, unless given as 'numAtomVxls'
+        if numAtomVxls is None:
+            numAtomVxls = len(self.atmmap.vxls_val)
         self.lgwrite(
             ln='Total number of voxels assigned to atoms: {}'.format(
-                len(self.atmmap.vxls_val)))
+                numAtomVxls))
 
     def createVoxelList(self,
                         inclOnlyGluAsp=False):
 
-        # create dictionary of voxels with atom numbers as keys
+        # group voxel density values by atom number. Per-atom values
+        # are accessed by atom number as slices of a single array
 
         self.startTimer()
         self.printStepNumber()
         self.lgwrite(ln='Combining voxel density and atom values...')
         self.success()
-        vxlDic = {atm: [] for atm in self.atmmap.vxls_val}
-        xyzDic = {atm: [] for atm in self.atmmap.vxls_val}
 
-        self.densmap.reshape1dTo3d()
         self.densmap.abs2xyz_params()
-        for atm, dens in zip(self.atmmap.vxls_val, self.densmap.vxls_val):
-            vxlDic[atm].append(dens)
-
-        self.vxlsPerAtom = vxlDic
+        self.vxlsPerAtom = self.vxlGrouping.group(self.densmap.vxls_val)
 
         # The following is not essential for run and should not be called by default
         if self.doXYZanalysis:
@@ -290,9 +466,7 @@ class maps2DensMetrics(object):
 
             xyz_list = self.densmap.getVoxXYZ(
                 self.atomIndices, coordType='fractional')
-
-            for atm, xyz in zip(self.atmmap.vxls_val, xyz_list):
-                xyzDic[atm].append(xyz)
+            xyzPerAtom = self.vxlGrouping.group(xyz_list)
 
             # get the mid points for each atom from the set of voxels
             # per atom, whilst accounting for symmetry (the asym unit
@@ -312,19 +486,14 @@ class maps2DensMetrics(object):
 
                 xyzAnalysis = perAtomXYZAnalysis(
                     atomObj=atom, vxlRefPoint=np.mean(xyz_list, 0),
-                    densPerVxl=np.round(np.array(vxlDic[atom.atomnum]), 3),
-                    xyzsPerAtom=xyzDic[atom.atomnum], densMapObj=self.densmap)
+                    densPerVxl=np.round(self.vxlsPerAtom[atom.atomnum], 3),
+                    xyzsPerAtom=xyzPerAtom[atom.atomnum],
+                    densMapObj=self.densmap)
                 xyzAnalysis.getxyzPerAtom()
                 atom.vxlMidPt = xyzAnalysis.findVoxelMidPt()
                 xyzDic2[atom.getAtomID()] = xyzAnalysis.keptPts
                 self.xyzsPerAtom = xyzDic2
 
-        if self.calcFCmap:
-            vxlDic2 = {atm: [] for atm in self.atmmap.vxls_val}
-            for atm, dens in zip(self.atmmap.vxls_val, self.FCmap.vxls_val):
-                vxlDic2[atm].append(dens)
-            self.FCperAtom = vxlDic2
-
         self.deleteMapsAttributes()
         self.stopTimer()
 
@@ -502,6 +671,391 @@ class maps2DensMetrics(object):
 
                 self.densByRegion.append(clustAnalysis.densByRegion)
 
+    def calcDensMetricsAllAtoms(self,
+                                numProcesses=1):
+
+        # calculate density metrics for all atoms at once. The voxels are
+        # already grouped by atom number (a CSR layout of per-atom offsets
+        # plus values), such that every metric computed within
+        # calcDensMetricsForAtom is found using segmented reductions over
+        # all atoms, rather than separate numpy calls per atom. Results are
+        # stored as the same per-atom attributes. If 'numProcesses' > 1,
+        # contiguous chunks of atoms are processed in a process pool
+
+        atmNums = self.vxlGrouping.keys
+        counts = self.vxlGrouping.counts
+        if self.calcFCmap:
+            FCvals = self.FCperAtom.vals
+        else:
+            FCvals = None
+
+        if numProcesses > 1:
+            metrics = self.calcSegmentMetricsInPool(
+                vxls=self.vxlsPerAtom.vals, FCvals=FCvals, counts=counts,
+                numProcesses=numProcesses)
+        else:
+            metrics = calcSegmentMetrics(
+                vxls=self.vxlsPerAtom.vals, FCvals=FCvals, counts=counts)
+
+        # locate each atom within the per-atom segments
+        atomNums = np.array([atom.atomnum for atom in self.PDBarray])
+        segInds = np.searchsorted(atmNums, atomNums)
+        segInds[segInds == len(atmNums)] = 0
+        found = atmNums[segInds] == atomNums
+
+        for i, atom in enumerate(self.PDBarray):
+            if found[i]:
+                for name in metrics:
+                    setattr(atom, name, metrics[name][segInds[i]])
+            else:
+                # as in calcDensMetricsForAtom, an atom with no assigned
+                # voxels is treated as having a single nan-valued voxel
+                error(
+                    text='No voxels assigned to an atom. Consider ' +
+                         'increasing per-atom search radius parameter in ' +
+                         'RIDL input .txt file.',
+                    log=self.log, type='warning')
+                for name in metrics:
+                    setattr(atom, name, np.nan)
+                atom.numvoxels = 1
+                atom.meanPosOnly = 0
+                atom.meanNegOnly = 0
+            atom.getAdditionalMetrics()
+
+    def calcDensMetricsAllDatasets(self,
+                                   densMapList=[], memLimit=None):
+
+        # calculate per-atom density metrics for every density map in
+        # 'densMapList', where all datasets share the pdb file, atom-tagged
+        # map and Fcalc map (each read once here). The density maps are
+        # read in batches, with the values of a batch grouped by atom as a
+        # single (datasets x voxels) array, from which every metric of every
+        # dataset in the batch is found in one set of segmented reductions
+        # (see calcSegmentMetrics). The batch size is limited such that the
+        # estimated memory use is within 'memLimit' (GB), if given. Returns
+        # a dictionary of (atoms x datasets) metric arrays, with atoms
+        # ordered as PDBarray. No per-dataset atom objects are created
+
+        self.readPDBfile()
+        self.readAtomMap()
+        if self.densSampleStore != '':
+            createDensitySampleStore(
+                storeName=self.densSampleStore, atomMap=self.atmmap,
+                atomIndices=self.atomIndices, grouping=self.vxlGrouping,
+                dsetNames=self.densSampleDsets, doses=self.densSampleDoses)
+        if self.calcFCmap:
+            self.readFCMap()
+            self.reportDensMapInfo(mapType='calc')
+            FCvals = self.FCperAtom.vals
+        else:
+            FCvals = None
+
+        numDsets = len(densMapList)
+        batchSize = numDsets
+        if memLimit is not None:
+            maxForMem = int(memLimit*1e9//self.estimateDatasetMemory())
+            batchSize = max(1, min(batchSize, maxForMem))
+
+        atomNums = np.array([atom.atomnum for atom in self.PDBarray])
+        dsetMetrics = {}
+        for batchStart in range(0, numDsets, batchSize):
+            batchMaps = densMapList[batchStart:batchStart + batchSize]
+            vxls = np.empty((len(batchMaps), len(self.atomIndices)))
+            for j, densMap in enumerate(batchMaps):
+                self.densMapIn = densMap
+                self.readDensityMap()
+                self.reportDensMapInfo()
+                self.checkMapCompatibility()
+                if self.densSampleStore != '':
+                    writeDensitySamples(storeName=self.densSampleStore,
+                                        dsetName=self.densMapIn,
+                                        vals=self.densmap.vxls_val)
+                vxls[j] = self.vxlGrouping.group(self.densmap.vxls_val).vals
+                del self.densmap.vxls_val
+
+            self.printStepNumber()
+            self.startTimer()
+            self.lgwrite(
+                ln='Calculating electron density statistics per atom for ' +
+                   '{} datasets...'.format(len(batchMaps)))
+            metrics = calcSegmentMetrics(vxls=vxls, FCvals=FCvals,
+                                         counts=self.vxlGrouping.counts)
+            del vxls
+
+            found = self.setAtomDsetMetrics(
+                dsetMetrics=dsetMetrics, atomNums=atomNums,
+                segKeys=self.vxlGrouping.keys, segMetrics=metrics,
+                numDsets=numDsets,
+                dsetCols=slice(batchStart, batchStart + len(batchMaps)))
+            self.stopTimer()
+
+        self.setMissingAtomMetrics(dsetMetrics=dsetMetrics, found=found)
+
+        return dsetMetrics
+
+    def calcDensMetricsStreamed(self,
+                                densMapList=[], memLimit=None):
+
+        # calculate per-atom density metrics for every density map in
+        # 'densMapList', as calcDensMetricsAllDatasets, but with the
+        # atom-tagged, density and Fcalc maps each read slab by slab (see
+        # mapSlabs.py), such that memory use is bounded by the slab size
+        # rather than by the size of the maps. A first pass over the
+        # atom-tagged map finds the last slab holding voxels of each atom.
+        # In a second pass, the voxel values of each atom are held only
+        # until its last slab has been read, when every metric for the
+        # atom (including the percentiles) is found exactly as for the
+        # in-memory calculation. Only atoms spanning slab boundaries are
+        # carried between slabs. The slab size is limited such that the
+        # estimated memory use is within 'memLimit' (GB), if given
+
+        self.readPDBfile()
+
+        self.printStepNumber()
+        self.startTimer()
+        self.lgwrite(ln='Reading maps slab by slab...\n' +
+                        'Atom map name: {}'.format(self.atomMapIn))
+
+        atomMap = atomMapSlabReader(mapName=self.filesIn + self.atomMapIn,
+                                    log=self.log)
+        self.atmmap = atomMap.header
+        densMaps = [mapSlabReader(mapName=self.filesIn + densMap,
+                                  log=self.log) for densMap in densMapList]
+        if self.calcFCmap:
+            FCmap = mapSlabReader(mapName=self.filesIn + self.FCmapIn,
+                                  log=self.log)
+            self.FCmap = FCmap.header
+
+        slabVoxels = defaultSlabVoxels
+        if memLimit is not None:
+            # as estimateDatasetMemory, for each voxel of each dataset
+            slabVoxels = int(memLimit*1e9//(64*len(densMaps)))
+        bounds = slabBounds(nxyz=self.atmmap.nxyz, slabVoxels=slabVoxels)
+        self.lgwrite(ln='Maps read in {} slabs'.format(len(bounds)))
+
+        # first pass: the last slab holding voxels of each atom
+        slabKeys = []
+        numAtomVxls = 0
+        for start, stop in bounds:
+            inds, nums = atomMap.getTaggedVoxels(start=start, stop=stop)
+            slabKeys.append(np.unique(nums))
+            numAtomVxls += len(inds)
+        tagKeys, lastSlab = lastSlabPerKey(slabKeys=slabKeys)
+        self.checkAtomTags(tagNums=tagKeys)
+        self.lgwrite(
+            ln='Number of atoms not assigned to voxels: ' +
+               '{}'.format(len(set(range(1, len(self.PDBarray)+1)) -
+                               set(tagKeys.tolist()))))
+
+        for densMap in densMaps:
+            self.densmap = densMap.header
+            self.checkMapCompatibility(numAtomVxls=numAtomVxls)
+
+        # second pass: per-atom metrics for the atoms completed by each slab
+        atomNums = np.array([atom.atomnum for atom in self.PDBarray])
+        numDsets = len(densMaps)
+        dsetMetrics = {}
+        found = np.zeros(len(atomNums), dtype=bool)
+        densStats = [runningVoxelStats() for densMap in densMaps]
+        FCstats = runningVoxelStats()
+        carryNums = np.zeros(0, dtype=np.int32)
+        carryVxls = np.zeros((numDsets, 0))
+        carryFC = np.zeros(0)
+
+        self.printStepNumber()
+        self.lgwrite(
+            ln='Calculating electron density statistics per atom for ' +
+               '{} datasets...'.format(numDsets))
+        for slab, (start, stop) in enumerate(bounds):
+            inds, nums = atomMap.getTaggedVoxels(start=start, stop=stop)
+            vxls = np.empty((numDsets, len(inds)))
+            for j, densMap in enumerate(densMaps):
+                vxls[j] = densMap.gather(inds)
+                densStats[j].add(vxls[j])
+            carryNums = np.concatenate((carryNums, nums))
+            carryVxls = np.concatenate((carryVxls, vxls), axis=1)
+            if self.calcFCmap:
+                FCvals = FCmap.gather(inds)
+                FCstats.add(FCvals)
+                carryFC = np.concatenate((carryFC, FCvals))
+
+            # atoms with all voxels now read. Each atom's voxels are held
+            # in map order, and so are grouped as for voxelGrouping
+            done = lastSlab[np.searchsorted(tagKeys, carryNums)] <= slab
+            if not done.any():
+                continue
+            grouping = voxelGrouping(keys=carryNums[done])
+            if self.calcFCmap:
+                FCvals = carryFC[done][grouping.order]
+            else:
+                FCvals = None
+            metrics = calcSegmentMetrics(
+                vxls=carryVxls[:, done][:, grouping.order], FCvals=FCvals,
+                counts=grouping.counts)
+            found |= self.setAtomDsetMetrics(
+                dsetMetrics=dsetMetrics, atomNums=atomNums,
+                segKeys=grouping.keys, segMetrics=metrics, numDsets=numDsets)
+
+            carryNums = carryNums[~done]
+            carryVxls = carryVxls[:, ~done]
+            if self.calcFCmap:
+                carryFC = carryFC[~done]
+        self.stopTimer()
+
+        for densMap, stats in zip(densMaps, densStats):
+            self.lgwrite(ln='\nDensity map name: {}'.format(
+                densMap.mapName.replace(self.filesIn, '')))
+            self.densmap = densMap.header
+            self.reportDensMapInfo(vxlStats=stats.getStats())
+        if self.calcFCmap:
+            self.lgwrite(ln='\nFcalc density map name: {}'.format(
+                self.FCmapIn))
+            self.reportDensMapInfo(mapType='calc', vxlStats=FCstats.getStats())
+
+        self.setMissingAtomMetrics(dsetMetrics=dsetMetrics, found=found)
+
+        return dsetMetrics
+
+    def setAtomDsetMetrics(self,
+                           dsetMetrics={}, atomNums=[], segKeys=[],
+                           segMetrics={}, numDsets=1, dsetCols=slice(None)):
+
+        # fill the (atoms x datasets) metric arrays of 'dsetMetrics' for
+        # atoms (with atom numbers 'atomNums') within the per-atom segments
+        # with atom numbers 'segKeys'. 'segMetrics' holds a row of
+        # per-segment values for each of the datasets 'dsetCols' (as
+        # returned by calcSegmentMetrics). Returns whether each atom was
+        # found within the segments
+
+        segInds = np.searchsorted(segKeys, atomNums)
+        segInds[segInds == len(segKeys)] = 0
+        if len(segKeys) > 0:
+            found = segKeys[segInds] == atomNums
+        else:
+            found = np.zeros(len(atomNums), dtype=bool)
+
+        for name, vals in segMetrics.items():
+            if name not in dsetMetrics:
+                dsetMetrics[name] = np.full((len(atomNums), numDsets), np.nan)
+            dsetMetrics[name][found, dsetCols] = vals[:, segInds[found]].T
+
+        return found
+
+    def setMissingAtomMetrics(self,
+                              dsetMetrics={}, found=[]):
+
+        # as in calcDensMetricsAllAtoms, an atom with no assigned voxels
+        # (where 'found' is False) is treated as having a single nan-valued
+        # voxel
+
+        if not found.all():
+            error(text='No voxels assigned to {} atoms. '.format(
+                        np.count_nonzero(~found)) +
+                       'Consider increasing per-atom search radius ' +
+                       'parameter in RIDL input .txt file.',
+                  log=self.log, type='warning')
+            dsetMetrics['numvoxels'][~found] = 1
+            dsetMetrics['meanPosOnly'][~found] = 0
+            dsetMetrics['meanNegOnly'][~found] = 0
+
+    def calcSegmentMetricsInPool(self,
+                                 vxls=[], FCvals=None, counts=[],
+                                 numProcesses=2):
+
+        # calculate per-atom density metrics over contiguous chunks of
+        # atoms in a process pool. The grouped voxel values are copied once
+        # into shared memory, from which each worker reads its own chunk
+        # without the values being pickled. Since the metrics for an atom
+        # depend only on its own voxels, the results are identical to those
+        # calculated on a single process
+
+        self.lgwrite(ln='Using {} processes'.format(numProcesses))
+
+        sharedVxls = toSharedArray(vxls)
+        if FCvals is None:
+            sharedFCvals = None
+        else:
+            sharedFCvals = toSharedArray(FCvals)
+
+        # split atoms into chunks of roughly equal numbers of voxels. More
+        # chunks than processes are used to balance the load between workers
+        ends = np.cumsum(counts)
+        numChunks = min(4*numProcesses, len(counts))
+        targets = ends[-1]*np.arange(1, numChunks)/numChunks
+        segBounds = np.unique(np.concatenate(
+            ([0], np.minimum(np.searchsorted(ends, targets) + 1, len(counts)),
+             [len(counts)])))
+        vxlBounds = np.concatenate(([0], ends))[segBounds]
+
+        chunks = [(vxlBounds[j], vxlBounds[j+1],
+                   counts[segBounds[j]:segBounds[j+1]])
+                  for j in range(len(segBounds) - 1)]
+
+        pool = Pool(processes=numProcesses, initializer=initSharedVoxels,
+                    initargs=(sharedVxls, sharedFCvals))
+        try:
+            results = pool.map(calcChunkMetrics, chunks)
+        finally:
+            pool.close()
+            pool.join()
+
+        return {name: np.concatenate([r[name] for r in results])
+                for name in results[0]}
+
+    def getDensMetricArrays(self):
+
+        # the per-atom density metrics for the current dataset, as a
+        # dictionary of arrays ordered as PDBarray. This is a compact form
+        # in which to pass a dataset's metrics between processes
+
+        names = [n for n in densMetricAttrs if hasattr(self.PDBarray[0], n)]
+
+        return {n: np.array([getattr(atom, n) for atom in self.PDBarray])
+                for n in names}
+
+    def setDensMetricArrays(self,
+                            metrics={}):
+
+        # set per-atom density metrics from arrays ordered as PDBarray
+        # (as returned by getDensMetricArrays)
+
+        for name, vals in metrics.items():
+            for atom, val in zip(self.PDBarray, vals):
+                setattr(atom, name, val)
+
+    def estimateDatasetMemory(self,
+                              bytesPerVoxel=64):
+
+        # rough estimate of the peak memory (in bytes) needed to calculate
+        # per-atom metrics for one density map, once the atom-tagged map
+        # has been read. This is dominated by the float64 per-voxel arrays
+        # used during the segmented metric calculation
+
+        return bytesPerVoxel*len(self.atomIndices)
+
+    def estimateStateMemory(self,
+                            bytesPerAtom=3000):
+
+        # rough estimate of the memory (in bytes) held by this object once
+        # the pdb file, atom-tagged map and Fcalc map have been read, as
+        # copied to each worker process of calculateMetrics (see
+        # processLaterDsetsConcurrently). This is the per-voxel arrays held
+        # plus, per atom, the atom object (with its metric attributes) and
+        # its entry in the voxel grouping
+
+        arrays = [self.atomIndices, self.atmmap.vxls_val,
+                  self.vxlGrouping.order, self.vxlGrouping.keys,
+                  self.vxlGrouping.starts, self.vxlGrouping.counts]
+        for name in ('vxlsPerAtom', 'FCperAtom'):
+            if hasattr(self, name):
+                arrays.append(getattr(self, name).vals)
+        for name in ('densmap', 'FCmap'):
+            if hasattr(getattr(self, name, None), 'vxls_val'):
+                arrays.append(getattr(self, name).vxls_val)
+
+        return (sum(np.asarray(a).nbytes for a in arrays) +
+                bytesPerAtom*len(self.PDBarray))
+
     def calcDensMetrics(self,
                         plotDistn=False, showProgress=True, parallel=False,
                         makeTrainSet=False, inclOnlyGluAsp=False,
@@ -525,10 +1079,19 @@ class maps2DensMetrics(object):
 
         total = len(self.PDBarray)
 
-        if parallel:
-            # TODO: this would be great to implement at some point
-            print('Parallel processing not currently implemented!')
-            pass
+        standardRun = not (plotDistn or makeTrainSet or inclOnlyGluAsp or
+                           doRandomSubset or self.doXYZanalysis)
+
+        if parallel and not standardRun:
+            error(text='Parallel processing only available for a standard ' +
+                       'run. Calculating metrics on a single process',
+                  log=self.log, type='warning')
+
+        if standardRun:
+            # the standard run: all atoms are processed together
+            self.calcDensMetricsAllAtoms(
+                numProcesses=self.numProcesses if parallel else 1)
+
         else:
 
             self.densByRegion = []
@@ -873,3 +1436,111 @@ class maps2DensMetrics(object):
                         '\nSTEP {})'.format(self.stepNumber))
 
         self.stepNumber += 1
+
+
+# voxel values shared with the worker processes of a metric calculation
+# process pool. Set within each worker by initSharedVoxels
+sharedVoxels = {}
+
+
+def toSharedArray(vals=[]):
+
+    # copy a 1d float64 array into a shared memory array, which may be
+    # passed to the worker processes of a pool without being pickled
+
+    shared = sharedctypes.RawArray('d', len(vals))
+    np.frombuffer(shared, dtype=np.float64)[:] = vals
+
+    return shared
+
+
+def initSharedVoxels(vxls=None, FCvals=None):
+
+    # process pool initializer. Store the shared voxel arrays for the
+    # lifetime of the worker process
+
+    sharedVoxels['vxls'] = vxls
+    sharedVoxels['FCvals'] = FCvals
+
+
+def calcChunkMetrics(chunk=()):
+
+    # calculate density metrics for a contiguous chunk of atoms within a
+    # process pool worker. 'chunk' holds the voxel range of the chunk and
+    # the number of voxels per atom within it
+
+    start, stop, counts = chunk
+    vxls = np.frombuffer(sharedVoxels['vxls'], dtype=np.float64)[start:stop]
+    if sharedVoxels['FCvals'] is None:
+        FCvals = None
+    else:
+        FCvals = np.frombuffer(
+            sharedVoxels['FCvals'], dtype=np.float64)[start:stop]
+
+    return calcSegmentMetrics(vxls=vxls, FCvals=FCvals, counts=counts)
+
+
+def calcSegmentMetrics(vxls=[], FCvals=None, counts=[]):
+
+    # calculate density metrics for a set of atoms whose voxel values are
+    # held contiguously per atom, with 'counts' voxels for each atom in
+    # turn. Returns a dictionary of per-atom metric arrays. Fcalc-weighted
+    # metrics are only included if Fcalc map values are provided.
+    #
+    # 'vxls' may also hold the values for several datasets, as a 2d array
+    # with one row per dataset, in which case each metric array holds one
+    # row of per-atom values per dataset (see segmentedStats.py). The
+    # Fcalc map values are then shared between all datasets
+
+    starts = np.cumsum(counts) - counts
+
+    # sort voxels within each atom, such that the first voxel for
+    # each atom is the first occurrence of the per-atom minimum
+    srtOrder = sortWithinSegments(vxls, counts)
+    srtVxls = takeWithinRows(vxls, srtOrder)
+
+    metrics = {}
+    metrics['meandensity'] = segmentedMean(vxls, starts, counts)
+    metrics['mediandensity'] = segmentedPercentile(
+        srtVxls, starts, counts, q=50)
+    metrics['mindensity'] = srtVxls[..., starts]
+    metrics['maxdensity'] = srtVxls[..., starts + counts - 1]
+    metrics['stddensity'] = segmentedStd(
+        vxls, starts, counts, means=metrics['meandensity'])
+    for q, name in ((10, 'min90tile'), (90, 'max90tile'),
+                    (5, 'min95tile'), (95, 'max95tile')):
+        metrics[name] = segmentedPercentile(srtVxls, starts, counts, q=q)
+    metrics['numvoxels'] = np.broadcast_to(
+        counts, metrics['meandensity'].shape).copy()
+    metrics['meanPosOnly'] = segmentedMaskedMean(
+        vxls, vxls > 0, starts, default=0)
+    metrics['meanNegOnly'] = segmentedMaskedMean(
+        vxls, vxls < 0, starts, default=0)
+
+    if FCvals is not None:
+        # see calcDensMetricsForAtom for a description of these
+        # Fcalc-weighted metrics. Negative Fcalc values set to zero
+        FCvals = np.maximum(FCvals, 0)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            FCmaxNormed = FCvals/np.repeat(
+                segmentedMax(FCvals, starts), counts)
+            weighted = vxls*FCmaxNormed
+
+            metrics['densityWeightedMean'] = segmentedMean(
+                weighted, starts, counts)
+            metrics['densityWeightedMin'] = segmentedMin(weighted, starts)
+            metrics['densityWeightedMax'] = segmentedMax(weighted, starts)
+            metrics['fracOfMaxAtomDensAtMin'] = FCmaxNormed[
+                srtOrder[..., starts]]
+
+            for sign, name in ((1, 'densityWeightedMeanPosOnly'),
+                               (-1, 'densityWeightedMeanNegOnly')):
+                mask = sign*weighted > 0
+                numVals = segmentedSum(mask.astype(np.int64), starts)
+                valsSum = segmentedSum(np.where(mask, weighted, 0), starts)
+                weightsSum = segmentedSum(
+                    np.where(mask, FCmaxNormed, 0), starts)
+                metrics[name] = np.where(numVals > 0, valsSum/weightsSum, 0)
+
+    return metrics
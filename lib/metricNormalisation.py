@@ -1,4 +1,5 @@
 from errors import error
+from doseSeriesStore import getDensMetricArray
 import numpy as np
 import sys
 
@@ -61,7 +62,7 @@ class metricNormalisation(object):
 
         # calculate the weighting for each dataset and
         # for each density metric individually here
-        vals = [a.densMetric[metric]['Standard']['values'] for a in normSet]
+        vals = getDensMetricArray(atoms=normSet, metric=metric)
         self.meanweight[metric] = np.nanmean(vals, 0)
         self.stdweight[metric] = np.nanstd(vals, 0)
 
@@ -0,0 +1,480 @@
+import re
+import numpy as np
+from classHolder import PDBtable
+
+# reading and writing of mmCIF coordinate files, as an alternative to
+# fixed-column pdb format for structures beyond pdb format limits (more
+# than 99,999 atoms, or multi-character chain IDs). Files are read with
+# a streaming tokenizer, such that only the _atom_site loop (and any
+# requested single items) are held in memory, in a single pass
+
+# the _atom_site items read for each singlePDB attribute, in order of
+# preference (author-defined items are used where present, as in pdb
+# format files)
+atomSiteItems = {'atomOrHetatm': ['group_pdb'],
+                 'atomnum': ['id'],
+                 'atomtype': ['auth_atom_id', 'label_atom_id'],
+                 'basetype': ['auth_comp_id', 'label_comp_id'],
+                 'chaintype': ['auth_asym_id', 'label_asym_id'],
+                 'residuenum': ['auth_seq_id', 'label_seq_id'],
+                 'X_coord': ['cartn_x'],
+                 'Y_coord': ['cartn_y'],
+                 'Z_coord': ['cartn_z'],
+                 'Occupancy': ['occupancy'],
+                 'Bfactor': ['b_iso_or_equiv'],
+                 'atomID': ['type_symbol']}
+
+# the _atom_site items written to mmCIF output files
+atomSiteOutputItems = ['group_PDB', 'id', 'type_symbol', 'label_atom_id',
+                       'label_alt_id', 'label_comp_id', 'label_asym_id',
+                       'label_entity_id', 'label_seq_id',
+                       'pdbx_PDB_ins_code', 'Cartn_x', 'Cartn_y',
+                       'Cartn_z', 'occupancy', 'B_iso_or_equiv',
+                       'auth_seq_id', 'auth_comp_id', 'auth_asym_id',
+                       'auth_atom_id', 'pdbx_PDB_model_num']
+
+# single (non-loop) items copied from an input file to output files
+cellItemPrefixes = ('_cell.', '_symmetry.', '_space_group.')
+
+tokenPattern = re.compile(
+    r"""'(?:[^']|'(?=\S))*'(?=\s|$)|"(?:[^"]|"(?=\S))*"(?=\s|$)|#.*|\S+""")
+
+reservedPrefixes = ('_', 'loop_', 'data_', 'save_', 'global_', 'stop_')
+
+
+def isMmCIFfile(fileName=''):
+
+    # whether a coordinate file is in mmCIF (rather than pdb) format,
+    # as determined by its file extension
+
+    return fileName.lower().endswith(('.cif', '.mmcif'))
+
+
+def coordFileExtension(fileName=''):
+
+    # the file extension used for coordinate files of the same format
+    # as 'fileName'
+
+    if isMmCIFfile(fileName):
+        return '.cif'
+    return '.pdb'
+
+
+def splitMmCIFline(line=''):
+
+    # the raw tokens of a single line (quotes are kept, comments are
+    # removed). Lines without quotes or comments are simply split
+
+    if "'" not in line and '"' not in line and '#' not in line:
+        return line.split()
+
+    return [t for t in tokenPattern.findall(line) if not t.startswith('#')]
+
+
+def mmCIFlines(lines=[]):
+
+    # yield each line of an mmCIF file as its raw text (including the
+    # line end) and a list of its raw tokens. A multi-line text field
+    # (delimited by ';' at the start of a line) is yielded as a single
+    # token, including its delimiters, with the raw text of all its lines
+
+    textField, rawText = None, ''
+    for line in lines:
+        rawText += line
+        line = line.rstrip('\r\n')
+        tokens = []
+        if textField is not None:
+            if line.startswith(';'):
+                textField.append(';')
+                tokens.append('\n'.join(textField))
+                textField = None
+                line = line[1:]
+            else:
+                textField.append(line)
+                continue
+        elif line.startswith(';'):
+            textField = [line]
+            continue
+        yield rawText, tokens + splitMmCIFline(line)
+        rawText = ''
+
+    if textField is not None:
+        raise ValueError('Unterminated text field in mmCIF file')
+
+
+def mmCIFlineTokens(lines=[]):
+
+    # yield the raw tokens of each line of an mmCIF file as a list (see
+    # mmCIFlines), skipping lines without tokens
+
+    for rawText, tokens in mmCIFlines(lines):
+        if tokens:
+            yield tokens
+
+
+def joinMmCIFtokens(tokens=[]):
+
+    # the text of a list of raw tokens, separated by spaces, with any
+    # text field on lines of its own. Ends with a line end
+
+    text = ''
+    for token in tokens:
+        if token.startswith(';'):
+            text += ('\n' if text and not text.endswith('\n') else '') + \
+                token + '\n'
+        else:
+            text += (' ' if text and not text.endswith('\n') else '') + token
+    if not text.endswith('\n'):
+        text += '\n'
+
+    return text
+
+
+def isReserved(token=''):
+
+    # whether a raw token is a data name or reserved word (rather than
+    # a value)
+
+    return token.lower().startswith(reservedPrefixes)
+
+
+def unquote(token=''):
+
+    # the value of a raw token
+
+    if token.startswith(';'):
+        return token[1:-2]
+    if token[0] in '\'"':
+        return token[1:-1]
+    return token
+
+
+def quoteValue(val=''):
+
+    # the raw token for a value, quoted where required
+
+    val = str(val)
+    if val == '':
+        return '.'
+    if (any(c.isspace() for c in val) or val[0] in '\'";#$[]_' or
+            isReserved(val)):
+        if "'" not in val:
+            return "'{}'".format(val)
+        return '"{}"'.format(val)
+    return val
+
+
+def parseMmCIF(lines=[], loopCategory='_atom_site.', itemPrefixes=()):
+
+    # parse mmCIF lines in a single pass. Returns the (lower-case) item
+    # names of the loop for category 'loopCategory' with its raw values
+    # (as a flat list, row by row), together with a list of (name, raw
+    # value) for any single items with names starting 'itemPrefixes'
+
+    loopTags, loopVals = [], []
+    items = []
+
+    # the tags of the loop currently being read, whether the current loop
+    # is 'loopCategory', and the name of a single item awaiting its value
+    tags, inLoopBody, isCategory, pendingTag = None, False, False, None
+
+    for tokens in mmCIFlineTokens(lines):
+        if inLoopBody and not isReserved(tokens[0]):
+            if isCategory:
+                loopVals.extend(tokens)
+            continue
+        for token in tokens:
+            if pendingTag is not None:
+                if pendingTag.lower().startswith(itemPrefixes):
+                    items.append((pendingTag, token))
+                pendingTag = None
+                continue
+            reserved = isReserved(token)
+            if tags is not None and not inLoopBody:
+                if token.startswith('_'):
+                    tags.append(token.lower())
+                    continue
+                # first value of a loop
+                inLoopBody = True
+                isCategory = tags[0].startswith(loopCategory)
+                if isCategory:
+                    loopTags = [t[len(loopCategory):] for t in tags]
+            if inLoopBody:
+                if not reserved:
+                    if isCategory:
+                        loopVals.append(token)
+                    continue
+                tags, inLoopBody, isCategory = None, False, False
+            if token.lower() == 'loop_':
+                tags = []
+            elif token.startswith('_'):
+                pendingTag = token
+
+    return loopTags, loopVals, items
+
+
+def readMmCIFitems(fileName='', itemPrefixes=cellItemPrefixes):
+
+    # the single (non-loop) items of an mmCIF file with names starting
+    # 'itemPrefixes', as a list of (name, raw value)
+
+    with open(fileName, 'r') as cifin:
+        return parseMmCIF(cifin, loopCategory=(),
+                          itemPrefixes=itemPrefixes)[2]
+
+
+def readMmCIFspaceGroup(fileName=''):
+
+    # the space group (without spaces, as for pdb CRYST1 records) of an
+    # mmCIF file, or None if not found
+
+    items = {k.lower(): unquote(v) for k, v in readMmCIFitems(
+        fileName, itemPrefixes=('_symmetry.', '_space_group.'))}
+    for name in ('_symmetry.space_group_name_h-m',
+                 '_space_group.name_h-m_alt'):
+        if items.get(name, '?') not in ('?', '.'):
+            return items[name].replace(' ', '')
+
+    return None
+
+
+def readMmCIFunitCell(fileName=''):
+
+    # the unit cell (a, b, c, alpha, beta, gamma) of an mmCIF file, or
+    # None if not found
+
+    items = {k.lower(): unquote(v) for k, v in readMmCIFitems(
+        fileName, itemPrefixes=('_cell.',))}
+    names = ['_cell.length_a', '_cell.length_b', '_cell.length_c',
+             '_cell.angle_alpha', '_cell.angle_beta', '_cell.angle_gamma']
+    try:
+        return [float(items[name]) for name in names]
+    except (KeyError, ValueError):
+        return None
+
+
+def readMmCIFtable(fileName=''):
+
+    # read the _atom_site loop of an mmCIF file into typed columns (see
+    # classHolder.PDBtable), with attributes as for pdb format files.
+    # Occupancies are read as numbers (unknown values as nan), since
+    # these may be unknown ('?') in mmCIF files
+
+    with open(fileName, 'r') as cifin:
+        tags, vals, items = parseMmCIF(cifin)
+
+    numTags = len(tags)
+    if numTags == 0 or len(vals) % numTags != 0:
+        raise ValueError(
+            'No complete _atom_site loop in mmCIF file {}'.format(fileName))
+
+    def column(names, default=None):
+        for name in names:
+            if name in tags:
+                col = vals[tags.index(name)::numTags]
+                joined = ''.join(col)
+                if "'" in joined or '"' in joined or ';' in joined:
+                    col = [unquote(v) for v in col]
+                return col
+        if default is None:
+            raise ValueError(
+                'Missing _atom_site.{} in mmCIF file {}'.format(
+                    names[0], fileName))
+        return [default]*(len(vals)//numTags)
+
+    columns = {}
+    for attr in ('atomOrHetatm', 'atomtype', 'basetype', 'chaintype',
+                 'residuenum', 'atomID'):
+        default = {'atomOrHetatm': 'ATOM'}.get(attr)
+        columns[attr] = column(atomSiteItems[attr], default)
+
+    # residue numbers include any insertion code, as for pdb files
+    if 'pdbx_pdb_ins_code' in tags:
+        columns['residuenum'] = [
+            r + i if i not in ('?', '.') else r for r, i in zip(
+                columns['residuenum'], column(['pdbx_pdb_ins_code']))]
+
+    columns = {k: np.array(v, dtype=str) for k, v in columns.items()}
+    columns['atomnum'] = mmCIFnumbers(column(atomSiteItems['atomnum']),
+                                      dtype=np.int64)
+    for attr in ('X_coord', 'Y_coord', 'Z_coord', 'Bfactor'):
+        columns[attr] = mmCIFnumbers(column(atomSiteItems[attr]))
+    columns['Occupancy'] = mmCIFnumbers(
+        column(atomSiteItems['Occupancy'], '1.00'))
+
+    return PDBtable(columns=columns)
+
+
+def mmCIFnumbers(vals=[], dtype=np.float64):
+
+    # numeric array from a list of mmCIF values. Unknown ('?') or
+    # inapplicable ('.') float values are read as nan
+
+    convert = int if dtype is np.int64 else float
+    try:
+        return np.array(list(map(convert, vals)), dtype=dtype)
+    except ValueError:
+        if convert is int:
+            raise
+        return np.array([float(v) if v not in ('?', '.') else np.nan
+                         for v in vals], dtype=dtype)
+
+
+def renumberMmCIFFile(fileIn='', fileOut='', atomRange=None):
+
+    # renumber the _atom_site.id items of an mmCIF file sequentially,
+    # copying all other lines unchanged (atom rows are written one per
+    # line, with any text field values on lines of their own). If
+    # 'atomRange' (first, last) is given, only the first-th to last-th
+    # atoms of the file (counting from 1) are kept, numbered from 1.
+    # Returns the number of atoms written
+
+    index, counter = 0, 0
+
+    # the tags of the loop currently being read, and the position of the
+    # atom number within each row (once within the _atom_site loop body)
+    tags, idIndex, row = None, None, []
+
+    with open(fileIn, 'r') as cifin, open(fileOut, 'w') as cifout:
+        for rawText, tokens in mmCIFlines(cifin):
+            if tags is not None and idIndex is None and tokens:
+                if tokens[0].startswith('_'):
+                    tags.append(tokens[0].lower())
+                elif '_atom_site.id' in tags:
+                    idIndex = tags.index('_atom_site.id')
+                else:
+                    tags = None
+            if idIndex is not None:
+                if tokens and not isReserved(tokens[0]):
+                    row += tokens
+                    while len(row) >= len(tags):
+                        index += 1
+                        if (atomRange is None or
+                                atomRange[0] <= index <= atomRange[1]):
+                            counter += 1
+                            row[idIndex] = str(counter)
+                            cifout.write(joinMmCIFtokens(row[:len(tags)]))
+                        row = row[len(tags):]
+                    continue
+                if tokens:
+                    if row:
+                        raise ValueError(
+                            'Incomplete _atom_site row in mmCIF ' +
+                            'file {}'.format(fileIn))
+                    tags, idIndex = None, None
+            if tokens and tokens[0].lower() == 'loop_':
+                tags = []
+            cifout.write(rawText)
+
+    if row:
+        raise ValueError(
+            'Incomplete _atom_site row in mmCIF file {}'.format(fileIn))
+
+    return counter
+
+
+def mmCIFdataBlock(fileName='', items=[]):
+
+    # the opening lines of an mmCIF output file: the data block header,
+    # followed by any single items (as (name, raw value) pairs, e.g.
+    # the unit cell and space group of an input file)
+
+    name = fileName.replace('\\', '/').split('/')[-1].split('.')[0]
+    block = 'data_{}\n#\n'.format(name.replace(' ', '_') or 'RIDL')
+    for tag, val in items:
+        if val.startswith(';'):
+            block += '{}\n{}\n'.format(tag, val)
+        else:
+            block += '{} {}\n'.format(tag, val)
+    if items:
+        block += '#\n'
+
+    return block
+
+
+def mmCIFatomSiteHeader():
+
+    # the header of the _atom_site loop, as written by writeMmCIFline
+    # and writeMmCIFline_DamSite
+
+    return 'loop_\n' + ''.join(
+        '_atom_site.{}\n'.format(item) for item in atomSiteOutputItems)
+
+
+def splitResidueNumber(residuenum=''):
+
+    # the sequence number and insertion code of a residue number (as
+    # held for singlePDB atoms, e.g. '52A')
+
+    match = re.match(r'^(-?\d+)(.*)$', str(residuenum))
+    if match is None:
+        return str(residuenum), '?'
+
+    return match.group(1), match.group(2) or '?'
+
+
+def atomSiteRow(vals={}):
+
+    # a single _atom_site loop row, from a dictionary of item values
+
+    return ' '.join(quoteValue(vals.get(item, '?'))
+                    for item in atomSiteOutputItems)
+
+
+def writeMmCIFline(element, Bfactor):
+
+    # convert atom information (in class format) to an _atom_site
+    # row for mmCIF output files (as writePDBline for pdb files).
+    # The Bfactor of each atom can be specified by another metric
+
+    seqNum, insCode = splitResidueNumber(element.residuenum)
+    vals = {'group_PDB': 'ATOM',
+            'id': element.atomnum,
+            'type_symbol': element.atomID,
+            'label_atom_id': element.atomtype,
+            'label_alt_id': '.',
+            'label_comp_id': element.basetype,
+            'label_asym_id': element.chaintype,
+            'label_seq_id': seqNum,
+            'pdbx_PDB_ins_code': insCode,
+            'Cartn_x': '{0:.3f}'.format(element.X_coord),
+            'Cartn_y': '{0:.3f}'.format(element.Y_coord),
+            'Cartn_z': '{0:.3f}'.format(element.Z_coord),
+            'occupancy': '{0:.2f}'.format(1.00),
+            'B_iso_or_equiv': '{0:.2f}'.format(float(Bfactor)),
+            'auth_seq_id': seqNum,
+            'auth_comp_id': element.basetype,
+            'auth_asym_id': element.chaintype,
+            'auth_atom_id': element.atomtype,
+            'pdbx_PDB_model_num': 1}
+
+    return atomSiteRow(vals)
+
+
+def writeMmCIFline_DamSite(atom='', damValue=0, index=0, chain='A'):
+
+    # convert atom information (in class format) to an _atom_site row
+    # for mmCIF output files, written as a 'DAM' atom with the same xyz
+    # coordinates as the input atom (as writePDBline_DamSite for pdb
+    # files). The B-factor item is the damage metric value for the atom
+
+    vals = {'group_PDB': 'HETATM',
+            'id': index,
+            'type_symbol': atom.atomID,
+            'label_atom_id': 'O',
+            'label_alt_id': '.',
+            'label_comp_id': 'DAM',
+            'label_asym_id': chain,
+            'label_seq_id': index,
+            'Cartn_x': '{0:.3f}'.format(atom.X_coord),
+            'Cartn_y': '{0:.3f}'.format(atom.Y_coord),
+            'Cartn_z': '{0:.3f}'.format(atom.Z_coord),
+            'occupancy': '{0:.2f}'.format(float(1)),
+            'B_iso_or_equiv': '{0:.3f}'.format(float(damValue)),
+            'auth_seq_id': index,
+            'auth_comp_id': 'DAM',
+            'auth_asym_id': chain,
+            'auth_atom_id': 'O',
+            'pdbx_PDB_model_num': 1}
+
+    return atomSiteRow(vals)
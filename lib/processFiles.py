@@ -5,6 +5,8 @@ from ridlFeedback import provideFeedback
 from furtherOutput import furtherAnalysis
 from savevariables import retrieveGenericObject
 from errors import error
+from mmCIFFileManipulation import coordFileExtension
+from atomTagMap import removeDenseAtomMap
 import difflib
 import shutil
 import os
@@ -18,7 +20,11 @@ class processFiles():
                  metCalcInput='metricCalc_inputfile.txt',
                  cleanFinalFiles=False, logFileObj='',
                  makeSummaryFile=False,
-                 keepMapDir=True, includeSIGF=True):
+                 keepMapDir=True, includeSIGF=True, numProcesses=1,
+                 numDsetProcesses=1, memLimit=None, cacheSize=0,
+                 saveDsetFiles=False, saveDensSamples=False,
+                 batchDsets=False, streamMaps=False,
+                 sparseAtomMapsOnly=False):
 
         # class to read an input file and generate a set of density
         # and atom-tagged maps for a damage series. Can handle a single
@@ -32,11 +38,22 @@ class processFiles():
         self.metCalcInput = metCalcInput
         self.logFile = logFileObj
         self.includeSIGF = includeSIGF
+        self.numProcesses = numProcesses
+        self.numDsetProcesses = numDsetProcesses
+        self.memLimit = memLimit
+        self.cacheSize = cacheSize
+        self.saveDsetFiles = saveDsetFiles
+        self.saveDensSamples = saveDensSamples
+        self.batchDsets = batchDsets
+        self.streamMaps = streamMaps
+        self.sparseAtomMapsOnly = sparseAtomMapsOnly
 
         self.runFileProcessing()
 
         if makeMaps:
             self.runMapGeneration()
+            if self.sparseAtomMapsOnly:
+                self.removeDenseAtomMaps()
 
         if makeMetrics:
             self.runMetricCalcStep()
@@ -110,6 +127,21 @@ class processFiles():
                 self.getCurrentInputParams(jobNumber=i)
                 self.runMapGenerationPipeline(firstTimeRun)
 
+    def removeDenseAtomMaps(self):
+
+        # remove the dense atom-tagged maps of the map directory that are
+        # held in sparse form (see atomTagMap.removeDenseAtomMap). This is
+        # only done once all maps have been made, since the dense atom map
+        # of the first dataset is reused to make the maps of later datasets
+
+        numRemoved = 0
+        for fName in sorted(os.listdir(self.mapProcessDir)):
+            if fName.endswith('_atoms.map'):
+                numRemoved += removeDenseAtomMap(
+                    mapName=self.mapProcessDir + fName, log=self.logFile)
+        self.logFile.writeToLog(
+            str='{} dense atom-tagged map(s) removed'.format(numRemoved))
+
     def runMapGenerationPipeline(self,
                                  firstTimeRun=True):
 
@@ -236,19 +268,30 @@ class processFiles():
 
         if self.useSeparatePDBperDataset():
             atomMapList = ['{}_atoms.map'.format(d) for d in names2]
-            pdbFileList = ['{}.pdb'.format(d) for d in names2]
+            pdbFileList = ['{}{}'.format(d, self.coordFileExtension('pdb2'))
+                           for d in names2]
         else:
             atomMapList = ['{}_atoms.map'.format(d) for d in names1]
-            pdbFileList = ['{}.pdb'.format(d) for d in names1]
+            pdbFileList = ['{}{}'.format(d, self.coordFileExtension('pdb1'))
+                           for d in names1]
 
         c = calculateMetrics(logFile=self.logFile, densMapList=densMapList,
                              atomMapList=atomMapList, outDir=self.dir,
-                             mapDir=self.mapProcessDir, initialPDB=self.name1,
+                             mapDir=self.mapProcessDir,
+                             initialPDB=self.initialCoordFiles(),
                              seriesName=seriesName, doses=self.getDoses(),
                              pklDataFile=self.pklDataFile,
                              pdbFileList=pdbFileList, normSet=self.normSet,
                              RIDLinputFile=self.inputFile,
-                             sepPDBperDataset=self.useSeparatePDBperDataset())
+                             sepPDBperDataset=self.useSeparatePDBperDataset(),
+                             numProcesses=self.numProcesses,
+                             numDsetProcesses=self.numDsetProcesses,
+                             memLimit=self.memLimit,
+                             cacheSize=self.cacheSize,
+                             saveDsetFiles=self.saveDsetFiles,
+                             saveDensSamples=self.saveDensSamples,
+                             batchDsets=self.batchDsets,
+                             streamMaps=self.streamMaps)
 
         # decide whether Fcalc data is present and should be used
         c.inclFCmets = self.includeFCmaps()
@@ -286,7 +329,8 @@ class processFiles():
                             doses=self.getDoses(), pklSeries=self.pklDataFile,
                             inputDir=self.mapProcessDir,
                             densMaps=self.name2.split(','),
-                            initialPDB=self.name1, normSet=self.normSet,
+                            initialPDB=self.initialCoordFiles(),
+                            normSet=self.normSet,
                             inclFCmetrics=self.includeFCmaps())
         else:
             furtherAnalysis(csvOnly=csvOnly, atmsObjs=combinedAtoms,
@@ -434,13 +478,16 @@ class processFiles():
         props = ['mtz2', 'mtz3']
         fType = ['.mtz', '.mtz']
 
+        # coordinate files may be in pdb or mmCIF format
+        coordTypes = ('.pdb', '.cif', '.mmcif')
+
         if not self.highDsetOnly:
             props += ['mtz1', 'pdb1']
-            fType += ['.mtz', '.pdb']
+            fType += ['.mtz', coordTypes]
 
         if self.useSeparatePDBperDataset():
             props.append('pdb2')
-            fType.append('.pdb')
+            fType.append(coordTypes)
 
         for p, t in zip(props, fType):
             if not self.multiDatasets:
@@ -923,7 +970,10 @@ class processFiles():
 
         # check that a file has the required file extension
 
-        if not fileName.endswith(fileType):
+        # 'fileType' may also be a tuple of allowed extensions
+        if not fileName.lower().endswith(fileType):
+            if isinstance(fileType, tuple):
+                fileType = '" or "'.join(fileType)
             self.writeError(
                 text='"{}" input file input must end '.format(property) +
                      'with extension  "{}". '.format(fileType) +
@@ -1116,6 +1166,24 @@ class processFiles():
         else:
             return False
 
+    def coordFileExtension(self,
+                           pdbProperty='pdb1'):
+
+        # the file extension (.pdb or .cif) of coordinate files written
+        # during map processing, following the format of the input
+        # coordinate file(s) given by 'pdbProperty'
+
+        return coordFileExtension(
+            getattr(self, pdbProperty, '').split(',')[0])
+
+    def initialCoordFiles(self):
+
+        # the (comma-separated) names of the initial dataset coordinate
+        # files, as copied into the map processing directory
+
+        return ','.join('{}{}'.format(n, self.coordFileExtension('pdb1'))
+                        for n in self.name1.split(','))
+
     def useSeparatePDBperDataset(self):
 
         # decide whether a separate pdb file should be used per dataset
@@ -1183,7 +1251,8 @@ class processFiles():
         if self.highDsetOnly:
             return
 
-        f = '{}.pdb'.format(self.name1_current)
+        f = '{}{}'.format(self.name1_current,
+                          coordFileExtension(self.pdb1_current))
         d = self.mapProcessDir
         if f not in os.listdir(d):
             shutil.copy2(self.pdb1_current, d+f)
@@ -7,15 +7,20 @@ import mmap
 import numpy as np
 from functools import reduce
 
+# the number of voxels of a map processed together when locating the
+# atom-tagged voxels, such that no temporary arrays the size of the full
+# map are required
+tagSearchChunkSize = 2**24
+
 
 def readMap(dirIn='./', dirOut='./', mapName='untitled.map',
             mapType='atom_map', atomInds=[], log='',
-            standardise=False, fixMaxMapVal=''):
-
-    # a function to read in a .map file of either density or atom-tagged type
+            standardise=False, fixMaxMapVal='', vectorised=True):
 
-    # define 'rho' electron map object
-    rho = MapInfo()
+    # a function to read in a .map file of either density or atom-tagged type.
+    # If 'vectorised' is True, the voxel block of the file is mapped directly
+    # as a read-only numpy array (rather than unpacked voxel by voxel) and
+    # typed arrays are returned in place of python lists
 
     mapName = dirIn + mapName
     filesize = os.path.getsize(mapName)
@@ -30,83 +35,8 @@ def readMap(dirIn='./', dirOut='./', mapName='untitled.map',
         with open(mapName, "r+b") as f:
             bmf = mmap.mmap(f.fileno(), 0)
 
-    # start adding header information into MapInfo class format.
-    # Note the unpacking of a struct for each byte, read as a long 'l'
-    for n in ('nx', 'ny', 'nz'):
-        rho.nxyz[n] = unpack('=l', bmf.read(4))[0]
-
-    rho.type = unpack('=l', bmf.read(4))[0]
-
-    for s in ('fast', 'med', 'slow'):
-        rho.start[s] = unpack('=l', bmf.read(4))[0]
-
-    for g in ('1', '2', '3'):
-        rho.gridsamp[g] = unpack('=l', bmf.read(4))[0]
-
-    for d in ('a', 'b', 'c', 'alpha', 'beta', 'gamma'):
-        # cell dims stored as float not long int
-        rho.celldims[d] = unpack('f', bmf.read(4))[0]
-
-    for a in ('fast', 'med', 'slow'):
-        rho.axis[a] = unpack('=l', bmf.read(4))[0]
-
-    for d in ('min', 'max', 'mean'):
-        rho.density[d] = unpack('f', bmf.read(4))[0]
-
-    s = rho.getHeaderInfo(tab=True)
-
-    # write to log file if specified
-    if log != '':
-        if os.path.exists(log.logFile):
-            for l in s.split('\n'):
-                log.writeToLog(l, priority='minor')
-    else:
-        print(s)
-
-    # calculate the last nx*ny*nz bytes of file (corresponding to
-    # the position of the 3D electron density array). Note factor
-    # of 4 is included since 4-byte floats used for electron
-    # density array values.
-
-    densitystart = filesize - 4*(reduce(lambda x, y: x*y, list(rho.nxyz.values())))
-
-    # if sys.version_info[0] >= 3:
-    #     import functools
-    #     densitystart = filesize - 4*(functools.reduce(lambda x, y: x*y, list(rho.nxyz.values())))
-    # else:
-    #     densitystart = filesize - 4*(reduce(lambda x, y: x*y, list(rho.nxyz.values())))
-
-    # get symmetry operations from map header
-    for j in range(23, 58):
-        if j != 53 and j < 57:
-
-            if j != 55:
-                val = unpack('=l', bmf.read(4))[0]
-            else:
-                val = unpack('=f', bmf.read(4))[0]
-
-            if j == 24:
-                numSymBytes = val
-
-            if j == 55:
-                mapStdev = round(val, 5)
-
-        elif j < 57:
-            for i in range(4):
-                val = unpack('c', bmf.read(1))[0]
-        else:
-            for i in range(10):
-                for k in range(80):
-                    char = unpack('c', bmf.read(1))[0]
-    symOps = []
-
-    for j in range(numSymBytes // 80):
-        line = ''
-        for k in range(80):
-            char = unpack('=c', bmf.read(1))[0].decode("utf-8")
-            line += char
-        symOps.append(line)
-    rho.curateSymOps(symOps)
+    rho, densitystart, mapStdev, numVoxels = readMapHeader(
+        bmf=bmf, fileSize=filesize, log=log)
 
     # next seek start of electron density data
     bmf.seek(densitystart, 0)
@@ -133,7 +63,16 @@ def readMap(dirIn='./', dirOut='./', mapName='untitled.map',
         density = []
         appenddens = density.append
 
-        if mapType in ('atom_map'):
+        if mapType in ('atom_map') and vectorised:
+            # map the voxel block as a read-only array and locate all
+            # atom-tagged voxels (those with int(value) != 0) in one pass
+            voxels = np.memmap(mapName, dtype=np.dtype(struct_fmt), mode='r',
+                               offset=densitystart, shape=(numVoxels,))
+            atomInds, density = findTaggedVoxels(voxels=voxels)
+            del voxels
+            log.writeToLog(str='# voxels in total : {}'.format(numVoxels))
+
+        elif mapType in ('atom_map'):
             atomInds = []
             appendindex = atomInds.append
             counter = -1
@@ -150,6 +89,18 @@ def readMap(dirIn='./', dirOut='./', mapName='untitled.map',
                     appendindex(counter)
             log.writeToLog(str='# voxels in total : {}'.format(counter + 1))
 
+        # gather the density at all atom-tagged voxels in one
+        # vectorised read, aligned to the atom map voxel ordering
+        elif mapType in ('density_map') and vectorised:
+            voxels = np.memmap(mapName, dtype=np.dtype(struct_fmt), mode='r',
+                               offset=densitystart, shape=(numVoxels,))
+            density = np.array(voxels[np.asarray(atomInds)], dtype=np.float32)
+            del voxels
+
+            if len(density) != len(atomInds):
+                error(text='Failure to process the density map ' +
+                           'using atom-tagged map', log=log, type='error')
+
         # efficient way to read through density map file
         # using indices of atoms from atom map file above
         elif mapType in ('density_map'):
@@ -190,20 +141,23 @@ def readMap(dirIn='./', dirOut='./', mapName='untitled.map',
     # guarantee that the max and min voxel values may be non atom voxels and
     # thus removed
     if mapType in ('atom_map'):
-        if max(density) == rho.density['max']:
+        maxDensity = np.max(density)
+        if maxDensity == rho.density['max']:
             log.writeToLog(
                 str='calculated max voxel value match value ' +
                     'stated in file header')
         else:
             error(
                 text='Calculated max voxel value:{} does NOT '.format(
-                    max(density)) +
+                    maxDensity) +
                 'match value stated in file header:{}'.format(
                     rho.density['max']),
                 log=log, type='error')
 
     # if each voxel value is an atom number, then want to convert to integer
-    if mapType in ('atom_map'):
+    if mapType in ('atom_map') and vectorised:
+        density_final = (density // 100).astype(np.int32)
+    elif mapType in ('atom_map'):
         density_final = [int(dens // 100) for dens in density]
     elif mapType in ('density_map'):
         density_final = density
@@ -211,8 +165,10 @@ def readMap(dirIn='./', dirOut='./', mapName='untitled.map',
         error(text='Unknown map type!', log=log, type='error')
 
     # provide option to standardise density to map mean and standard deviation
+    # (in double precision, as for the python floats of the unvectorised read)
     if standardise and mapType in ('density_map'):
-        density_final = (np.array(density_final)-rho.density['mean'])/mapStdev
+        density_final = (np.array(density_final, dtype=np.float64) -
+                         rho.density['mean'])/mapStdev
 
         if fixMaxMapVal != '':
             density_final /= np.max(np.absolute(density_final))
@@ -223,7 +179,8 @@ def readMap(dirIn='./', dirOut='./', mapName='untitled.map',
                         fixMaxMapVal))
             density_final *= fixMaxMapVal
 
-        density_final = density_final.tolist()
+        if not vectorised:
+            density_final = density_final.tolist()
 
     rho.vxls_val = density_final
 
@@ -231,3 +188,112 @@ def readMap(dirIn='./', dirOut='./', mapName='untitled.map',
         return rho, atomInds
     else:
         return rho
+
+
+def readMapHeader(bmf=None, fileSize=0, log=''):
+
+    # read the header of an open .map file 'bmf' (of 'fileSize' bytes)
+    # into a MapInfo object. Returns the MapInfo object, the byte offset
+    # of the voxel block within the file, the map standard deviation and
+    # the number of voxels
+
+    # define 'rho' electron map object
+    rho = MapInfo()
+
+    # start adding header information into MapInfo class format.
+    # Note the unpacking of a struct for each byte, read as a long 'l'
+    for n in ('nx', 'ny', 'nz'):
+        rho.nxyz[n] = unpack('=l', bmf.read(4))[0]
+
+    rho.type = unpack('=l', bmf.read(4))[0]
+
+    for s in ('fast', 'med', 'slow'):
+        rho.start[s] = unpack('=l', bmf.read(4))[0]
+
+    for g in ('1', '2', '3'):
+        rho.gridsamp[g] = unpack('=l', bmf.read(4))[0]
+
+    for d in ('a', 'b', 'c', 'alpha', 'beta', 'gamma'):
+        # cell dims stored as float not long int
+        rho.celldims[d] = unpack('f', bmf.read(4))[0]
+
+    for a in ('fast', 'med', 'slow'):
+        rho.axis[a] = unpack('=l', bmf.read(4))[0]
+
+    for d in ('min', 'max', 'mean'):
+        rho.density[d] = unpack('f', bmf.read(4))[0]
+
+    s = rho.getHeaderInfo(tab=True)
+
+    # write to log file if specified
+    if log != '':
+        if os.path.exists(log.logFile):
+            for l in s.split('\n'):
+                log.writeToLog(l, priority='minor')
+    else:
+        print(s)
+
+    # calculate the last nx*ny*nz bytes of file (corresponding to
+    # the position of the 3D electron density array). Note factor
+    # of 4 is included since 4-byte floats used for electron
+    # density array values.
+
+    numVoxels = reduce(lambda x, y: x*y, list(rho.nxyz.values()))
+    densitystart = fileSize - 4*numVoxels
+
+    # if sys.version_info[0] >= 3:
+    #     import functools
+    #     densitystart = filesize - 4*(functools.reduce(lambda x, y: x*y, list(rho.nxyz.values())))
+    # else:
+    #     densitystart = filesize - 4*(reduce(lambda x, y: x*y, list(rho.nxyz.values())))
+
+    # get symmetry operations from map header
+    for j in range(23, 58):
+        if j != 53 and j < 57:
+
+            if j != 55:
+                val = unpack('=l', bmf.read(4))[0]
+            else:
+                val = unpack('=f', bmf.read(4))[0]
+
+            if j == 24:
+                numSymBytes = val
+
+            if j == 55:
+                mapStdev = round(val, 5)
+
+        elif j < 57:
+            for i in range(4):
+                val = unpack('c', bmf.read(1))[0]
+        else:
+            for i in range(10):
+                for k in range(80):
+                    char = unpack('c', bmf.read(1))[0]
+    symOps = []
+
+    for j in range(numSymBytes // 80):
+        line = ''
+        for k in range(80):
+            char = unpack('=c', bmf.read(1))[0].decode("utf-8")
+            line += char
+        symOps.append(line)
+    rho.curateSymOps(symOps)
+
+    return rho, densitystart, mapStdev, numVoxels
+
+
+def findTaggedVoxels(voxels=[], start=0, chunkSize=tagSearchChunkSize):
+
+    # the linear indices (offset by 'start') and values of the atom-tagged
+    # voxels (those with int(value) != 0) within an array of map voxels.
+    # The voxels are searched in chunks of at most 'chunkSize' voxels
+
+    inds = [np.zeros(0, dtype=np.intp)]
+    vals = [np.zeros(0, dtype=voxels.dtype)]
+    for chunkStart in range(0, len(voxels), chunkSize):
+        chunk = voxels[chunkStart:chunkStart + chunkSize]
+        chunkInds = np.flatnonzero(np.trunc(chunk))
+        inds.append(chunkInds + (start + chunkStart))
+        vals.append(np.array(chunk[chunkInds]))
+
+    return np.concatenate(inds), np.concatenate(vals)
@@ -1,6 +1,8 @@
 from checkDependencies import checkDependencies
 from os import path, makedirs, system
-from PDBFileManipulation import writePDBline
+from PDBFileManipulation import writePDBline, readSpaceGroup
+from mmCIFFileManipulation import isMmCIFfile, writeMmCIFline,\
+    readMmCIFitems, mmCIFdataBlock, mmCIFatomSiteHeader
 from time import gmtime, strftime
 from errors import error
 import numpy as np
@@ -795,29 +797,46 @@ where \(\langle D_\text{neg}\text{(a)}\rangle_{a\in C_\alpha}\) and \(\sigma_{a\
             self.atmsObjs.calcAdditionalMetrics(metric=metric,
                                                 normType=normType)
 
-        pdbIn = open(self.get1stDsetPDB(), 'r')
         pdbTemplate = self.get1stDsetPDB()
-        fileOut = pdbTemplate.replace('.pdb', '') +\
-            '_{}D{}_{}.pdb'.format(normType.replace(" ", ""), metric, dataset)
+
+        # the output is written in the format of the template (pdb or
+        # mmCIF), with the B-factor replaced by the metric values
+        if isMmCIFfile(pdbTemplate):
+            ext, writeLine = '.cif', writeMmCIFline
+        else:
+            ext, writeLine = '.pdb', writePDBline
+
+        fileOut = pdbTemplate.replace(ext, '') +\
+            '_{}D{}_{}{}'.format(normType.replace(" ", ""), metric, dataset,
+                                 ext)
         if singleRes != '':
-            fileOut = fileOut.replace('.pdb', '-{}.pdb'.format(singleRes))
+            fileOut = fileOut.replace(ext, '-{}{}'.format(singleRes, ext))
 
         pdbOut = open(fileOut, 'w')
-        pdbOut.write(
-            'REMARK\tBfactor column replaced by {} D{} metric values\n'.format(
-                normType, metric))
-        for l in pdbIn.readlines():
-            if l.split()[0] in ('CRYST1', 'SCALE1', 'SCALE2', 'SCALE3'):
-                pdbOut.write(l)
-            elif 'ATOM' in l.split()[0]:
-                break
-        pdbIn.close()
+        if ext == '.cif':
+            pdbOut.write(mmCIFdataBlock(
+                fileName=fileOut, items=readMmCIFitems(pdbTemplate)))
+            pdbOut.write(
+                '# Bfactor column replaced by {} D{} metric values\n'.format(
+                    normType, metric))
+            pdbOut.write(mmCIFatomSiteHeader())
+        else:
+            pdbIn = open(pdbTemplate, 'r')
+            pdbOut.write(
+                'REMARK\tBfactor column replaced by {} D{} '.format(
+                    normType, metric) + 'metric values\n')
+            for l in pdbIn.readlines():
+                if l.split()[0] in ('CRYST1', 'SCALE1', 'SCALE2', 'SCALE3'):
+                    pdbOut.write(l)
+                elif 'ATOM' in l.split()[0]:
+                    break
+            pdbIn.close()
 
         if singleRes == '':
             for atm in self.atmsObjs.atomList:
                 dens = atm.densMetric[metric][normType]['values'][dataset]
                 if not np.isnan(dens):
-                    l = writePDBline(atm, dens)
+                    l = writeLine(atm, dens)
                     pdbOut.write(l+'\n')
         else:
             atmDic = self.atmsObjs.getAvMetricPerAtmInRes(
@@ -829,9 +848,9 @@ where \(\langle D_\text{neg}\text{(a)}\rangle_{a\in C_\alpha}\) and \(\sigma_{a\
             for atm in self.atmsObjs.atomList:
                 if atm.residuenum == resNum:
                     dens = atmDic[atm.atomtype]
-                    l = writePDBline(atm, dens)
+                    l = writeLine(atm, dens)
                     pdbOut.write(l+'\n')
-        pdbOut.write('END')
+        pdbOut.write('#\n' if ext == '.cif' else 'END')
         pdbOut.close()
 
     def visualiseDamSites(self,
@@ -979,7 +998,7 @@ where \(\langle D_\text{neg}\text{(a)}\rangle_{a\in C_\alpha}\) and \(\sigma_{a\
         elif isinstance(self.initialPDB, str):
             a = self.initialPDB
 
-        if not a.endswith('.pdb'):
+        if not a.endswith(('.pdb', '.cif')):
             a += '.pdb'
 
         pdbFile = self.inDir + a
@@ -991,12 +1010,9 @@ where \(\langle D_\text{neg}\text{(a)}\rangle_{a\in C_\alpha}\) and \(\sigma_{a\
         # parse the first dataset pdb file and retrieve the space group
 
         pdbFile = self.get1stDsetPDB()
-        pdbin = open(pdbFile, 'r')
-
-        for line in pdbin.readlines():
-            if line.split()[0] == 'CRYST1':
-                self.spaceGroup = line[55:66].replace(' ', '')
-        pdbin.close()
+        spaceGroup = readSpaceGroup(pdbFileName=pdbFile)
+        if spaceGroup is not None:
+            self.spaceGroup = spaceGroup
 
         try:
             self.spaceGroup
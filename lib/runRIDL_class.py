@@ -18,7 +18,11 @@ class process():
                  inputFile='fullInput.txt', makeMaps=True,
                  makeMetrics=False, cleanUpFinalFiles=False,
                  printverboseOutput=False, printOutput=True,
-                 makeSummaryFile=False, keepMapDir=True):
+                 makeSummaryFile=False, keepMapDir=True, numProcesses=1,
+                 numDsetProcesses=1, memLimit=None, cacheSize=0,
+                 saveDsetFiles=False, saveDensSamples=False,
+                 batchDsets=False, streamMaps=False,
+                 sparseAtomMapsOnly=False):
 
         self.inputFile = inputFile
         self.makeMaps = makeMaps
@@ -28,6 +32,15 @@ class process():
         self.printverboseOutput = printverboseOutput
         self.printOutput = printOutput
         self.keepMapDir = keepMapDir
+        self.numProcesses = numProcesses
+        self.numDsetProcesses = numDsetProcesses
+        self.memLimit = memLimit
+        self.cacheSize = cacheSize
+        self.saveDsetFiles = saveDsetFiles
+        self.saveDensSamples = saveDensSamples
+        self.batchDsets = batchDsets
+        self.streamMaps = streamMaps
+        self.sparseAtomMapsOnly = sparseAtomMapsOnly
 
     def setInputFile(self, name):
 
@@ -63,7 +76,14 @@ class process():
             inputFile=self.inputFile, makeMaps=self.makeMaps,
             makeMetrics=self.makeMetrics, makeSummaryFile=self.makeSummaryFile,
             cleanFinalFiles=self.cleanUpFinalFiles, logFileObj=self.logFile,
-            keepMapDir=self.keepMapDir)
+            keepMapDir=self.keepMapDir, numProcesses=self.numProcesses,
+            numDsetProcesses=self.numDsetProcesses, memLimit=self.memLimit,
+            cacheSize=self.cacheSize,
+            saveDsetFiles=self.saveDsetFiles,
+            saveDensSamples=self.saveDensSamples,
+            batchDsets=self.batchDsets,
+            streamMaps=self.streamMaps,
+            sparseAtomMapsOnly=self.sparseAtomMapsOnly)
 
     def printInputFile(self):
 
@@ -1,6 +1,8 @@
 from future import standard_library
 standard_library.install_aliases()
 from progbar import progress
+from columnarFile import writeColumnarFile, columnarFile, isColumnarFile, \
+    atomsToColumns, columnsToAtoms
 
 import sys
 if sys.version_info[0] < 3:
@@ -10,23 +12,24 @@ else:
 
 # small functions to save PDB list of atom objects containing info on
 # each dose level to save running time consuming scripts calculating
-# electron density values to each atom in structure
+# electron density values to each atom in structure. Files are written
+# in a columnar format (see columnarFile), while files in the older
+# pickle format (of name '*_data.pkl') can still be read
 
 
 def save_objectlist(PDBlist, pdbName):
     # to save current PDB list in a file:
-    filename = str(len(PDBlist))+'_'+pdbName+'_data.pkl'
-    with open(filename, 'wb') as output:
-        for atom in PDBlist:
-            pickle.dump(atom, output, pickle.HIGHEST_PROTOCOL)
-    return filename
+    filename = str(len(PDBlist))+'_'+pdbName+'_data.col'
+    columns = {}
+    header = {'atoms': atomsToColumns(atoms=PDBlist, columns=columns)}
+    return writeColumnarFile(filename, columns=columns, header=header)
 
 
 def retrieve_objectlist(fileName='untitled.pkl', loadBar=False, logFile=''):
 
     # this function retrieves a list of objects
     # from a file, given name of form filename =
-    # str(len(PDBlist))+'_'+str(pdbName)+'_data.pkl'
+    # str(len(PDBlist))+'_'+str(pdbName)+'_data.col' (or '_data.pkl')
 
     ln = 'Retrieving dataset from .pkl file...'
     if logFile != '':
@@ -46,6 +49,13 @@ def retrieve_objectlist(fileName='untitled.pkl', loadBar=False, logFile=''):
         print(ln)
 
     # to retrieve list from file to new list:
+    if isColumnarFile(fileName):
+        colFile = columnarFile(fileName, mmap=False)
+        PDBretrieved = columnsToAtoms(colFile=colFile,
+                                      info=colFile.header['atoms'])
+        PDBretrieved.sort(key=lambda x: x.atomnum)
+        return PDBretrieved
+
     PDBretrieved = []
     with open(fileName, 'rb') as input:
         for i in range(0, int(num_atoms)):
@@ -64,7 +74,17 @@ def retrieve_objectlist(fileName='untitled.pkl', loadBar=False, logFile=''):
 
 def saveGenericObject(obj=[], fileName='untitled'):
 
-    # save a generic object to file 'fileName'_data.pkl
+    # save a generic object to file 'fileName'_data.col if the object
+    # has a columnar form (see combinedAtomList.getColumnarState), and
+    # otherwise to file 'fileName'_data.pkl
+
+    if hasattr(obj, 'getColumnarState'):
+        columns = {}
+        header = {'module': type(obj).__module__,
+                  'class': type(obj).__name__,
+                  'state': obj.getColumnarState(columns=columns)}
+        return writeColumnarFile(fileName+'_data.col', columns=columns,
+                                 header=header)
 
     filename = fileName+'_data.pkl'
     with open(filename, 'wb') as output:
@@ -73,7 +93,7 @@ def saveGenericObject(obj=[], fileName='untitled'):
 
 
 def checkFileFormat(fileName):
-    if fileName.split('_')[-1] != 'data.pkl':
+    if fileName.split('_')[-1] not in ('data.col', 'data.pkl'):
         sys.exit('.pkl file of wrong format to retrieve. ' +
                  'File {} supplied'.format(fileName))
 
@@ -82,9 +102,18 @@ def retrieveGenericObject(
                           fileName='untitled.pkl'):
 
     # retrieve a generic object from
-    # file name '{fileName}_data.pkl'
+    # file name '{fileName}_data.col' (or '{fileName}_data.pkl').
+    # Arrays of a columnar file are memory-mapped
 
     checkFileFormat(fileName)
+    if isColumnarFile(fileName):
+        colFile = columnarFile(fileName)
+        header = colFile.header
+        cls = getattr(__import__(str(header['module'])), str(header['class']))
+        obj = cls.__new__(cls)
+        obj.setColumnarState(colFile=colFile, state=header['state'])
+        return obj
+
     with open(fileName, 'rb') as input:
         obj = pickle.load(input)
     return obj
@@ -0,0 +1,218 @@
+from __future__ import division
+import numpy as np
+
+# a small set of segmented (per-group) reductions over a 1d array of
+# values held in a CSR-like layout: values sorted so that each group
+# (typically an atom) occupies a contiguous segment, together with the
+# start offset and length of each segment. This allows per-atom density
+# statistics to be calculated for every atom at once, rather than with
+# a separate set of numpy calls per atom. All segments must be non-empty.
+#
+# The values may also be a 2d array, with one row of values per dataset
+# (all sharing the same segments), in which case every reduction is over
+# the last axis and returns one row of per-segment results per dataset.
+# Each row is reduced exactly as a 1d array of its values would be.
+#
+# Sums (and so means and standard deviations) add the values of each
+# segment in turn (np.add.reduceat), whereas np.mean and np.std use
+# pairwise summation. The results therefore agree with those of numpy
+# for each segment alone only to within rounding (of order 1e-16
+# relative), rather than bit for bit
+
+
+def groupByKey(keys=[]):
+
+    # find the CSR layout for an array of group keys (e.g. atom numbers
+    # per voxel). Returns the stable sort order of the keys, the unique
+    # keys, and the start offset and length of each key's segment within
+    # the sorted order. The stable sort preserves the original ordering
+    # of values within each segment
+
+    keys = np.asarray(keys)
+    order = np.argsort(keys, kind='mergesort')
+    uniqKeys, starts, counts = np.unique(
+        keys[order], return_index=True, return_counts=True)
+
+    return order, uniqKeys, starts, counts
+
+
+def segmentIds(counts=[]):
+
+    # the segment number of each value in a CSR layout
+
+    return np.repeat(np.arange(len(counts)), counts)
+
+
+def sortWithinSegments(vals=[], counts=[]):
+
+    # return the order that sorts values within each segment, leaving
+    # the segments themselves in place. The sort is stable, such that
+    # the first entry of each segment is the first occurrence of the
+    # segment minimum
+
+    vals = np.asarray(vals)
+    segIds = segmentIds(counts)
+    if vals.ndim > 1:
+        segIds = np.broadcast_to(segIds, vals.shape)
+
+    return np.lexsort((vals, segIds))
+
+
+def takeWithinRows(vals=[], order=[]):
+
+    # reorder the values of each row by an order found per row (e.g. by
+    # sortWithinSegments). Equal to vals[order] for 1d values
+
+    vals = np.asarray(vals)
+    if vals.ndim == 1:
+        return vals[order]
+
+    return vals[np.arange(len(vals))[:, np.newaxis], order]
+
+
+def segmentedSum(vals=[], starts=[]):
+
+    # sum of values within each segment
+
+    return np.add.reduceat(vals, starts, axis=-1)
+
+
+def segmentedMean(vals=[], starts=[], counts=[]):
+
+    # mean of values within each segment
+
+    return segmentedSum(vals, starts)/counts
+
+
+def segmentedStd(vals=[], starts=[], counts=[], means=None):
+
+    # population standard deviation of values within each segment,
+    # calculated in two passes (about the per-segment mean)
+
+    if means is None:
+        means = segmentedMean(vals, starts, counts)
+    devs = vals - np.repeat(means, counts, axis=-1)
+
+    return np.sqrt(segmentedSum(devs*devs, starts)/counts)
+
+
+def segmentedMin(vals=[], starts=[]):
+
+    # min of values within each segment
+
+    return np.minimum.reduceat(vals, starts, axis=-1)
+
+
+def segmentedMax(vals=[], starts=[]):
+
+    # max of values within each segment
+
+    return np.maximum.reduceat(vals, starts, axis=-1)
+
+
+def segmentedPercentile(sortedVals=[], starts=[], counts=[], q=50):
+
+    # q-th percentile of values within each segment, using linear
+    # interpolation between the closest ranks (as np.percentile).
+    # 'sortedVals' must already be sorted within each segment
+
+    pos = (q/100.)*(counts - 1)
+    lower = np.floor(pos).astype(np.int64)
+    upper = np.minimum(lower + 1, counts - 1)
+    frac = pos - lower
+    lowerVals = sortedVals[..., starts + lower]
+    upperVals = sortedVals[..., starts + upper]
+
+    return lowerVals + (upperVals - lowerVals)*frac
+
+
+def segmentedMaskedMean(vals=[], mask=[], starts=[], default=0):
+
+    # mean of values within each segment, including only values for
+    # which 'mask' is True. Segments with no such values take 'default'
+
+    num = segmentedSum(mask.astype(np.int64), starts)
+    total = segmentedSum(np.where(mask, vals, 0), starts)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = total/num
+
+    return np.where(num > 0, means, default)
+
+
+class voxelGrouping(object):
+
+    # the CSR grouping of atom-tagged map voxels by atom number. The
+    # stable sort order of the per-voxel atom numbers and the per-atom
+    # segment offsets are found once per atom map, after which any
+    # per-voxel array (density or Fcalc map values) can be grouped by
+    # atom with a single indexed read
+
+    def __init__(self,
+                 keys=[], layout=None):
+
+        # the stable sort order, unique atom numbers and the start offset
+        # and length of each atom's segment within the sorted voxels. These
+        # are found from the per-voxel atom numbers 'keys', unless given
+        # directly as 'layout' (e.g. as held in the file cache)
+        if layout is None:
+            layout = groupByKey(keys)
+        self.order, self.keys, self.starts, self.counts = layout
+
+        # the segment number for each atom number
+        self.segIndex = {k: i for i, k in enumerate(self.keys.tolist())}
+
+    def group(self,
+              vals=[], dtype=np.float64):
+
+        # group a per-voxel array (ordered as the atom-tagged map voxels)
+        # by atom number. Values are held in float64 such that per-atom
+        # statistics are calculated in double precision, as for the
+        # python float lists of the per-atom calculation
+
+        return groupedValues(
+            grouping=self, vals=np.asarray(vals, dtype=dtype)[self.order])
+
+
+class groupedValues(object):
+
+    # per-voxel values held contiguously per atom, following the layout
+    # of a voxelGrouping. Provides read-only dictionary-style access,
+    # keyed by atom number, where each per-atom entry is a zero-copy
+    # slice of the underlying array
+
+    def __init__(self,
+                 grouping=[], vals=[]):
+
+        # the voxelGrouping defining the per-atom segments
+        self.grouping = grouping
+
+        # the grouped per-voxel values
+        self.vals = vals
+
+    def __getitem__(self, key):
+
+        # the values for a single atom number. Raises KeyError for an
+        # atom with no voxels assigned
+
+        i = self.grouping.segIndex[key]
+        start = self.grouping.starts[i]
+
+        return self.vals[start:start + self.grouping.counts[i]]
+
+    def __contains__(self, key):
+        return key in self.grouping.segIndex
+
+    def __len__(self):
+        return len(self.grouping.keys)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return self.grouping.keys.tolist()
+
+    def values(self):
+        return [self[k] for k in self.keys()]
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
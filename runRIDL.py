@@ -52,6 +52,81 @@ parser.add_argument('-c',
                     help='Calculate damage metrics per atom. Will output ' +
                          'csv-format files of metric per atom upon completion')
 
+parser.add_argument('--nproc',
+                    type=int, dest='numProcesses',
+                    action='store', default=1,
+                    help='Number of processes to use when calculating ' +
+                         'per-atom damage metrics with -c (default 1).')
+
+parser.add_argument('--nproc_dsets',
+                    type=int, dest='numDsetProcesses',
+                    action='store', default=1,
+                    help='Number of later-dose datasets to process ' +
+                         'concurrently with -c, when a single atom-tagged ' +
+                         'map is used for the whole series (default 1).')
+
+parser.add_argument('--mem_limit',
+                    type=float, dest='memLimit',
+                    action='store', default=None,
+                    help='Approximate memory budget (in GB) shared between ' +
+                         'datasets processed concurrently with ' +
+                         '--nproc_dsets. Fewer datasets are processed at ' +
+                         'once if required.')
+
+parser.add_argument('--cache_size',
+                    type=float, dest='cacheSize',
+                    action='store', default=0,
+                    help='Keep a cache of parsed maps and coordinate ' +
+                         'files, of at most this size (in GB), such that ' +
+                         'unchanged inputs are not reparsed when -c is ' +
+                         'rerun. The cache is kept in the RIDL-cache/ ' +
+                         'subdirectory of the RIDL-maps/ directory, with ' +
+                         'inputs identified by their content (SHA-1) ' +
+                         'hashes. Off by default (0).')
+
+parser.add_argument('--save_dset_files',
+                    dest='saveDsetFiles', action='store_const',
+                    default=False, const=True,
+                    help='Save the per-atom metrics of each dataset to ' +
+                         'file during -c map processing, such that post ' +
+                         'processing can be rerun from them. By default ' +
+                         'these are passed to post processing in memory.')
+
+parser.add_argument('--batch_dsets',
+                    dest='batchDsets', action='store_const',
+                    default=False, const=True,
+                    help='Calculate the per-atom metrics of all datasets ' +
+                         'together during -c map processing, in batches ' +
+                         'of datasets (limited by --mem_limit if given). ' +
+                         'Requires a single atom-tagged map for the whole ' +
+                         'series.')
+
+parser.add_argument('--stream_maps',
+                    dest='streamMaps', action='store_const',
+                    default=False, const=True,
+                    help='As --batch_dsets, but with all maps read slab ' +
+                         'by slab along the slow axis, such that maps ' +
+                         'larger than the available memory can be ' +
+                         'processed (slab size limited by --mem_limit if ' +
+                         'given).')
+
+parser.add_argument('--save_dens_samples',
+                    dest='saveDensSamples', action='store_const',
+                    default=False, const=True,
+                    help='Save the density values at the atom-tagged ' +
+                         'voxels of every dataset during -c map ' +
+                         'processing, as a single (voxels x datasets) ' +
+                         'matrix in RIDL-metrics/data/. Requires a single ' +
+                         'atom-tagged map for the whole series.')
+
+parser.add_argument('--sparse_atom_maps',
+                    dest='sparseAtomMapsOnly', action='store_const',
+                    default=False, const=True,
+                    help='Remove each dense atom-tagged map (_atoms.map) ' +
+                         'at the end of -p map generation, keeping only ' +
+                         'its sparse form (_atoms_sparse.col), which is ' +
+                         'all that is read by -c.')
+
 parser.add_argument('-t',
                     type=int, dest='template',
                     action='store', default=0,
@@ -99,71 +174,93 @@ parser.add_argument('-v',
                     default=False, const=True,
                     help='Print verbose output to command line.')
 
-args = parser.parse_args()
+# the pipeline is only run when this file is run as a script, and not
+# when it is imported (as by the worker processes of the --nproc and
+# --nproc_dsets process pools where these are started by spawning)
+if __name__ == '__main__':
 
-# check RIDL dependencies are present
-if args.checkDependencies:
-    checkDependencies(checkAll=True)
-    sys.exit()
+    args = parser.parse_args()
 
-# these are here so that they don't interfere with dependency checks
-from rigidBodyRefine import reRefine
-from runRIDL_class import process
+    if args.numProcesses < 1 or args.numDsetProcesses < 1:
+        error(text='Number of processes (--nproc, --nproc_dsets) must be ' +
+                   'at least 1', type='error')
 
-# create a template input file to be filled in manually by the user
-if args.template != 0:
-    p = process(inputFile='templateInputFile.txt')
-    p.writeTemplateInputFile(numHigherDoseDatasets=args.template)
-    print('Can use -j command for help on how to ' +
-          'complete the generated input file')
+    if args.cacheSize < 0:
+        error(text='Cache size (--cache_size) must not be negative',
+              type='error')
 
+    # check RIDL dependencies are present
+    if args.checkDependencies:
+        checkDependencies(checkAll=True)
+        sys.exit()
 
-# call the help information
-if args.inputFileHelp:
-    p = process()
-    p.howToWriteInputFile()
+    # these are here so that they don't interfere with dependency checks
+    from rigidBodyRefine import reRefine
+    from runRIDL_class import process
 
-inputFileToUse = args.inputFile
+    # create a template input file to be filled in manually by the user
+    if args.template != 0:
+        p = process(inputFile='templateInputFile.txt')
+        p.writeTemplateInputFile(numHigherDoseDatasets=args.template)
+        print('Can use -j command for help on how to ' +
+              'complete the generated input file')
 
-# check that the specified input file exists here
-if inputFileToUse is not None:
-    if not os.path.exists(inputFileToUse):
-        error(text='input file "{}" not found'.format(inputFileToUse),
-              type='error')
 
-# decide whether rigid body refinement must be run
-# first to generate higher dose coordinate models
-if args.performRigidBodyRefine:
-    if inputFileToUse is None:
-        error(text='Must specify input file with ' +
-              '-i tag to perform rigid body refinement job',
-              type='error')
-    else:
-        r = reRefine(inputFile=inputFileToUse)
-        inputFileToUse = r.newInputFile
-        if args.makeMaps or args.calcMetrics or args.output:
-            print('\nUsing newly generated RIDL input file ' +
-                  'for remainder of pipeline')
+    # call the help information
+    if args.inputFileHelp:
+        p = process()
+        p.howToWriteInputFile()
+
+    inputFileToUse = args.inputFile
+
+    # check that the specified input file exists here
+    if inputFileToUse is not None:
+        if not os.path.exists(inputFileToUse):
+            error(text='input file "{}" not found'.format(inputFileToUse),
+                  type='error')
+
+    # decide whether rigid body refinement must be run
+    # first to generate higher dose coordinate models
+    if args.performRigidBodyRefine:
+        if inputFileToUse is None:
+            error(text='Must specify input file with ' +
+                  '-i tag to perform rigid body refinement job',
+                  type='error')
         else:
-            print('\nUse this newly generated RIDL input ' +
-                  'file on next RIDL run')
+            r = reRefine(inputFile=inputFileToUse)
+            inputFileToUse = r.newInputFile
+            if args.makeMaps or args.calcMetrics or args.output:
+                print('\nUsing newly generated RIDL input file ' +
+                      'for remainder of pipeline')
+            else:
+                print('\nUse this newly generated RIDL input ' +
+                      'file on next RIDL run')
 
-if args.makeMaps or args.calcMetrics or args.output:
-    # run the pipeline, including generating density and atom-tagged
-    # maps from input pdb and mtz files (in a damage series), as
-    # specified within an input file
+    if args.makeMaps or args.calcMetrics or args.output:
+        # run the pipeline, including generating density and atom-tagged
+        # maps from input pdb and mtz files (in a damage series), as
+        # specified within an input file
 
-    if inputFileToUse is None:
-        print('\nRIDL run error:\nMust specify input file with ' +
-              '-i tag to when using either -p or -c flags')
-        sys.exit()
+        if inputFileToUse is None:
+            print('\nRIDL run error:\nMust specify input file with ' +
+                  '-i tag to when using either -p or -c flags')
+            sys.exit()
 
-    p = process(inputFile=inputFileToUse,
-                makeMaps=args.makeMaps,
-                makeMetrics=args.calcMetrics,
-                cleanUpFinalFiles=args.cleanUpFinalFiles,
-                printverboseOutput=args.verboseOutput,
-                printOutput=args.suppressOutput,
-                makeSummaryFile=args.output,
-                keepMapDir=not args.removeMaps)
-    p.run()
+        p = process(inputFile=inputFileToUse,
+                    makeMaps=args.makeMaps,
+                    makeMetrics=args.calcMetrics,
+                    cleanUpFinalFiles=args.cleanUpFinalFiles,
+                    printverboseOutput=args.verboseOutput,
+                    printOutput=args.suppressOutput,
+                    makeSummaryFile=args.output,
+                    keepMapDir=not args.removeMaps,
+                    numProcesses=args.numProcesses,
+                    numDsetProcesses=args.numDsetProcesses,
+                    memLimit=args.memLimit,
+                    cacheSize=args.cacheSize,
+                    saveDsetFiles=args.saveDsetFiles,
+                    saveDensSamples=args.saveDensSamples,
+                    batchDsets=args.batchDsets,
+                    streamMaps=args.streamMaps,
+                    sparseAtomMapsOnly=args.sparseAtomMapsOnly)
+        p.run()
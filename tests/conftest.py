@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the RIDL modules import each other by name from within lib/ (as set up
+# by runRIDL.py), and so the tests do the same
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'lib'))
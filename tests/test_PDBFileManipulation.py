@@ -0,0 +1,98 @@
+from PDBFileManipulation import PDBtoList, readPDBtable
+from classHolder import PDBtable
+import numpy as np
+import pytest
+
+# ATOM/HETATM records (including insertion codes, negative and large
+# coordinates, an unsigned occupancy, a missing element and lines cut
+# short) among other records, blank lines and short lines
+pdbLines = [
+    'HEADER    HYDROLASE                               01-JAN-00   1ABC',
+    'CRYST1   79.100   79.100   37.900  90.00  90.00  90.00 P 43 21 2',
+    '',
+    'ATOM      1  N   LYS A   1       3.287  10.092  10.329  1.00 15.80' +
+    '           N',
+    'ATOM      2  CA  LYS A   1      -2.445 -10.085 -19.056  0.50 16.13' +
+    '           C',
+    'ANISOU    2  CA  LYS A   1     2015   2103   2009    -17     43    -90' +
+    '       C',
+    'ATOM      3  CB ALYS A  52A   1234.567-999.999   0.000  1.00 10.00' +
+    '           C',
+    'ATOM      4  CB BLYS A  52A      0.001   -.500    5.5   .50 10.00',
+    'TER       5      LYS A  52A',
+    'HETATM    6  O   HOH B 201      -0.100   0.200  -0.300  1.00 30.00',
+    'HETATM 9999 FE   HEM C1001     100.000 -20.125   8.750  1.00  5.25' +
+    '          FE',
+    'ATOM  10000  OXT LYS A   2      1.0     2.0     3.0    1     20',
+    'END',
+    'A',
+]
+
+
+def legacyPDBtoList(pdbFileName=''):
+
+    # the per-line pdb parser replaced by readPDBtable, as a reference.
+    # Each atom is returned as a dictionary of its attributes
+
+    atoms = []
+    with open(pdbFileName, 'r') as pdbin:
+        for line in pdbin.readlines():
+            if ('ATOM' in str(line[0:6])) or ('HETATM' in str(line[0:6])):
+                atoms.append({
+                    'atomnum': int(line[6:11].strip()),
+                    'atomtype': str(line[12:16].strip()),
+                    'basetype': str(line[17:20].strip()),
+                    'chaintype': str(line[21]),
+                    'residuenum': str(line[22:27].strip()),
+                    'X_coord': float(line[30:38].strip()),
+                    'Y_coord': float(line[38:46].strip()),
+                    'Z_coord': float(line[46:54].strip()),
+                    'Occupancy': str(line[54:60].strip()),
+                    'Bfactor': float(line[60:66].strip()),
+                    'atomID': str(line[76:78].strip()),
+                    'atomOrHetatm': str(line[0:6].strip())})
+
+    return atoms
+
+
+@pytest.mark.parametrize('newline', ['\n', '\r\n'])
+@pytest.mark.parametrize('finalNewline', [True, False])
+def test_matches_legacy_parser(tmpdir, newline, finalNewline):
+
+    text = newline.join(pdbLines) + (newline if finalNewline else '')
+    pdbFile = tmpdir.join('test.pdb')
+    pdbFile.write_binary(text.encode('ascii'))
+
+    expected = legacyPDBtoList(str(pdbFile))
+    atoms = PDBtoList(str(pdbFile))
+
+    assert len(atoms) == len(expected) == 7
+    for atom, exp in zip(atoms, expected):
+        for attr, val in exp.items():
+            assert getattr(atom, attr) == val
+            assert type(getattr(atom, attr)) is type(val)
+
+
+def test_table_columns(tmpdir):
+
+    pdbFile = tmpdir.join('test.pdb')
+    pdbFile.write('\n'.join(pdbLines) + '\n')
+    table = readPDBtable(str(pdbFile))
+
+    assert set(table.columns) == set(PDBtable.columnAttrs)
+    np.testing.assert_array_equal(
+        table.columns['residuenum'],
+        ['1', '1', '52A', '52A', '201', '1001', '2'])
+    np.testing.assert_array_equal(
+        table.columns['atomOrHetatm'],
+        ['ATOM']*4 + ['HETATM']*2 + ['ATOM'])
+    assert table.columns['X_coord'].dtype == np.float64
+    assert table.columns['atomnum'].dtype.kind == 'i'
+
+
+def test_no_atoms(tmpdir):
+
+    pdbFile = tmpdir.join('test.pdb')
+    pdbFile.write('\n'.join(pdbLines[:3]) + '\n')
+
+    assert PDBtoList(str(pdbFile)) == []
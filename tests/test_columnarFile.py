@@ -0,0 +1,104 @@
+from __future__ import division
+from savevariables import saveGenericObject, retrieveGenericObject,\
+    save_objectlist, retrieve_objectlist
+from classHolder import singlePDB
+from combinedAtomList import combinedAtomList
+from mapsToDensityMetrics import densMetricAttrs
+import numpy as np
+import pytest
+
+# (residue type, atom type) of the atoms of each test residue
+residueAtoms = [('GLU', 'CD'), ('GLU', 'OE1'), ('CYS', 'SG'), ('ALA', 'CA'),
+                ('HOH', 'O')]
+
+
+def makeDataset(seed=0, numResidues=3):
+
+    # a list of atoms for a single dataset, with random coordinates and
+    # per-atom density metrics
+
+    rng = np.random.RandomState(seed)
+    atoms = []
+    for i in range(numResidues*len(residueAtoms)):
+        resType, atomType = residueAtoms[i % len(residueAtoms)]
+        atom = singlePDB(
+            atomnum=i + 1, residuenum=i//len(residueAtoms) + 1,
+            atomtype=atomType, basetype=resType, chaintype='A',
+            X_coord=rng.normal(), Y_coord=rng.normal(), Z_coord=rng.normal(),
+            Bfactor=20 + rng.normal(), Occupancy=1.0, atomOrHetatm='ATOM')
+        for attr in densMetricAttrs:
+            setattr(atom, attr, rng.normal())
+        atoms.append(atom)
+
+    return atoms
+
+
+def makeCombinedAtomList():
+
+    # a combinedAtomList for a series of three datasets
+
+    atomList = combinedAtomList(
+        datasetList=[makeDataset(seed=d) for d in range(3)],
+        numLigRegDsets=3, doseList=[1.0, 2.0, 3.0],
+        initialPDBList=makeDataset(seed=0), seriesName='test')
+    atomList.getMultiDoseAtomList()
+
+    return atomList
+
+
+@pytest.fixture
+def inTmpDir(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    return tmpdir
+
+
+def atomState(atom=None):
+    return {k: v for k, v in atom.__dict__.items() if k != 'store'}
+
+
+def test_combined_atom_list_round_trip(inTmpDir):
+
+    atomList = makeCombinedAtomList()
+    fileName = saveGenericObject(obj=atomList, fileName='series')
+    loaded = retrieveGenericObject(fileName=fileName)
+
+    assert type(loaded) is combinedAtomList
+    assert loaded.doseList == atomList.doseList
+    assert len(loaded.atomList) == len(atomList.atomList)
+    for atom, loadedAtom in zip(atomList.atomList, loaded.atomList):
+        assert atomState(loadedAtom) == atomState(atom)
+
+    for metric in ('loss', 'mean', 'gain', 'Bfactor'):
+        np.testing.assert_array_equal(
+            loaded.getDensMetricArray(metric=metric, normType='Standard'),
+            atomList.getDensMetricArray(metric=metric, normType='Standard'))
+
+    for atom, loadedAtom in zip(atomList.initialPDBList,
+                                loaded.initialPDBList):
+        assert loadedAtom.__dict__ == atom.__dict__
+
+
+def test_atom_list_round_trip(inTmpDir):
+
+    atoms = makeDataset()
+    fileName = save_objectlist(atoms, 'dataset')
+    loaded = retrieve_objectlist(fileName=fileName)
+
+    assert [a.__dict__ for a in loaded] == [a.__dict__ for a in atoms]
+
+
+def test_constant_lists_not_shared(inTmpDir):
+
+    # list attributes equal for all atoms are stored once, but each
+    # loaded atom holds its own copy
+    atoms = makeDataset()
+    for atom in atoms:
+        atom.flags = ['a', ['b']]
+    fileName = save_objectlist(atoms, 'dataset')
+    loaded = retrieve_objectlist(fileName=fileName)
+
+    loaded[0].flags.append('c')
+    loaded[0].flags[1].append('d')
+    assert loaded[0].flags == ['a', ['b', 'd'], 'c']
+    for atom in loaded[1:]:
+        assert atom.flags == ['a', ['b']]
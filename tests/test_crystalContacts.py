@@ -0,0 +1,237 @@
+from __future__ import division
+from crystalContacts import crystalContacts, readSymOps, parseSymOp,\
+    formatSymOp, combineSymOps, orthogonalisationMatrix
+import itertools
+import numpy as np
+import pytest
+
+# an excerpt of the CCP4 syminfo.lib format, for a triclinic, a
+# centred monoclinic, an orthorhombic and a trigonal space group
+symInfoLines = [
+    '# test excerpt',
+    'begin_spacegroup',
+    'number  1',
+    'basisop x,y,z',
+    'symbol ccp4 1',
+    "symbol Hall ' P 1'",
+    "symbol xHM  'P 1'",
+    "symbol old  'P 1'",
+    'symop x,y,z',
+    'cenop x,y,z',
+    'end_spacegroup',
+    'begin_spacegroup',
+    'number  5',
+    'basisop x,y,z',
+    'symbol ccp4 5',
+    "symbol Hall ' C 2y'",
+    "symbol xHM  'C 1 2 1'",
+    "symbol old  'C 1 2 1' 'C 2'",
+    'symop x,y,z',
+    'symop -x,y,-z',
+    'cenop x,y,z',
+    'cenop x+1/2,y+1/2,z',
+    'end_spacegroup',
+    'begin_spacegroup',
+    'number  19',
+    'basisop x,y,z',
+    'symbol ccp4 19',
+    "symbol Hall ' P 2ac 2ab'",
+    "symbol xHM  'P 21 21 21'",
+    "symbol old  'P 21 21 21'",
+    'symop x,y,z',
+    'symop -x+1/2,-y,z+1/2',
+    'symop x+1/2,-y+1/2,-z',
+    'symop -x,y+1/2,-z+1/2',
+    'cenop x,y,z',
+    'end_spacegroup',
+    'begin_spacegroup',
+    'number  152',
+    'basisop x,y,z',
+    'symbol ccp4 152',
+    "symbol xHM  'P 31 2 1'",
+    "symbol old  'P 31 2 1'",
+    'symop x,y,z',
+    'symop -y,x-y,z+1/3',
+    'symop -x+y,-x,z+2/3',
+    'symop y,x,-z',
+    'symop x-y,-y,-z+2/3',
+    'symop -x,-x+y,-z+1/3',
+    'cenop x,y,z',
+    'end_spacegroup',
+]
+
+# the operators of space group C2 (with centring)
+C2symOps = ['x,y,z', '-x,y,-z', 'x+1/2,y+1/2,z', '-x+1/2,y+1/2,-z']
+
+
+@pytest.fixture
+def symInfoFile(tmpdir):
+    symInfo = tmpdir.join('syminfo.lib')
+    symInfo.write('\n'.join(symInfoLines) + '\n')
+    return str(symInfo)
+
+
+@pytest.mark.parametrize('spaceGroup', ['5', 5, 'C 1 2 1', 'C121', 'C 2',
+                                        'c2', "'C 2'"])
+def test_read_sym_ops(symInfoFile, spaceGroup):
+
+    assert readSymOps(spaceGroup, symInfoFile=symInfoFile) == C2symOps
+
+
+def test_read_sym_ops_other_groups(symInfoFile):
+
+    assert readSymOps('P1', symInfoFile=symInfoFile) == ['x,y,z']
+    assert readSymOps('P212121', symInfoFile=symInfoFile) == \
+        ['x,y,z', '-x+1/2,-y,z+1/2', 'x+1/2,-y+1/2,-z', '-x,y+1/2,-z+1/2']
+    assert len(readSymOps('P 31 2 1', symInfoFile=symInfoFile)) == 6
+
+
+def test_read_sym_ops_not_found(symInfoFile, monkeypatch):
+
+    # an unknown space group (including one listed only by Hall symbol),
+    # or no symmetry library
+    assert readSymOps('P 2 2 2', symInfoFile=symInfoFile) == []
+    assert readSymOps('P 2ac 2ab', symInfoFile=symInfoFile) == []
+
+    monkeypatch.delenv('SYMINFO', raising=False)
+    monkeypatch.delenv('CLIBD', raising=False)
+    assert readSymOps('P1') == []
+
+    monkeypatch.setenv('SYMINFO', symInfoFile)
+    assert readSymOps('C2') == C2symOps
+
+
+def test_parse_sym_op():
+
+    rotation, translation = parseSymOp('-y,X-y,z+1/3')
+    np.testing.assert_array_equal(rotation,
+                                  [[0, -1, 0], [1, -1, 0], [0, 0, 1]])
+    np.testing.assert_array_equal(translation, [0, 0, 1/3])
+
+    rotation, translation = parseSymOp('1/2*x - 1/4, -z, y + 3/4')
+    np.testing.assert_array_equal(rotation,
+                                  [[0.5, 0, 0], [0, 0, -1], [0, 1, 0]])
+    np.testing.assert_array_equal(translation, [-0.25, 0, 0.75])
+
+
+@pytest.mark.parametrize('symOp', ['x,y,z', '-x+1/2,-y,z+1/2',
+                                   '-y,x-y,z+1/3', 'x-y,-y,-z+2/3',
+                                   '1/2*x+1/4,-z,y+3/4'])
+def test_format_sym_op(symOp):
+
+    assert formatSymOp(*parseSymOp(symOp)) == symOp
+
+
+def test_combine_sym_ops():
+
+    assert combineSymOps('-x,y,-z', 'x+1/2,y+1/2,z') == '-x+1/2,y+1/2,-z'
+    # translations are reduced to within a single cell
+    assert combineSymOps('-x+1/2,y,-z', 'x+1/2,y+1/2,z') == '-x,y+1/2,-z'
+
+
+@pytest.mark.parametrize('cell', [[20, 20, 20, 90, 90, 90],
+                                  [25, 18, 30, 90, 105.5, 90],
+                                  [40, 40, 50, 90, 90, 120],
+                                  [15, 22, 31, 71.2, 84.3, 99.6]])
+def test_orthogonalisation_matrix(cell):
+
+    # the columns (cell axes) have the lengths and angles of the cell,
+    # with a along x and b within the xy plane
+    orth = orthogonalisationMatrix(cell)
+    a, b, c = orth.T
+    np.testing.assert_allclose([np.linalg.norm(v) for v in (a, b, c)],
+                               cell[:3])
+
+    def angle(u, v):
+        return np.degrees(np.arccos(np.dot(u, v) /
+                                    (np.linalg.norm(u)*np.linalg.norm(v))))
+
+    np.testing.assert_allclose([angle(b, c), angle(a, c), angle(a, b)],
+                               cell[3:])
+    assert a[1] == a[2] == b[2] == 0
+
+
+def bruteForceContacts(coords=[], cell=[], symOps=[], point=[],
+                       distLimMax=4, distLimMin=0, maxShift=3):
+
+    # every crystal atom within the distance limits of a point, found by
+    # generating all symmetry images over a range of lattice translations.
+    # Returns a dictionary of (atom, operator, translation) to distance
+
+    orth = orthogonalisationMatrix(cell)
+    fracCoords = np.dot(coords, np.linalg.inv(orth).T)
+    contacts = {}
+    for op, symOp in enumerate(symOps):
+        rotation, translation = parseSymOp(symOp)
+        image = np.dot(fracCoords, rotation.T) + translation
+        for shift in itertools.product(range(-maxShift, maxShift + 1),
+                                       repeat=3):
+            shifted = np.dot(image + shift, orth.T)
+            dists = np.sqrt(np.sum((shifted - point)**2, axis=1))
+            for i in np.flatnonzero((dists < distLimMax) &
+                                    (dists > distLimMin)):
+                contacts[(i, op, shift)] = dists[i]
+
+    return contacts
+
+
+@pytest.mark.parametrize('spaceGroup,cell', [
+    ('C 2', [21.3, 17.9, 19.4, 90, 107.3, 90]),
+    ('P 21 21 21', [16.2, 19.8, 23.1, 90, 90, 90]),
+    ('P 31 2 1', [18.7, 18.7, 21.5, 90, 90, 120])])
+def test_matches_brute_force(symInfoFile, spaceGroup, cell):
+
+    rng = np.random.RandomState(0)
+    symOps = readSymOps(spaceGroup, symInfoFile=symInfoFile)
+    orth = orthogonalisationMatrix(cell)
+
+    # model atoms within (and beyond the edges of) the unit cell, with
+    # query points at model atoms and elsewhere
+    coords = np.dot(rng.uniform(-0.1, 1.1, (60, 3)), orth.T)
+    groups = rng.randint(0, 10, len(coords))
+    points = np.vstack([coords[:20],
+                        np.dot(rng.uniform(-0.2, 1.2, (20, 3)), orth.T)])
+    pointGroups = np.append(groups[:20], np.full(20, -1))
+
+    search = crystalContacts(coords=coords, cell=cell, symOps=symOps,
+                             groups=groups)
+    distLimMin, distLimMax = 0.5, 4.5
+    contacts = search.withinDist(points=points, distLimMax=distLimMax,
+                                 distLimMin=distLimMin,
+                                 pointGroups=pointGroups)
+
+    numContacts = 0
+    for point, pointGroup, found in zip(points, pointGroups, contacts):
+        expected = bruteForceContacts(
+            coords=coords, cell=cell, symOps=symOps, point=point,
+            distLimMax=distLimMax, distLimMin=distLimMin)
+        # model atoms (identity, no translation) of the point's group
+        expected = {key: dist for key, dist in expected.items()
+                    if not (key[1] == 0 and key[2] == (0, 0, 0) and
+                            groups[key[0]] == pointGroup)}
+
+        atomInds, opInds, shifts, dists = found
+        keys = [(i, op, tuple(shift)) for i, op, shift in
+                zip(atomInds, opInds, shifts)]
+        assert len(set(keys)) == len(keys)
+        assert set(keys) == set(expected)
+        np.testing.assert_allclose(dists, [expected[k] for k in keys],
+                                   rtol=1e-12)
+        assert np.all(np.diff(dists) >= 0)
+        numContacts += len(keys)
+
+    # the test is not trivially passed
+    assert numContacts > 100
+
+
+def test_no_points_or_atoms():
+
+    search = crystalContacts(coords=np.zeros((0, 3)),
+                             cell=[20, 20, 20, 90, 90, 90], symOps=['x,y,z'])
+    contacts = search.withinDist(points=[[1, 2, 3]])
+    assert len(contacts) == 1
+    assert all(len(c) == 0 for c in contacts[0])
+
+    search = crystalContacts(coords=[[1, 2, 3]],
+                             cell=[20, 20, 20, 90, 90, 90], symOps=['x,y,z'])
+    assert search.withinDist(points=np.zeros((0, 3))) == []
@@ -0,0 +1,241 @@
+from __future__ import division
+from combinedAtomList import combinedAtomList
+from groupedStats import groupedStatsTable, groupedStatNames
+from classHolder import singlePDB
+from mapsToDensityMetrics import densMetricAttrs
+import numpy as np
+import pytest
+import warnings
+
+# tolerance of statistics found from segmented sums (see groupedStats.py)
+# relative to those of the per-group calculation
+rtol = 1e-10
+
+# (residue type, atom type, number of atoms) of each group of test atoms
+atomGroups = [('GLU', 'CD', 40), ('GLU', 'OE1', 12), ('CYS', 'SG', 25),
+              ('ZN', 'ZN', 1), ('ALA', 'CA', 30), ('HOH', 'O', 22),
+              ('LYS', 'NZ', 21)]
+
+
+def makeMetrics(numDsets=3):
+
+    # per-atom (atoms x datasets) 'mean' and 'loss' metric values for the
+    # groups of atomGroups: values of a normal distribution, a group of
+    # fewer than 20 atoms, a constant group, a single atom, values
+    # rounded to a grid (ties, including zeros), an all-positive group
+    # and a group holding a nan value. Atoms absent from a dataset have
+    # nan values for all metrics in that dataset
+
+    rng = np.random.RandomState(0)
+    groupVals = []
+    for resType, atomType, num in atomGroups:
+        vals = rng.normal(0, 1, (num, numDsets))
+        if atomType == 'SG':
+            vals[:] = 0.3
+        elif atomType == 'CA':
+            vals = np.round(vals*2)/2
+        elif atomType == 'O':
+            vals = np.abs(vals) + 0.1
+        elif atomType == 'NZ':
+            vals[4, 0] = np.nan
+        groupVals.append(vals)
+    mean = np.vstack(groupVals)
+    loss = rng.normal(0, 1, mean.shape)
+
+    # atoms absent from later datasets, including every atom of a group
+    absent = np.zeros(mean.shape, dtype=bool)
+    starts = np.cumsum([0] + [num for r, a, num in atomGroups])
+    absent[starts[0]:starts[0] + 5, 2] = True
+    absent[starts[1] + 3:starts[1] + 6, 1] = True
+    absent[starts[2]:starts[2] + 3, 2] = True
+    absent[starts[3], 2] = True
+    mean[absent] = np.nan
+    loss[absent] = np.nan
+
+    return mean, loss
+
+
+@pytest.fixture(scope='module')
+def atomList():
+
+    # a combinedAtomList over three datasets of the atomGroups atoms,
+    # in two chains
+    atoms = []
+    for resType, atomType, num in atomGroups:
+        for i in range(num):
+            atoms.append(singlePDB(
+                atomnum=len(atoms) + 1, residuenum=len(atoms) + 1,
+                atomtype=atomType, basetype=resType,
+                chaintype='AB'[len(atoms) % 2], atomOrHetatm='ATOM'))
+    mean, loss = makeMetrics()
+    metrics = {attr: np.zeros(mean.shape) for attr in densMetricAttrs}
+    metrics.update({'meandensity': mean, 'mindensity': loss})
+
+    atomList = combinedAtomList(datasetList=[atoms], numLigRegDsets=3,
+                                doseList=[1.0, 2.0, 3.0],
+                                initialPDBList=atoms, seriesName='test')
+    atomList.getMultiDoseAtomListFromMetrics(
+        atoms=atoms, metrics=metrics)
+
+    return atomList
+
+
+def legacyGetStats(atomList=None, metric='mean', normType='Standard',
+                   dataset=0, dic={}):
+
+    # the per-group stats of combinedAtomList.getStats before these were
+    # found for all groups together, as a reference. Two changes are made
+    # such that the reference is defined where the per-group calculation
+    # was not:
+    # - for groups of zero variance, the skew and kurtosis are 0 and -3
+    #   (as by the pinned scipy 1.1.0), where newer scipy versions give
+    #   nan
+    # - for groups holding nan values, the number of outliers is nan
+    #   (np.histogram raises a ValueError), and the asymmetry score and
+    #   normality test (nan) are undefined ('N/A' and 'n/a')
+
+    getStatsPerKey = {}
+    for k in list(dic.keys()):
+        m = list(atomList.getDensMetricArray(
+            metric=metric, normType=normType, atoms=dic[k])[:, dataset])
+        hasNan = np.any(np.isnan(m))
+        statsDic = {}
+        statsDic['#atoms'] = len(m)
+        statsDic['mean'] = np.mean(m)
+        statsDic['std'] = np.std(m)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            statsDic['skew'] = atomList.calculateSkew(metricList=m)
+            statsDic['kurtosis'] = atomList.calculateKurtosis(metricList=m)
+            statsDic['normality'] = atomList.testForNormality(metricList=m)
+        if not hasNan and np.isnan(statsDic['skew']):
+            statsDic['skew'], statsDic['kurtosis'] = 0, -3
+        statsDic['asymmetry score'] = atomList.calcAsymmetryAboutZero(vals=m)
+        try:
+            statsDic['outliers'] = atomList.calcNumOutliers(
+                metricList=m, metric=metric, normType=normType)
+        except ValueError:
+            statsDic['outliers'] = np.nan
+        if hasNan:
+            statsDic['asymmetry score'] = 'N/A'
+            statsDic['normality'] = 'n/a'
+        statsDic['returnOrder'] = ['mean', 'std', '#atoms', 'outliers',
+                                   'skew', 'kurtosis', 'asymmetry score']
+        getStatsPerKey[k] = statsDic
+
+    return getStatsPerKey
+
+
+def groupAtoms(atomList=None, groupBy='atomtype', dataset=0,
+               presentOnly=True):
+
+    # the atoms of atomList by group, in order of first atom, including
+    # only the atoms present within a dataset if 'presentOnly'
+
+    groupOf = {'atomtype': lambda a: '-'.join([a.basetype, a.atomtype]),
+               'residue': lambda a: a.basetype,
+               'chain': lambda a: a.chaintype}[groupBy]
+    loss = atomList.getDensMetricArray(metric='loss', normType='Standard')
+    groups = {}
+    keys = []
+    for atom, present in zip(atomList.atomList, ~np.isnan(loss[:, dataset])):
+        if present or not presentOnly:
+            if groupOf(atom) not in groups:
+                keys.append(groupOf(atom))
+            groups.setdefault(groupOf(atom), []).append(atom)
+
+    return keys, groups
+
+
+def assertStatsEqual(stats={}, expected={}):
+
+    assert set(stats) == set(expected)
+    for key in expected:
+        for stat, val in expected[key].items():
+            got = stats[key][stat]
+            if isinstance(val, str) or stat in ('#atoms', 'returnOrder'):
+                assert got == val, (key, stat)
+            else:
+                np.testing.assert_allclose(got, val, rtol=rtol, atol=1e-12,
+                                           err_msg='{} {}'.format(key, stat))
+
+
+@pytest.mark.parametrize('dataset', [0, 1, 2])
+def test_get_stats_matches_legacy(atomList, dataset):
+
+    # all atoms of each group, including those absent from the dataset
+    # (nan values)
+    keys, dic = groupAtoms(atomList=atomList, dataset=dataset,
+                           presentOnly=False)
+    expected = legacyGetStats(atomList=atomList, dataset=dataset, dic=dic)
+    stats = atomList.getStats(metric='mean', dataset=dataset, dic=dic)
+
+    assertStatsEqual(stats=stats, expected=expected)
+    assert list(stats) == keys
+
+
+@pytest.mark.parametrize('groupBy', ['atomtype', 'residue', 'chain'])
+@pytest.mark.parametrize('dataset', [0, 1, 2])
+def test_grouped_stats_matches_legacy(atomList, groupBy, dataset):
+
+    # only the atoms present within the dataset, in groups ordered by
+    # first atom. A group with no atoms present (ZN in dataset 2) is
+    # not included
+    keys, dic = groupAtoms(atomList=atomList, groupBy=groupBy,
+                           dataset=dataset)
+    expected = legacyGetStats(atomList=atomList, dataset=dataset, dic=dic)
+    stats = atomList.getGroupedStats(metric='mean', dataset=dataset,
+                                     groupBy=groupBy)
+
+    assertStatsEqual(stats=stats, expected=expected)
+    assert list(stats) == keys
+    znKey = {'atomtype': 'ZN-ZN', 'residue': 'ZN'}.get(groupBy)
+    if znKey is not None:
+        assert (znKey in stats) == (dataset != 2)
+
+
+def test_undefined_stats(atomList):
+
+    # the statistics that are undefined for the test groups
+    stats = atomList.getGroupedStats(metric='mean', dataset=0)
+
+    assert stats['ZN-ZN']['#atoms'] == 1
+    assert stats['ZN-ZN']['std'] == 0
+    assert stats['CYS-SG']['skew'] == 0
+    assert stats['CYS-SG']['kurtosis'] == -3
+    assert stats['HOH-O']['asymmetry score'] == 'N/A'
+    assert stats['GLU-OE1']['normality'] == 'n/a'
+    assert stats['GLU-CD']['normality'] != 'n/a'
+    assert np.isnan(stats['LYS-NZ']['mean'])
+    assert np.isnan(stats['LYS-NZ']['outliers'])
+
+
+def test_table_datasets(atomList):
+
+    # the stats of every dataset together are those of each dataset alone
+    table = atomList.getGroupedStatsTable(metric='mean', groupBy='residue')
+    for d in range(3):
+        single = atomList.getGroupedStatsTable(
+            metric='mean', groupBy='residue', datasets=[d])
+        assert single['keys'] == table['keys']
+        for stat in groupedStatNames + ['normality', 'firstAtom']:
+            np.testing.assert_array_equal(single[stat][:, 0],
+                                          table[stat][:, d], err_msg=stat)
+
+
+def test_empty_groups():
+
+    # groups without atoms (or with no atoms present) have no stats
+    vals = np.arange(6, dtype=np.float64).reshape(3, 2)
+    present = np.array([[True, False], [True, False], [False, True]])
+    table = groupedStatsTable(vals=vals, present=present,
+                              groupCodes=[0, 0, 2], numGroups=4)
+
+    np.testing.assert_array_equal(table['#atoms'],
+                                  [[2, 0], [0, 0], [0, 1], [0, 0]])
+    np.testing.assert_array_equal(table['mean'][:, 0],
+                                  [1, np.nan, np.nan, np.nan])
+    np.testing.assert_array_equal(table['mean'][:, 1],
+                                  [np.nan, np.nan, 5, np.nan])
+    np.testing.assert_array_equal(table['firstAtom'],
+                                  [[0, 3], [3, 3], [3, 2], [3, 3]])
@@ -0,0 +1,237 @@
+from PDBFileManipulation import PDBtoList, readPDBtable, writePDBline,\
+    renumberPDBFile
+from mmCIFFileManipulation import readMmCIFtable, readMmCIFunitCell,\
+    readMmCIFspaceGroup, renumberMmCIFFile, mmCIFdataBlock,\
+    mmCIFatomSiteHeader, writeMmCIFline
+from classHolder import singlePDB
+import numpy as np
+import pytest
+
+# the attributes written to (and read back from) both file formats
+roundTripAttrs = ['atomnum', 'atomtype', 'basetype', 'chaintype',
+                  'residuenum', 'X_coord', 'Y_coord', 'Z_coord', 'atomID']
+
+# an _atom_site loop (with unknown and quoted values, an insertion code,
+# a text field value within a row and a row split across lines) between
+# single items including a text field
+cifLines = [
+    'data_test',
+    '_cell.length_a 79.100',
+    '_cell.length_b 79.100',
+    '_cell.length_c 37.900',
+    '_cell.angle_alpha 90.00',
+    '_cell.angle_beta 90.00',
+    '_cell.angle_gamma 90.00',
+    "_symmetry.space_group_name_H-M 'P 43 21 2'",
+    '_struct.title',
+    ';Lines of a text field, including',
+    'loop_',
+    '_atom_site.id 99',
+    ';',
+    'loop_',
+    '_atom_site.group_PDB',
+    '_atom_site.id',
+    '_atom_site.type_symbol',
+    '_atom_site.label_atom_id',
+    '_atom_site.label_comp_id',
+    '_atom_site.label_asym_id',
+    '_atom_site.label_seq_id',
+    '_atom_site.pdbx_PDB_ins_code',
+    '_atom_site.Cartn_x',
+    '_atom_site.Cartn_y',
+    '_atom_site.Cartn_z',
+    '_atom_site.occupancy',
+    '_atom_site.B_iso_or_equiv',
+    '_atom_site.details',
+    'ATOM 10 N N LYS A 1 ? 3.287 10.092 10.329 1.00 15.80 .',
+    'ATOM 20 C CA LYS A 1 ? -2.445 -10.085 -19.056 ? 16.13 .',
+    'ATOM 30 C CB LYS A 52 A 1234.567 -999.999 0.000 0.50 10.00',
+    ';a text field',
+    'value',
+    ';',
+    'HETATM 40 O O HOH B 201 ? -0.100 0.200',
+    "-0.300 . 30.00 'quoted value'",
+    '#',
+    'loop_',
+    '_pdbx_poly_seq_scheme.seq_id',
+    '1',
+]
+
+
+@pytest.fixture
+def atoms():
+
+    # atoms with values within the limits of pdb format
+    rng = np.random.RandomState(0)
+    residues = [('LYS', 'A', '1'), ('LYS', 'A', '52A'), ('HOH', 'B', '-3'),
+                ('FE2', 'C', '1001')]
+    atoms = []
+    for i, (resType, chain, resNum) in enumerate(residues*2):
+        atoms.append(singlePDB(
+            atomnum=i + 1, atomtype=['N', 'CA', 'O', 'FE'][i % 4],
+            basetype=resType, chaintype=chain, residuenum=resNum,
+            X_coord=np.round(rng.uniform(-999, 9999), 3),
+            Y_coord=np.round(rng.uniform(-999, 9999), 3),
+            Z_coord=np.round(rng.uniform(-999, 9999), 3),
+            Bfactor=np.round(rng.uniform(0, 999), 2), Occupancy=1.0,
+            atomID=['N', 'C', 'O', 'FE'][i % 4], atomOrHetatm='ATOM'))
+
+    return atoms
+
+
+def writeCif(tmpdir, lines=[]):
+    cifFile = tmpdir.join('test.cif')
+    cifFile.write('\n'.join(lines) + '\n')
+    return str(cifFile)
+
+
+def assertAtomsEqual(atoms=[], expected=[], attrs=roundTripAttrs):
+    assert len(atoms) == len(expected)
+    for atom, exp in zip(atoms, expected):
+        for attr in attrs:
+            assert getattr(atom, attr) == getattr(exp, attr), attr
+
+
+def test_pdb_writer_round_trip(tmpdir, atoms):
+
+    pdbFile = tmpdir.join('test.pdb')
+    pdbFile.write(''.join(writePDBline(atom, atom.Bfactor) + '\n'
+                          for atom in atoms))
+    loaded = PDBtoList(str(pdbFile))
+
+    assertAtomsEqual(loaded, atoms, roundTripAttrs + ['Bfactor'])
+    assert all(atom.Occupancy == '1.00' for atom in loaded)
+
+
+def test_mmcif_writer_round_trip(tmpdir, atoms):
+
+    items = [('_cell.length_a', '79.1'), ('_cell.length_b', '79.1'),
+             ('_cell.length_c', '37.9'), ('_cell.angle_alpha', '90'),
+             ('_cell.angle_beta', '90'), ('_cell.angle_gamma', '90'),
+             ('_symmetry.space_group_name_H-M', "'P 43 21 2'")]
+    cifFile = tmpdir.join('test.cif')
+    cifFile.write(mmCIFdataBlock(str(cifFile), items=items) +
+                  mmCIFatomSiteHeader() +
+                  ''.join(writeMmCIFline(atom, atom.Bfactor) + '\n'
+                          for atom in atoms))
+    loaded = PDBtoList(str(cifFile))
+
+    assertAtomsEqual(loaded, atoms, roundTripAttrs + ['Bfactor'])
+    assert all(atom.Occupancy == 1.0 for atom in loaded)
+    assert readMmCIFunitCell(str(cifFile)) == [79.1, 79.1, 37.9, 90, 90, 90]
+    assert readMmCIFspaceGroup(str(cifFile)) == 'P43212'
+
+
+def test_formats_agree(tmpdir, atoms):
+
+    # the same atoms written in both formats are read identically
+    pdbFile = tmpdir.join('test.pdb')
+    pdbFile.write(''.join(writePDBline(atom, atom.Bfactor) + '\n'
+                          for atom in atoms))
+    cifFile = tmpdir.join('test.cif')
+    cifFile.write(mmCIFdataBlock(str(cifFile)) + mmCIFatomSiteHeader() +
+                  ''.join(writeMmCIFline(atom, atom.Bfactor) + '\n'
+                          for atom in atoms))
+
+    pdbTable = readPDBtable(str(pdbFile))
+    cifTable = readPDBtable(str(cifFile))
+    for attr, vals in pdbTable.columns.items():
+        if attr == 'Occupancy':
+            vals = vals.astype(np.float64)
+        np.testing.assert_array_equal(cifTable.columns[attr], vals,
+                                      err_msg=attr)
+
+
+def test_read_mmcif(tmpdir):
+
+    table = readMmCIFtable(writeCif(tmpdir, cifLines))
+
+    np.testing.assert_array_equal(table.columns['atomnum'],
+                                  [10, 20, 30, 40])
+    np.testing.assert_array_equal(table.columns['residuenum'],
+                                  ['1', '1', '52A', '201'])
+    np.testing.assert_array_equal(table.columns['atomOrHetatm'],
+                                  ['ATOM']*3 + ['HETATM'])
+    np.testing.assert_array_equal(table.columns['Z_coord'],
+                                  [10.329, -19.056, 0.0, -0.3])
+
+    # unknown ('?') and inapplicable ('.') occupancies are read as nan
+    occupancy = table.columns['Occupancy']
+    assert occupancy.dtype == np.float64
+    np.testing.assert_array_equal(occupancy, [1.0, np.nan, 0.5, np.nan])
+    assert readMmCIFunitCell(writeCif(tmpdir, cifLines)) == \
+        [79.1, 79.1, 37.9, 90, 90, 90]
+
+
+def test_missing_occupancy(tmpdir):
+
+    lines = ['data_test', 'loop_', '_atom_site.group_PDB', '_atom_site.id',
+             '_atom_site.type_symbol', '_atom_site.label_atom_id',
+             '_atom_site.label_comp_id', '_atom_site.label_asym_id',
+             '_atom_site.label_seq_id', '_atom_site.Cartn_x',
+             '_atom_site.Cartn_y', '_atom_site.Cartn_z',
+             '_atom_site.B_iso_or_equiv',
+             'ATOM 1 N N LYS A 1 3.287 10.092 10.329 15.80',
+             'ATOM 2 C CA LYS A 1 -2.445 -10.085 -19.056 ?']
+    table = readMmCIFtable(writeCif(tmpdir, lines))
+
+    np.testing.assert_array_equal(table.columns['Occupancy'], [1.0, 1.0])
+    np.testing.assert_array_equal(table.columns['Bfactor'], [15.8, np.nan])
+
+
+@pytest.mark.parametrize('atomRange', [None, (2, 3)])
+def test_renumber_mmcif(tmpdir, atomRange):
+
+    cifFile = writeCif(tmpdir, cifLines)
+    outFile = str(tmpdir.join('renumbered.cif'))
+    counter = renumberMmCIFFile(cifFile, outFile, atomRange=atomRange)
+
+    original = readMmCIFtable(cifFile)
+    if atomRange is not None:
+        original = original.take(np.arange(atomRange[0] - 1, atomRange[1]))
+    renumbered = readMmCIFtable(outFile)
+
+    assert counter == len(original)
+    np.testing.assert_array_equal(renumbered.columns['atomnum'],
+                                  np.arange(1, counter + 1))
+    for attr, vals in original.columns.items():
+        if attr != 'atomnum':
+            np.testing.assert_array_equal(renumbered.columns[attr], vals,
+                                          err_msg=attr)
+
+    # all lines outside the _atom_site loop body are copied unchanged,
+    # including the text field of a single item
+    with open(outFile, 'r') as cifin:
+        text = cifin.read()
+    start = cifLines.index('ATOM 10 N N LYS A 1 ? 3.287 10.092 10.329 ' +
+                           '1.00 15.80 .')
+    assert text.startswith('\n'.join(cifLines[:start]) + '\n')
+    assert text.endswith('\n'.join(cifLines[cifLines.index('#'):]) + '\n')
+    assert ';a text field\nvalue\n;' in text
+
+
+def test_renumber_incomplete_row(tmpdir):
+
+    # a row cut short, followed by another loop or the end of the file
+    end = cifLines.index('#')
+    for lines in (cifLines[:end - 1] + cifLines[end + 1:],
+                  cifLines[:end - 1]):
+        with pytest.raises(ValueError):
+            renumberMmCIFFile(writeCif(tmpdir, lines),
+                              str(tmpdir.join('renumbered.cif')))
+
+
+def test_renumber_pdb(tmpdir, atoms):
+
+    pdbFile = tmpdir.join('test.pdb')
+    pdbFile.write('CRYST1   79.100   79.100   37.900  90.00  90.00  90.00' +
+                  ' P 43 21 2\n' +
+                  ''.join(writePDBline(atom, atom.Bfactor) + '\n'
+                          for atom in atoms[::-1]) + 'END\n')
+    outFile = str(tmpdir.join('renumbered.pdb'))
+
+    assert renumberPDBFile(str(pdbFile), outFile, atomRange=(2, 4)) == 3
+    renumbered = PDBtoList(outFile)
+    assertAtomsEqual(renumbered, atoms[-2:-5:-1],
+                     [a for a in roundTripAttrs if a != 'atomnum'])
+    assert [atom.atomnum for atom in renumbered] == [1, 2, 3]
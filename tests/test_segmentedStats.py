@@ -0,0 +1,162 @@
+from __future__ import division
+from mapsToDensityMetrics import maps2DensMetrics, calcSegmentMetrics,\
+    densMetricAttrs
+from segmentedStats import voxelGrouping, sortWithinSegments,\
+    takeWithinRows, segmentedPercentile
+from classHolder import singlePDB
+import numpy as np
+import pytest
+
+# the segmented sums (np.add.reduceat) add the values of each atom in
+# turn, whereas np.mean and np.std within the per-atom calculation use
+# pairwise summation, and so the two agree only to within rounding
+rtol = 1e-12
+atol = 1e-12
+
+# the Fcalc-weighted metrics, only found where an Fcalc map is used
+FCmetricAttrs = ['densityWeightedMean', 'densityWeightedMin',
+                 'densityWeightedMax', 'fracOfMaxAtomDensAtMin',
+                 'densityWeightedMeanPosOnly', 'densityWeightedMeanNegOnly']
+
+
+def makeVoxels(seed=0, numAtoms=60):
+
+    # per-voxel atom numbers (in map order), density and Fcalc values
+    # for atoms of between 1 and 40 voxels, including atoms with only
+    # positive or only negative density, repeated (tied) values and
+    # atoms with no positive Fcalc density
+
+    rng = np.random.RandomState(seed)
+    atomNums = np.arange(1, numAtoms + 1)
+    counts = rng.randint(1, 41, size=numAtoms)
+    counts[:3] = 1
+    keys = np.repeat(atomNums, counts)
+    vals = rng.normal(0, 1, len(keys))
+    FCvals = rng.normal(0.5, 1, len(keys))
+
+    vals[keys == 4] = np.abs(vals[keys == 4])
+    vals[keys == 5] = -np.abs(vals[keys == 5])
+    vals[keys == 6] = np.round(vals[keys == 6])
+    vals[keys == 7] = 0.25
+    FCvals[keys == 8] = -np.abs(FCvals[keys == 8])
+
+    order = rng.permutation(len(keys))
+
+    return keys[order], vals[order], FCvals[order]
+
+
+def makeMetricCalc(keys=[], vals=[], FCvals=None, atomNums=[]):
+
+    # a maps2DensMetrics object for the voxels and atoms given, as after
+    # reading the atom-tagged, density and Fcalc maps
+
+    calc = maps2DensMetrics.__new__(maps2DensMetrics)
+    calc.log = ''
+    calc.doXYZanalysis = False
+    calc.calcFCmap = FCvals is not None
+    calc.vxlGrouping = voxelGrouping(keys=keys)
+    calc.vxlsPerAtom = calc.vxlGrouping.group(vals)
+    if FCvals is not None:
+        calc.FCperAtom = calc.vxlGrouping.group(FCvals)
+    calc.PDBarray = [singlePDB(atomnum=n) for n in atomNums]
+
+    return calc
+
+
+@pytest.mark.parametrize('useFC', [False, True])
+def test_matches_per_atom_metrics(useFC):
+
+    keys, vals, FCvals = makeVoxels()
+    if not useFC:
+        FCvals = None
+    atomNums = np.unique(keys)
+
+    legacy = makeMetricCalc(keys=keys, vals=vals, FCvals=FCvals,
+                            atomNums=atomNums)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for atom in legacy.PDBarray:
+            legacy.calcDensMetricsForAtom(atom=atom)
+            atom.getAdditionalMetrics()
+
+    new = makeMetricCalc(keys=keys, vals=vals, FCvals=FCvals,
+                         atomNums=atomNums)
+    new.calcDensMetricsAllAtoms()
+
+    attrs = [a for a in densMetricAttrs if useFC or a not in FCmetricAttrs]
+    for attr in attrs:
+        np.testing.assert_allclose(
+            [getattr(atom, attr) for atom in new.PDBarray],
+            [getattr(atom, attr) for atom in legacy.PDBarray],
+            rtol=rtol, atol=atol, err_msg=attr)
+
+
+def test_atom_without_voxels():
+
+    # an atom with no voxels is treated as having a single nan voxel, as
+    # within the per-atom calculation
+
+    keys, vals, FCvals = makeVoxels()
+    atomNums = np.append(np.unique(keys), keys.max() + 1)
+    calc = makeMetricCalc(keys=keys, vals=vals, FCvals=FCvals,
+                          atomNums=atomNums)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        calc.calcDensMetricsAllAtoms()
+
+    atom = calc.PDBarray[-1]
+    assert np.isnan(atom.meandensity)
+    assert np.isnan(atom.densityWeightedMean)
+    assert atom.numvoxels == 1
+    assert atom.meanPosOnly == 0
+    assert atom.meanNegOnly == 0
+    assert not np.isnan(calc.PDBarray[-2].meandensity)
+
+
+def test_no_atoms():
+
+    counts = np.zeros(0, dtype=np.int64)
+    metrics = calcSegmentMetrics(vxls=np.zeros(0), FCvals=np.zeros(0),
+                                 counts=counts)
+
+    assert set(metrics) == set(densMetricAttrs) - {'rsddensity',
+                                                   'rangedensity'}
+    for name in metrics:
+        assert metrics[name].shape == (0,)
+
+
+def test_datasets_as_rows():
+
+    # each row of a (datasets x voxels) array is reduced exactly as the
+    # values of that dataset alone
+
+    keys, vals, FCvals = makeVoxels()
+    grouping = voxelGrouping(keys=keys)
+    rng = np.random.RandomState(1)
+    rows = np.vstack([grouping.group(vals).vals,
+                      rng.normal(0, 1, len(vals)),
+                      np.round(rng.normal(0, 1, len(vals)))])
+    grpFCvals = grouping.group(FCvals).vals
+
+    metrics = calcSegmentMetrics(vxls=rows, FCvals=grpFCvals,
+                                 counts=grouping.counts)
+    for d, row in enumerate(rows):
+        rowMetrics = calcSegmentMetrics(vxls=row, FCvals=grpFCvals,
+                                        counts=grouping.counts)
+        for name in rowMetrics:
+            np.testing.assert_array_equal(metrics[name][d], rowMetrics[name],
+                                          err_msg=name)
+
+
+@pytest.mark.parametrize('q', [0, 5, 10, 25, 50, 90, 95, 100])
+def test_percentile(q):
+
+    # segments of 1, 2 and 3 values, tied values and a larger segment
+    segments = [[1.5], [2., -1.], [3., 3., -3.], [0., 0.],
+                list(np.random.RandomState(2).normal(0, 1, 101))]
+    vals = np.concatenate(segments)
+    counts = np.array([len(s) for s in segments])
+    starts = np.cumsum(counts) - counts
+    srtVals = takeWithinRows(vals, sortWithinSegments(vals, counts))
+
+    np.testing.assert_allclose(
+        segmentedPercentile(srtVals, starts, counts, q=q),
+        [np.percentile(s, q) for s in segments], rtol=1e-15, atol=1e-15)